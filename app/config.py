@@ -103,6 +103,17 @@ config['momentum.fatcatmap.data'] = {
 
 }
 
+# Entity Caching Configuration
+config['momentum.fatcatmap.data.caching'] = {
+
+	'debug': False, ## Log cache hit/miss counts
+	'instance_max_size': 2000, ## Max entities held in instance memory
+	'instance_ttl': 300, ## Seconds an entity lives in instance memory
+	'enable_memcache': True, ## Use memcache as the second-level cache
+	'memcache_ttl': 3600 ## Seconds an entity lives in memcache
+
+}
+
 # API Configuration
 config['momentum.fatcatmap.api'] = {
 
@@ -111,9 +122,19 @@ config['momentum.fatcatmap.api'] = {
     ## API Modules
     'modules':{
 
-        'ajax':{'enabled':False},
+        'ajax':{'enabled':True, 'methods':{
+
+            'search': ['momentum','fatcatmap','api','ajax','search','SearchAction'],
+            'autocomplete': ['momentum','fatcatmap','api','ajax','autocomplete','AutocompleteAction'],
+
+        }},
         'data':{'enabled':True},
-        'graph':{'enabled':False},
+        'graph':{'enabled':True, 'methods':{
+
+            'query': ['momentum','fatcatmap','api','graph','query','QueryAction'],
+            'paths': ['momentum','fatcatmap','api','graph','paths','PathsAction'],
+
+        }},
         'media':{'enabled':False},
         'platform':{'enabled':False},
         'work':{'enabled':False}
@@ -266,6 +287,253 @@ config['momentum.fatcatmap.workers.indexer'] = {
 
 }
 
+# External Service Response Caching
+config['momentum.fatcatmap.services.caching'] = {
+
+	'debug': False, ## Log cache hits, misses and refreshes
+	'enable_datastore': True, ## Persist responses as ExtInteraction entities (second tier, survives memcache eviction)
+	'memcache_ttl': 3600, ## Seconds a response lives in memcache
+	'default_ttl': 86400, ## Seconds a response stays fresh, for methods not listed below
+	'max_stale': 604800, ## Seconds past expiry a response may still be served if the upstream call fails
+
+	## Per-method freshness, in seconds
+	'ttls': {
+
+		'sunlight': {
+
+			'legislators.get': 86400,
+			'legislators.getList': 86400,
+			'legislators.search': 3600,
+			'committees.get': 604800,
+			'committees.getList': 604800,
+			'committees.allForLegislator': 604800,
+			'districts.getDistrictsFromZip': 2592000,
+			'districts.getZipsFromDistrict': 2592000,
+			'districts.getDistrictFromLatLong': 2592000
+
+		},
+
+		'opensecrets': {
+
+			'candSummary': 604800,
+			'candContrib': 604800,
+			'candIndustry': 604800,
+			'candSector': 604800,
+			'CandIndByInd': 604800,
+			'memTravelTrips': 604800
+
+		}
+
+	}
+
+}
+
+# External Service Fetching
+config['momentum.fatcatmap.services.fetch'] = {
+
+	'max_concurrency': 10, ## Max concurrent requests per batch client
+	'deadline': 10, ## urlfetch deadline, in seconds
+	'default_rate_limit': (1, 1), ## (requests per second, burst) for services not listed below
+
+	## Per-service (requests per second, burst), shared by every client in an instance
+	'rate_limits': {
+
+		'sunlight': (10, 20),
+		'opensecrets': (2, 5)
+
+	}
+
+}
+
+# External Service API Keys
+config['momentum.fatcatmap.services.keys'] = {
+
+	'default_strategy': 'round_robin', ## How keys are picked: 'round_robin', or 'quota' (most remaining daily quota first)
+	'reload_interval': 300, ## Seconds an instance keeps its copy of a service's keys
+	'flush_interval': 60, ## Seconds between writes of key usage to the sharded counters
+	'flush_threshold': 100, ## ...or after this many uses, whichever comes first
+	'default_rate_limit': (1, 1), ## (requests per second, burst) per key, for services not listed below
+
+	## Per-service key selection strategy
+	'strategies': {
+
+		'opensecrets': 'quota'
+
+	},
+
+	## Per-service (requests per second, burst), for each key
+	'rate_limits': {
+
+		'sunlight': (10, 20),
+		'opensecrets': (2, 5)
+
+	}
+
+}
+
+# Entity Resolution (duplicate contributors - see core.graph.resolution)
+config['momentum.fatcatmap.resolution'] = {
+
+	'threshold': 0.9, ## Minimum name similarity (0-1) for two contributors to be merged
+	'max_block_size': 500, ## Blocks larger than this (very common names) aren't compared
+	'min_name_length': 4, ## Normalised names shorter than this are never matched
+	'lock_timeout': 600 ## Seconds before a merge's lock on a node is presumed abandoned (its task died) and can be taken over
+
+}
+
+# Graph Snapshots (compact in-memory copies of the graph for analytics - see core.graph.snapshot)
+config['momentum.fatcatmap.graph.snapshot'] = {
+
+	'node_page_size': 1000, ## Node keys per keys-only query page
+	'adjacency_page_size': 50, ## NodeAdjacency shards per query page (each holds up to 2500 edges)
+	'step_seconds': 480, ## Seconds each task spends building a snapshot before handing the build on to the next
+	'keep': 3 ## Stored snapshots to keep - older ones are deleted
+
+}
+
+# PageRank (nightly node popularity - see core.graph.pagerank)
+config['momentum.fatcatmap.graph.pagerank'] = {
+
+	'damping': 0.85, ## Probability of following an edge rather than jumping to a random node
+	'tolerance': 0.0001, ## Stop once the mean change in a node's score over one iteration falls below this
+	'max_iterations': 40, ## ...or after this many iterations, whichever comes first
+	'shard_count': 16 ## Mapper shards per pass
+
+}
+
+# Centrality (influence scores computed on graph snapshots - see core.graph.centrality)
+config['momentum.fatcatmap.graph.centrality'] = {
+
+	'damping': 0.85, ## PageRank damping factor
+	'max_iterations': 100, ## Power iteration limit for eigenvector centrality and PageRank
+	'tolerance': 0.000001, ## ...which stop early once the mean change per node falls below this
+	'epsilon': 0.05, ## Approximate betweenness: maximum error in any node's (normalised) score...
+	'delta': 0.1, ## ...with probability at least 1-delta
+	'max_samples': 2000, ## Most source nodes sampled for betweenness, whatever the error bound asks for
+	'processes': 4, ## Worker processes for betweenness sampling, where multiprocessing is available
+	'chunk_sources': 100, ## Betweenness sources sampled per task, when influence is computed in chunks
+	'shard_count': 16 ## Shards for the mapper writing Node.influence
+
+}
+
+# Path Queries ("how are these two connected" - see core.graph.paths)
+config['momentum.fatcatmap.graph.paths'] = {
+
+	'max_hops': 4, ## Longest path searched for
+	'paths': 3, ## Paths returned by default (the k in top-k)
+	'fanout': 50, ## Neighbours followed from each node, best-scoring first, after type and score filters
+	'level_nodes': 2000, ## Most new nodes one search side may reach per hop
+	'max_nodes': 8000, ## Most nodes reached by both sides together
+	'max_candidates': 500, ## Most candidate paths ranked before the best are returned
+	'deadline': 20, ## Seconds a search may run before returning what it has found (marked incomplete)
+	'cache_ttl': 3600 ## Seconds complete results are cached in memcache, per node pair and parameters
+
+}
+
+# Bulk Loaders (offline datasets, loaded by the momentum.fatcatmap.mappers.loader mapper - see core.graph.loader)
+config['momentum.fatcatmap.loaders'] = {
+
+	## Sunlight legislators.csv
+	'sunlight_legislators': {
+
+		'format': 'csv',
+		'skip_header': True,
+		'columns': ['title', 'firstname', 'middlename', 'lastname', 'name_suffix', 'nickname', 'party', 'state', 'district', 'in_office', 'gender', 'phone', 'fax', 'website', 'webform', 'congress_office', 'bioguide_id', 'votesmart_id', 'fec_id', 'govtrack_id', 'crp_id', 'twitter_id', 'congresspedia_url', 'youtube_url', 'facebook_id', 'official_rss', 'senate_class', 'birthdate'],
+
+		'node': {
+
+			'type': 'legislator',
+			'label': '%(title)s. %(firstname)s %(lastname)s (%(party)s-%(state)s)',
+			'dedup': 'bioguide',
+
+			'native': {
+
+				'first_name': 'firstname',
+				'middle_name': 'middlename',
+				'last_name': 'lastname',
+				'name_suffix': 'name_suffix',
+				'nickname': 'nickname',
+				'gender': ('gender', 'lower'),
+				'birthdate': ('birthdate', 'date'),
+				'party': ('party', 'upper', 'key:PoliticalParty'),
+				'in_office': ('in_office', 'bool'),
+				'office_phone': 'phone',
+				'office_fax': 'fax',
+				'official_website': 'website',
+				'official_webform': 'webform'
+
+			},
+
+			'ext_ids': {'bioguide': 'bioguide_id', 'votesmart': 'votesmart_id', 'fec': 'fec_id', 'govtrack': 'govtrack_id', 'opensecrets': 'crp_id', 'twitter': 'twitter_id', 'congresspedia': 'congresspedia_url'},
+			'ext_id_names': {'bioguide': 'bioguide_id', 'votesmart': 'votesmart_id', 'fec': 'fec_id', 'govtrack': 'govtrack_id', 'opensecrets': 'crp_id', 'twitter': 'twitter_id', 'congresspedia': 'congresspedia_url'}
+
+		}
+
+	},
+
+	## OpenSecrets bulk data: PACs (cmtes.txt)
+	'opensecrets_pacs': {
+
+		'format': 'csv',
+		'encoding': 'latin-1',
+		'quotechar': '|',
+		'columns': ['cycle', 'cmte_id', 'pac_short', 'affiliate', 'ultorg', 'recip_id', 'recip_code', 'fec_cand_id', 'party', 'prim_code', 'source', 'sensitive', 'foreign', 'active'],
+
+		'node': {
+
+			'type': 'contributor',
+			'label': '%(pac_short)s',
+			'dedup': 'opensecrets',
+			'native': {'name': 'pac_short'},
+			'ext_ids': {'opensecrets': 'cmte_id'},
+			'ext_id_names': {'opensecrets': 'pac_id'}
+
+		}
+
+	},
+
+	## OpenSecrets bulk data: PAC contributions (pacs.txt), aggregated per (PAC, candidate, cycle)
+	'opensecrets_pac_totals': {
+
+		'format': 'csv',
+		'encoding': 'latin-1',
+		'quotechar': '|',
+		'columns': ['cycle', 'fec_rec_no', 'pac_id', 'cid', 'amount', 'date', 'real_code', 'type', 'di', 'fec_cand_id'],
+
+		'contribution': {
+
+			'type': 'campaign_contributions',
+			'contributor': ('opensecrets', 'pac_id'),
+			'recipient': ('opensecrets', 'cid'),
+			'cycle': 'cycle',
+			'amount': ('amount', 'int')
+
+		}
+
+	},
+
+	## OpenSecrets bulk data: individual contributions (indivs.txt), aggregated per (contributor, recipient, cycle)
+	'opensecrets_individual_totals': {
+
+		'format': 'csv',
+		'encoding': 'latin-1',
+		'quotechar': '|',
+		'columns': ['cycle', 'fec_trans_id', 'contrib_id', 'contrib', 'recip_id', 'org_name', 'ult_org', 'real_code', 'date', 'amount', 'street', 'city', 'state', 'zip', 'recip_code', 'type', 'cmte_id', 'other_id', 'gender', 'microfilm', 'occupation', 'employer', 'source'],
+
+		'contribution': {
+
+			'type': 'campaign_contributions',
+			'contributor': ('opensecrets', 'contrib_id'),
+			'recipient': ('opensecrets', 'recip_id'),
+			'cycle': 'cycle',
+			'amount': ('amount', 'int')
+
+		}
+
+	}
+
+}
+
 ## Services Config
 config['services.sunlight'] = {
 
@@ -4,7 +4,73 @@ from google.appengine.ext import db
 class Model(db.Model):
 
     """ Root, master, non-polymorphic data model. Everything lives under this class. """
-    
+
+    ## Set to an entity cache (an object with get_multi/invalidate) to cache this model's entities - the cache is
+    ## expected to invalidate written and deleted keys itself (see momentum.fatcatmap.core.data.caching)
+    _entity_cache = None
+
+    @classmethod
+    def get(cls, keys, **kwargs):
+
+        """ Fetches entities by key, going through the model's entity cache if it has one. """
+
+        if cls._entity_cache is None or len(kwargs) > 0:
+            return super(Model, cls).get(keys, **kwargs)
+
+        multiple = isinstance(keys, (list, tuple))
+        if not multiple:
+            keys = [keys]
+
+        keys = [isinstance(key, basestring) and db.Key(key) or key for key in keys]
+        cached = cls._entity_cache.get_multi(keys)
+        results = [cached.get(str(key)) for key in keys]
+
+        for entity in results:
+            if entity is not None and not isinstance(entity, cls):
+                raise db.KindError('Kind %r is not a subclass of kind %r' % (entity.kind(), cls.kind()))
+
+        if multiple:
+            return results
+        return results[0]
+
+    @classmethod
+    def get_by_key_name(cls, key_names, parent=None, **kwargs):
+
+        """ Fetches entities by key name, going through the model's entity cache if it has one. """
+
+        if cls._entity_cache is None or len(kwargs) > 0:
+            return super(Model, cls).get_by_key_name(key_names, parent, **kwargs)
+
+        return cls._get_by_path(key_names, parent)
+
+    @classmethod
+    def get_by_id(cls, ids, parent=None, **kwargs):
+
+        """ Fetches entities by numeric ID, going through the model's entity cache if it has one. """
+
+        if cls._entity_cache is None or len(kwargs) > 0:
+            return super(Model, cls).get_by_id(ids, parent, **kwargs)
+
+        return cls._get_by_path(ids, parent)
+
+    @classmethod
+    def _get_by_path(cls, ids, parent=None):
+
+        if isinstance(parent, db.Model):
+            parent = parent.key()
+        elif isinstance(parent, basestring):
+            parent = db.Key(parent)
+
+        multiple = isinstance(ids, (list, tuple))
+        if not multiple:
+            ids = [ids]
+
+        results = cls.get([db.Key.from_path(cls.kind(), id, parent=parent) for id in ids])
+
+        if multiple:
+            return results
+        return results[0]
+
     def _getModelPath(self,seperator=None):
 
         path = [i for i in str(self.__module__+'.'+self.__class__.__name__).split('.')]
@@ -201,6 +201,12 @@ class PolyPro(Model):
 	@classmethod
 	def from_entity(cls, entity):
 
+		## Fast path: implementation class is already loaded (no import/path work per entity)
+		if _CLASS_KEY_PROPERTY in entity:
+			key = tuple(entity[_CLASS_KEY_PROPERTY])
+			if key != cls.class_key() and key in _class_map:
+				return _class_map[key].from_entity(entity)
+
 		if(_PATH_KEY_PROPERTY in entity and
 		   tuple(entity[_PATH_KEY_PROPERTY]) != cls.path_key()):
 			key = entity[_PATH_KEY_PROPERTY].split(':')
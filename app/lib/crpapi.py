@@ -31,22 +31,44 @@ class CRPApiObject(object):
 class CRP(object):
 
     apikey = None
+    cache = None
+    key_pool = None
+    base_url = 'http://api.opensecrets.org/'
 
     @staticmethod
     def _apicall(func, params):
-        if CRP.apikey is None:
+        if CRP.apikey is None and CRP.key_pool is None:
             raise CRPApiError('Missing CRP apikey')
 
-        url = 'http://api.opensecrets.org/?method=%s&output=json&apikey=%s&%s' % \
-              (func, CRP.apikey, urllib.urlencode(params))
+        # optional response cache: cache.fetch(service, func, params, fetch)
+        if CRP.cache is not None:
+            return CRP.cache.fetch('opensecrets', func, params, CRP._fetch)
+        return CRP._fetch(func, params)
+
+    @staticmethod
+    def _url(func, params):
+        # optional key pool: key_pool.acquire() picks a key for each call
+        apikey = CRP.apikey
+        if CRP.key_pool is not None:
+            apikey = CRP.key_pool.acquire()
+        return '%s?method=%s&output=json&apikey=%s&%s' % \
+               (CRP.base_url, func, apikey, urllib.urlencode(params))
+
+    @staticmethod
+    def _parse(response):
         try:
-            response = urllib2.urlopen(url).read()
             return json.loads(response)['response']
-        except urllib2.HTTPError, e:
-            raise CRPApiError(e.read())
         except (ValueError, KeyError), e:
             raise CRPApiError('Invalid Response')
 
+    @staticmethod
+    def _fetch(func, params):
+        try:
+            response = urllib2.urlopen(CRP._url(func, params)).read()
+        except urllib2.HTTPError, e:
+            raise CRPApiError(e.read())
+        return CRP._parse(response)
+
     class candSummary(object):
         @staticmethod
         def get(**kwargs):
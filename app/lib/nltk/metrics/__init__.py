@@ -11,7 +11,11 @@
 Classes and methods for scoring processing modules.
 """
 
-from scores import *
+# scores needs nltk.util, which this trimmed copy of NLTK doesn't include
+try:
+    from scores import *
+except ImportError:
+    pass
 from confusionmatrix import *
 from distance import *
 from windowdiff import *
@@ -73,22 +73,44 @@ class District(SunlightApiObject):
 class sunlight(object):
 
     apikey = None
+    cache = None
+    key_pool = None
+    base_url = 'http://services.sunlightlabs.com/api/'
 
     @staticmethod
     def _apicall(func, params):
-        if sunlight.apikey is None:
+        if sunlight.apikey is None and sunlight.key_pool is None:
             raise SunlightApiError('Missing sunlightlabs apikey')
 
-        url = 'http://services.sunlightlabs.com/api/%s.json?apikey=%s&%s' % \
-              (func, sunlight.apikey, urlencode(params))
+        # optional response cache: cache.fetch(service, func, params, fetch)
+        if sunlight.cache is not None:
+            return sunlight.cache.fetch('sunlight', func, params, sunlight._fetch)
+        return sunlight._fetch(func, params)
+
+    @staticmethod
+    def _url(func, params):
+        # optional key pool: key_pool.acquire() picks a key for each call
+        apikey = sunlight.apikey
+        if sunlight.key_pool is not None:
+            apikey = sunlight.key_pool.acquire()
+        return '%s%s.json?apikey=%s&%s' % (sunlight.base_url, func,
+                                           apikey, urlencode(params))
+
+    @staticmethod
+    def _parse(response):
         try:
-            response = urlopen(url).read().decode()
-            return json.loads(response)['response']
-        except HTTPError, e:
-            raise SunlightApiError(e.read())
+            return json.loads(response.decode())['response']
         except (ValueError, KeyError), e:
             raise SunlightApiError('Invalid Response')
 
+    @staticmethod
+    def _fetch(func, params):
+        try:
+            response = urlopen(sunlight._url(func, params)).read()
+        except HTTPError, e:
+            raise SunlightApiError(e.read())
+        return sunlight._parse(response)
+
     class legislators(object):
         @staticmethod
         def get(**kwargs):
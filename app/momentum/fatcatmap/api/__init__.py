@@ -2,6 +2,7 @@ import config
 
 
 _CHESHIRE_TRANSPORT_VERSION = 1.0
+_RESERVED_PARAMS = ['payload', 'method_path', 'module', 'output', 'format']
 
 
 ## Momentum API Module
@@ -33,7 +34,10 @@ class MomentumAPIRequest(object):
 				pass
 
 		elif 'method_path' in config:
-			raw_request['method'] = config['method_path'].split('/')
+			raw_request['request']['method'] = config['method_path'].split('/')
+
+			## Plain GET/POST calls pass method params as request args
+			raw_request['request']['params'] = dict([(key, value) for key, value in config.items() if key not in _RESERVED_PARAMS])
 
 		request_obj = MomentumAPIRequest()
 		if 'id' in raw_request: request_obj.id = raw_request['id']
@@ -44,7 +48,7 @@ class MomentumAPIRequest(object):
 			if 'opts' in raw_request['request']: request_obj.opts = raw_request['request']['opts']
 		if 'client' in raw_request: request_obj.client = raw_request['client']
 
-		return raw_request
+		return request_obj
 
 
 ## Response Message
@@ -0,0 +1,31 @@
+## AJAX Autocomplete API
+from momentum.fatcatmap.handlers.api import InvalidParams
+from momentum.fatcatmap.api.ajax import MomentumAjaxAPI
+from momentum.fatcatmap.api.ajax import MomentumAjaxAPIResponse
+
+from momentum.fatcatmap.core.search.autocomplete import complete
+
+_MAX_LIMIT = 25
+
+
+class AutocompleteResponse(MomentumAjaxAPIResponse):
+    type = 'AutocompleteResponse'
+
+
+class AutocompleteAction(MomentumAjaxAPI):
+
+    ''' ajax.autocomplete: ranked node label completions for a partial query, one key lookup per keystroke. '''
+
+    response = AutocompleteResponse
+
+    def execute(self, q=None, limit=10):
+
+        if not q:
+            raise InvalidParams
+
+        try:
+            limit = min(int(limit), _MAX_LIMIT)
+        except (TypeError, ValueError):
+            raise InvalidParams
+
+        return {'query': q, 'results': [{'id': str(key), 'label': label, 'score': score} for key, label, score in complete(q, limit)]}
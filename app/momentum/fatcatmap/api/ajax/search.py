@@ -1 +1,43 @@
-## AJAX Search API
\ No newline at end of file
+## AJAX Search API
+from momentum.fatcatmap.handlers.api import InvalidParams
+from momentum.fatcatmap.api.ajax import MomentumAjaxAPI
+from momentum.fatcatmap.api.ajax import MomentumAjaxAPIResponse
+
+from momentum.fatcatmap.core.search.index import search
+
+from momentum.fatcatmap.models.graph import Node
+
+_MAX_LIMIT = 50
+
+
+class SearchResponse(MomentumAjaxAPIResponse):
+    type = 'SearchResponse'
+
+
+class SearchAction(MomentumAjaxAPI):
+
+    ''' ajax.search: top-k ranked full-text search over node labels and native fields. '''
+
+    response = SearchResponse
+
+    def execute(self, q=None, limit=10):
+
+        if not q:
+            raise InvalidParams
+
+        try:
+            limit = min(int(limit), _MAX_LIMIT)
+        except (TypeError, ValueError):
+            raise InvalidParams
+
+        results = search(q, limit)
+
+        nodes = Node.get([key for key, score in results])
+
+        hits = []
+        for (key, score), node in zip(results, nodes):
+            if node is not None:
+                node_type = Node.type.get_value_for_datastore(node)
+                hits.append({'id': str(key), 'label': node.label, 'type': node_type and node_type.name() or None, 'score': score})
+
+        return {'query': q, 'results': hits}
@@ -0,0 +1,52 @@
+## Graph Paths API
+
+
+## "how are these two connected": shortest paths between two nodes
+from google.appengine.ext import db
+
+from momentum.fatcatmap.handlers.api import InvalidParams
+from momentum.fatcatmap.api.graph import MomentumGraphAPI
+from momentum.fatcatmap.api.graph import MomentumGraphAPIResponse
+
+from momentum.fatcatmap.core.graph.paths import find_paths
+
+_MAX_PATHS = 10
+_MAX_HOPS = 4
+_MAX_FANOUT = 100
+_WEIGHTS = ['hops', 'score']
+
+
+class GraphPathsResponse(MomentumGraphAPIResponse):
+    type = 'GraphPathsResponse'
+
+
+class PathsAction(MomentumGraphAPI):
+
+    ''' graph.paths: the k shortest distinct paths between two nodes, by hops or by edge score, with edge type and score filters. '''
+
+    response = GraphPathsResponse
+
+    def execute(self, source=None, target=None, k=3, max_hops=4, types=None, min_score=None, fanout=None, weight='hops'):
+
+        if source is None or target is None or weight not in _WEIGHTS:
+            raise InvalidParams
+
+        try:
+            source, target = db.Key(str(source)), db.Key(str(target))
+        except db.BadKeyError:
+            raise InvalidParams
+
+        try:
+            k = max(min(int(k), _MAX_PATHS), 1)
+            max_hops = max(min(int(max_hops), _MAX_HOPS), 1)
+            if fanout is not None:
+                fanout = min(int(fanout), _MAX_FANOUT)
+            if min_score is not None:
+                min_score = float(min_score)
+        except (TypeError, ValueError):
+            raise InvalidParams
+
+        if isinstance(types, basestring):
+            types = types.split(',')
+
+        return find_paths(source, target, k=k, max_hops=max_hops, types=types, min_score=min_score, fanout=fanout, weight=weight)
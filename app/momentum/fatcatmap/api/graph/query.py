@@ -1,4 +1,58 @@
 ## Graph Query API
 
 
-## a DB-query type interface for querying the graph (paths, stats, edge counts, node counts, group info, etc)
\ No newline at end of file
+## a DB-query type interface for querying the graph (paths, stats, edge counts, node counts, group info, etc)
+from google.appengine.ext import db
+
+from momentum.fatcatmap.handlers.api import InvalidParams
+from momentum.fatcatmap.api.graph import MomentumGraphAPI
+from momentum.fatcatmap.api.graph import MomentumGraphAPIResponse
+
+from momentum.fatcatmap.core.graph.query import neighborhood
+
+_MAX_DEPTH = 3
+_MAX_FANOUT = 100
+_MAX_NODES = 2000
+
+
+class GraphQueryResponse(MomentumGraphAPIResponse):
+    type = 'GraphQueryResponse'
+
+
+class QueryAction(MomentumGraphAPI):
+
+    ''' graph.query: k-hop neighbourhood of a root node, with per-hop fan-out, edge type and score pruning. '''
+
+    response = GraphQueryResponse
+
+    def execute(self, root=None, depth=2, fanout=25, types=None, min_score=None, min_super_score=None, max_nodes=500):
+
+        if root is None:
+            raise InvalidParams
+
+        try:
+            root = db.Key(str(root))
+        except db.BadKeyError:
+            raise InvalidParams
+
+        try:
+            depth = min(int(depth), _MAX_DEPTH)
+            fanout = min(int(fanout), _MAX_FANOUT)
+            max_nodes = min(int(max_nodes), _MAX_NODES)
+            if min_score is not None:
+                min_score = float(min_score)
+            if min_super_score is not None:
+                min_super_score = float(min_super_score)
+        except (TypeError, ValueError):
+            raise InvalidParams
+
+        if isinstance(types, basestring):
+            types = types.split(',')
+
+        result = neighborhood(root, depth=depth, fanout=fanout, types=types, min_score=min_score, min_super_score=min_super_score, max_nodes=max_nodes)
+
+        ## No such root node
+        if result is None:
+            raise InvalidParams
+
+        return result
@@ -9,7 +9,7 @@ from django.utils.simplejson import JSONDecoder
 
 from google.appengine.ext import db
 
-from momentum.fatcatmap.core.data import MomentumDataAdapter
+from momentum.fatcatmap.core.data.adapters import MomentumDataAdapter
 
 model_cache = {}
 
@@ -1 +1,242 @@
-from google.appengine.api import memcache
\ No newline at end of file
+import time
+import config
+import logging
+
+from google.appengine.ext import db
+from google.appengine.api import memcache
+from google.appengine.api import apiproxy_stub_map
+
+from tipfy import Tipfy
+from tipfy.ext.db import get_protobuf_from_entity
+from tipfy.ext.db import get_entity_from_protobuf
+
+
+_MEMCACHE_NAMESPACE = 'momentum.fatcatmap.entities'
+_REQUEST_CACHE_ATTRIBUTE = '_pc_entity_cache'
+
+
+class EntityCache(object):
+
+	'''
+
+	Layered cache for datastore entities, consulted in order:
+
+		1) request: a dict attached to the current Tipfy request (skipped outside of tipfy requests)
+		2) instance: an in-memory LRU of encoded protobufs, bounded by size and TTL
+		3) memcache: encoded protobufs (via tipfy.ext.db.get_protobuf_from_entity)
+
+	Whatever is still missing is fetched with one batch datastore get, and backfilled
+	into every layer. Models opt in by setting _entity_cache to an EntityCache instance.
+
+	'''
+
+	def __init__(self, max_size=None, ttl=None, memcache_ttl=None):
+
+		cfg = config.config.get('momentum.fatcatmap.data.caching')
+
+		self.max_size = max_size or cfg['instance_max_size']
+		self.ttl = ttl or cfg['instance_ttl']
+		self.memcache_ttl = memcache_ttl or cfg['memcache_ttl']
+		self.enable_memcache = cfg['enable_memcache']
+		self.debug = cfg['debug']
+
+		self._instance = {}
+		self._last_used = {}
+
+	#### ==== Request Layer ==== ####
+	def _request_layer(self):
+
+		request = Tipfy.request
+		if request is None:
+			return None
+
+		cache = getattr(request, _REQUEST_CACHE_ATTRIBUTE, None)
+		if cache is None:
+			cache = {}
+			setattr(request, _REQUEST_CACHE_ATTRIBUTE, cache)
+		return cache
+
+	#### ==== Instance Layer ==== ####
+	def _instance_get(self, key_string):
+
+		if key_string in self._instance:
+			expires, protobuf = self._instance[key_string]
+			if expires > time.time():
+				self._last_used[key_string] = time.time()
+				return get_entity_from_protobuf(protobuf)
+			self._instance_delete(key_string)
+		return None
+
+	def _instance_set(self, key_string, protobuf):
+
+		self._instance[key_string] = (time.time()+self.ttl, protobuf)
+		self._last_used[key_string] = time.time()
+
+		## Evict the least recently used tenth once we're over size
+		if len(self._instance) > self.max_size:
+			by_age = sorted(self._last_used.items(), key=lambda item: item[1])
+			for stale_key, last_used in by_age[0:max(1, self.max_size/10)]:
+				self._instance_delete(stale_key)
+
+	def _instance_delete(self, key_string):
+
+		if key_string in self._instance:
+			del self._instance[key_string]
+		if key_string in self._last_used:
+			del self._last_used[key_string]
+
+	#### ==== Public API ==== ####
+	def get_multi(self, keys):
+
+		''' Returns a dict of str(key) => entity for every key that exists, touching the datastore at most once. '''
+
+		results = {}
+		missing = [str(key) for key in keys]
+
+		## Request layer
+		request_cache = self._request_layer()
+		if request_cache is not None:
+			for key_string in missing:
+				if key_string in request_cache:
+					results[key_string] = request_cache[key_string]
+			missing = [key_string for key_string in missing if key_string not in results]
+
+		## Instance layer
+		found = []
+		for key_string in missing:
+			entity = self._instance_get(key_string)
+			if entity is not None:
+				results[key_string] = entity
+				found.append(key_string)
+		missing = [key_string for key_string in missing if key_string not in results]
+
+		## Memcache layer
+		if self.enable_memcache and len(missing) > 0:
+			cached = memcache.get_multi(missing, namespace=_MEMCACHE_NAMESPACE)
+			for key_string, protobuf in cached.items():
+				results[key_string] = get_entity_from_protobuf(protobuf)
+				self._instance_set(key_string, protobuf)
+				found.append(key_string)
+			missing = [key_string for key_string in missing if key_string not in results]
+
+		## Datastore
+		if len(missing) > 0:
+			entities = [entity for entity in db.get([db.Key(key_string) for key_string in missing]) if entity is not None]
+			self.set_multi(entities)
+			for entity in entities:
+				results[str(entity.key())] = entity
+
+		if request_cache is not None:
+			for key_string in found:
+				request_cache[key_string] = results[key_string]
+
+		if self.debug:
+			logging.debug('ENTITY CACHE: '+str(len(keys))+' keys requested, '+str(len(missing))+' fetched from datastore.')
+
+		return results
+
+	def get(self, key):
+		return self.get_multi([key]).get(str(key))
+
+	def set_multi(self, entities):
+
+		''' Stores entities in every layer. '''
+
+		if len(entities) == 0:
+			return
+
+		protobufs = dict([(str(entity.key()), get_protobuf_from_entity(entity)) for entity in entities])
+
+		request_cache = self._request_layer()
+		for entity in entities:
+			key_string = str(entity.key())
+			if request_cache is not None:
+				request_cache[key_string] = entity
+			self._instance_set(key_string, protobufs[key_string])
+
+		if self.enable_memcache:
+			memcache.set_multi(protobufs, time=self.memcache_ttl, namespace=_MEMCACHE_NAMESPACE)
+
+	def invalidate(self, keys):
+
+		''' Drops keys from every layer. Called automatically for every put or delete of a cached kind (see invalidate_writes). '''
+
+		key_strings = [str(key) for key in keys]
+
+		request_cache = self._request_layer()
+		for key_string in key_strings:
+			if request_cache is not None and key_string in request_cache:
+				del request_cache[key_string]
+			self._instance_delete(key_string)
+
+		if self.enable_memcache:
+			memcache.delete_multi(key_strings, namespace=_MEMCACHE_NAMESPACE)
+
+
+## Shared process-wide cache, for models that opt in
+entity_cache = EntityCache()
+
+
+#### ==== Write Invalidation ==== ####
+def cache_for_kind(kind):
+
+	''' Returns the entity cache the model class for kind opts in to, or None. '''
+
+	try:
+		return getattr(db.class_for_kind(kind), '_entity_cache', None)
+	except db.KindError:
+		return None
+
+
+def invalidate_keys(keys):
+
+	''' Drops keys of cached kinds from their entity caches. '''
+
+	caches = {}
+	for key in keys:
+		cache = cache_for_kind(key.kind())
+		if cache is not None:
+			caches.setdefault(id(cache), (cache, []))[1].append(key)
+
+	for cache, cache_keys in caches.values():
+		cache.invalidate(cache_keys)
+
+
+## Keys written inside each open transaction (by handle), invalidated once it commits
+_transaction_writes = {}
+
+
+def invalidate_writes(service, call, request, response):
+
+	'''
+
+	Datastore post-call hook: drops every key of a cached kind that a Put or Delete
+	wrote from its entity cache. Hooking the RPC (rather than Model.put) covers batch
+	db.put()/db.delete() calls and mapper mutation pools as well.
+
+	Writes inside a transaction are held until its Commit, and invalidated then -
+	invalidating at the Put would let a read before the commit cache the old entity
+	again.
+
+	'''
+
+	if call == 'Put':
+		keys = [db.Key._FromPb(reference) for reference in response.key_list()]
+	elif call == 'Delete':
+		keys = [db.Key._FromPb(reference) for reference in request.key_list()]
+	elif call == 'Commit':
+		invalidate_keys(_transaction_writes.pop(request.handle(), []))
+		return
+	elif call == 'Rollback':
+		_transaction_writes.pop(request.handle(), None)
+		return
+	else:
+		return
+
+	if request.has_transaction():
+		_transaction_writes.setdefault(request.transaction().handle(), []).extend(keys)
+	else:
+		invalidate_keys(keys)
+
+
+apiproxy_stub_map.apiproxy.GetPostCallHooks().Append('fatcatmap_entity_cache', invalidate_writes, 'datastore_v3')
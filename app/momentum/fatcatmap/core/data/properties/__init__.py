@@ -25,4 +25,27 @@ class KeyProperty(db.StringProperty):
 		if self._autofetch == True:
 			return db.get(value)
 		else:
-			return value
\ No newline at end of file
+			return value
+
+class CachedReferenceProperty(db.ReferenceProperty):
+
+	''' ReferenceProperty that dereferences through the referenced model's entity cache, when it has one. '''
+
+	def __get__(self, model_instance, model_class):
+
+		if model_instance is None:
+			return self
+
+		if getattr(self.reference_class, '_entity_cache', None) is None or getattr(model_instance, '_RESOLVED'+self._attr_name(), None) is not None:
+			return super(CachedReferenceProperty, self).__get__(model_instance, model_class)
+
+		reference_key = self.get_value_for_datastore(model_instance)
+		if reference_key is None:
+			return None
+
+		instance = self.reference_class.get(reference_key)
+		if instance is None:
+			raise db.ReferencePropertyResolveError('ReferenceProperty failed to be resolved: %s' % reference_key.to_path())
+
+		setattr(model_instance, '_RESOLVED'+self._attr_name(), instance)
+		return instance
@@ -1,47 +1,231 @@
+import struct
 import logging
 from google.appengine.ext import db
 
 
-class IndexEntryListProperty(db.StringListProperty):
-	
-	''' Stores a list of keys and relevance/popularity scores. '''
-	
+_MAGIC = 'IE'
+_VERSION = 1
+
+_HEADER = struct.Struct('<2sBI')
+_SCORES = struct.Struct('<fff')
+_OFFSET = struct.Struct('<I')
+_PAIR = struct.Struct('<BB')
+_ID = struct.Struct('<q')
+_LENGTH = struct.Struct('<H')
+
+_KEY_ID = 0
+_KEY_NAME = 1
+
+
+def _pack_string(value):
+	value = value.encode('utf-8')
+	return _LENGTH.pack(len(value))+value
+
+
+def _unpack_string(data, offset):
+	length, = _LENGTH.unpack_from(data, offset)
+	offset += _LENGTH.size
+	return (data[offset:offset+length].decode('utf-8'), offset+length)
+
+
+def stored_entry(entry):
+
+	''' An index entry with its scores rounded to single precision, as they're stored, so a fresh entry compares equal to the same entry read back. '''
+
+	return (entry[0],)+_SCORES.unpack(_SCORES.pack(*entry[1:4]))
+
+
+def encode_index_entries(entries):
+
+	'''
+
+	Packs a list of (key, popularity, relevance, final) tuples into a blob:
+
+		header:  magic, version, entry count
+		strings: app, namespace, then a table of kind names
+		scores:  one struct-packed float triplet per entry
+		offsets: one uint32 per entry, pointing at its key path
+		keys:    each key path as (kind index, id/name) pairs
+
+	Scores and offsets are fixed width, so any entry can be decoded without touching the others.
+
+	'''
+
+	entries = list(entries)
+
+	app, namespace = '', ''
+	if len(entries) > 0:
+		app, namespace = entries[0][0].app(), entries[0][0].namespace() or ''
+
+	kinds = {}
+	kind_table = []
+	scores = []
+	paths = []
+
+	for key, p_score, r_score, f_score in entries:
+
+		if key.app() != app or (key.namespace() or '') != namespace:
+			raise db.BadValueError('All keys in an index entry list must share an app and namespace.')
+
+		scores.append(_SCORES.pack(p_score, r_score, f_score))
+
+		path = [chr(len(key.to_path())/2)]
+		for kind, id_or_name in zip(key.to_path()[0::2], key.to_path()[1::2]):
+			if kind not in kinds:
+				kinds[kind] = len(kind_table)
+				kind_table.append(kind)
+			if isinstance(id_or_name, basestring):
+				path.append(_PAIR.pack(kinds[kind], _KEY_NAME)+_pack_string(id_or_name))
+			else:
+				path.append(_PAIR.pack(kinds[kind], _KEY_ID)+_ID.pack(id_or_name))
+		paths.append(''.join(path))
+
+	strings = _pack_string(app)+_pack_string(namespace)+chr(len(kind_table))+''.join([_pack_string(kind) for kind in kind_table])
+
+	offsets = []
+	position = 0
+	for path in paths:
+		offsets.append(_OFFSET.pack(position))
+		position += len(path)
+
+	return db.Blob(_HEADER.pack(_MAGIC, _VERSION, len(entries))+strings+''.join(scores)+''.join(offsets)+''.join(paths))
+
+
+def decode_legacy_index_entries(value):
+
+	''' Decodes the original string-list format ("key::P/0.1::R/0.2::F/0.3"). Used to migrate old entities, which are rewritten in the packed format on their next put(). '''
+
+	decoded_entries = []
+	for encoded_entry in value:
+		split_entry = encoded_entry.split('::')
+
+		key = db.Key(split_entry[0])
+
+		p_score = split_entry[1].lower().replace('p/','')
+		r_score = split_entry[2].lower().replace('r/','')
+		f_score = split_entry[3].lower().replace('f/','')
+
+		decoded_entries.append((key, float(p_score), float(r_score), float(f_score)))
+
+	return decoded_entries
+
+
+class IndexEntryList(object):
+
+	''' Read-only, lazily-decoded view over a packed index entry blob. Supports len(), iteration, indexing and slicing; score() reads scores without decoding keys. '''
+
+	def __init__(self, blob):
+
+		self.blob = blob
+		magic, version, self.count = _HEADER.unpack_from(blob, 0)
+		if magic != _MAGIC or version != _VERSION:
+			raise db.BadValueError('Unrecognised index entry list encoding.')
+
+		offset = _HEADER.size
+		self.app, offset = _unpack_string(blob, offset)
+		self.namespace, offset = _unpack_string(blob, offset)
+
+		self.kinds = []
+		kind_count = ord(blob[offset])
+		offset += 1
+		for i in xrange(0, kind_count):
+			kind, offset = _unpack_string(blob, offset)
+			self.kinds.append(kind)
+
+		self.scores_offset = offset
+		self.offsets_offset = self.scores_offset+(self.count*_SCORES.size)
+		self.keys_offset = self.offsets_offset+(self.count*_OFFSET.size)
+
+	def __len__(self):
+		return self.count
+
+	def score(self, index):
+
+		''' Returns the (popularity, relevance, final) scores for an entry. '''
+
+		return _SCORES.unpack_from(self.blob, self.scores_offset+(index*_SCORES.size))
+
+	def key(self, index):
+
+		offset = self.keys_offset+_OFFSET.unpack_from(self.blob, self.offsets_offset+(index*_OFFSET.size))[0]
+
+		path = []
+		pair_count = ord(self.blob[offset])
+		offset += 1
+		for i in xrange(0, pair_count):
+			kind_index, id_type = _PAIR.unpack_from(self.blob, offset)
+			offset += _PAIR.size
+			if id_type == _KEY_NAME:
+				id_or_name, offset = _unpack_string(self.blob, offset)
+			else:
+				id_or_name, = _ID.unpack_from(self.blob, offset)
+				offset += _ID.size
+			path.extend([self.kinds[kind_index], id_or_name])
+
+		if self.namespace:
+			return db.Key.from_path(*path, **{'_app': self.app, 'namespace': self.namespace})
+		return db.Key.from_path(*path, **{'_app': self.app})
+
+	def __getitem__(self, index):
+
+		if isinstance(index, slice):
+			return [self[i] for i in xrange(*index.indices(self.count))]
+
+		if index < 0:
+			index += self.count
+		if index < 0 or index >= self.count:
+			raise IndexError('Index entry out of range.')
+
+		return (self.key(index),)+self.score(index)
+
+	def __iter__(self):
+		for index in xrange(0, self.count):
+			yield self[index]
+
+
+class IndexEntryListProperty(db.Property):
+
+	''' Stores a list of keys and relevance/popularity scores, packed into an unindexed blob. '''
+
+	data_type = list
+
 	def __init__(self, *args, **kwargs):
+		kwargs['indexed'] = False
 		super(IndexEntryListProperty, self).__init__(*args, **kwargs)
-		
-	
+
+	def default_value(self):
+		return []
+
+	def validate(self, value):
+
+		if value is None:
+			value = []
+
+		if not isinstance(value, (list, tuple, IndexEntryList)):
+			raise db.BadValueError('Property %s must be a list of (key, popularity, relevance, final) tuples.' % self.name)
+
+		return super(IndexEntryListProperty, self).validate(value)
+
+	def empty(self, value):
+		return value is None
+
 	def make_value_from_datastore(self, value):
-				
-		decoded_entries = []
-
-		if value is not None:
-			for encoded_entry in value:
-				split_entry = encoded_entry.split('::')
-				
-				key = db.Key(split_entry[0])
-				
-				p_score = split_entry[1].lower().replace('p/','')
-				r_score = split_entry[2].lower().replace('r/','')
-				f_score = split_entry[3].lower().replace('f/','')
-				
-						
-				decoded_entries.append((key, float(p_score), float(r_score), float(f_score)))
-						
-		return decoded_entries
-		
-		
-	def validate_list_contents(self, value):
-		
-		return value
-		
-			
+
+		if value is None:
+			return []
+
+		## Entities written before the packed encoding hold a list of strings
+		if isinstance(value, list):
+			return decode_legacy_index_entries(value)
+
+		return IndexEntryList(value)
+
 	def get_value_for_datastore(self, model_instance):
-		
-		value = self.__get__(model_instance, model_instance.__class__)		
 
-		encoded_index_entries = []		
-		for key, p_score, r_score, final_score in value:
-			encoded_index_entries.append(str(key)+'::P/'+str(p_score)+'::R/'+str(r_score)+'::F/'+str(final_score))
+		value = self.__get__(model_instance, model_instance.__class__)
+
+		## Unmodified views are written back as-is, with no re-encoding
+		if isinstance(value, IndexEntryList):
+			return db.Blob(value.blob)
 
-			
-		return encoded_index_entries
\ No newline at end of file
+		return encode_index_entries(value or [])
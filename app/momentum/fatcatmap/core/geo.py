@@ -0,0 +1,158 @@
+import time
+import logging
+
+from google.appengine.ext import db
+
+from momentum.fatcatmap.models.geo import USState
+from momentum.fatcatmap.models.geo import District
+from momentum.fatcatmap.models.politics import LegislativeChamber
+
+
+_PAGE_SIZE = 1000
+
+## Least time between reloads when a lookup misses, in seconds
+_RELOAD_INTERVAL = 60
+
+
+def _all_keys(model_class):
+
+	''' Every key of a kind, with keys-only queries paged by key. '''
+
+	keys = []
+	last = None
+	while True:
+		query = model_class.all(keys_only=True).order('__key__')
+		if last is not None:
+			query.filter('__key__ >', last)
+		page = query.fetch(_PAGE_SIZE)
+		keys.extend(page)
+		if len(page) < _PAGE_SIZE:
+			return keys
+		last = page[-1]
+
+
+class GeographyResolver(object):
+
+	'''
+
+	Resolves states, legislative chambers and districts to keys for importers
+	(legislators, committees, state legislatures).
+
+	Every USState, LegislativeChamber and District key is loaded once per instance,
+	with keys-only queries, and held in memory - so in steady state resolution costs
+	no RPCs at all. A state or chamber that isn't found triggers a reload (at most once
+	every _RELOAD_INTERVAL seconds) before giving up, so entities created after the
+	load are picked up. Districts that don't exist yet are queued by district() and
+	created by create_missing(), in one transaction per legislature.
+
+	'''
+
+	def __init__(self):
+		self.loaded = False
+		self.loaded_at = 0
+		self.states = {}
+		self.chambers = set([])
+		self.districts = set([])
+		self.pending = {}
+
+	def load(self):
+
+		self.states = dict([(key.name(), key) for key in _all_keys(USState)])
+		self.chambers = set(_all_keys(LegislativeChamber))
+		self.districts = set(_all_keys(District))
+		self.loaded = True
+		self.loaded_at = time.time()
+
+		logging.debug('Geography resolver loaded '+str(len(self.states))+' states, '+str(len(self.chambers))+' chambers and '+str(len(self.districts))+' districts.')
+
+	def check(self):
+		if not self.loaded:
+			self.load()
+
+	def refresh(self):
+
+		''' Reloads every key after a lookup missed, unless the last load was under _RELOAD_INTERVAL seconds ago. Returns True if it reloaded. '''
+
+		if time.time()-self.loaded_at < _RELOAD_INTERVAL:
+			return False
+
+		self.load()
+		return True
+
+	#### ==== Resolution ==== ####
+	def state(self, abbreviation):
+
+		''' Key for a state by its abbreviation, or None if there's no such state. '''
+
+		self.check()
+		key = self.states.get(abbreviation.upper())
+		if key is None and self.refresh():
+			key = self.states.get(abbreviation.upper())
+		return key
+
+	def chamber(self, legislature, chamber):
+
+		''' Key for a chamber by legislature and chamber key names (e.g. 'us_congress', 'us_senate'), or None if it doesn't exist. '''
+
+		self.check()
+		key = db.Key.from_path('Legislature', legislature, 'LegislativeChamber', chamber)
+		if key in self.chambers or (self.refresh() and key in self.chambers):
+			return key
+		return None
+
+	def district(self, chamber, key_name, build):
+
+		'''
+
+		Key for a district of a chamber. If the district doesn't exist yet, build (a
+		callable taking the district key) is called to construct it and the district is
+		queued for create_missing(). Either way the key is returned straight away.
+
+		'''
+
+		if chamber is None:
+			raise db.BadArgumentError('Cannot resolve district "'+key_name+'" without a chamber.')
+
+		self.check()
+		key = db.Key.from_path(District.kind(), key_name, parent=chamber)
+		if key not in self.districts and key not in self.pending:
+			self.pending[key] = build(key)
+		return key
+
+	#### ==== Creation ==== ####
+	def create_missing(self):
+
+		''' Creates queued districts, one transaction per legislature (its chambers and districts share an entity group). Districts created elsewhere in the meantime are left alone. Returns the number created. '''
+
+		if len(self.pending) == 0:
+			return 0
+
+		by_group = {}
+		for key, district in self.pending.items():
+			root = key
+			while root.parent() is not None:
+				root = root.parent()
+			by_group.setdefault(root, []).append(district)
+
+		created = 0
+		for root, districts in by_group.items():
+
+			def txn():
+				existing = db.get([district.key() for district in districts])
+				missing = [district for district, found in zip(districts, existing) if found is None]
+				if len(missing) > 0:
+					db.put(missing)
+				return len(missing)
+
+			created += db.run_in_transaction(txn)
+			self.districts.update([district.key() for district in districts])
+
+		self.pending = {}
+
+		logging.info('Geography resolver created '+str(created)+' districts.')
+
+		return created
+
+
+## Instance-wide resolver, shared by every importer
+geography = GeographyResolver()
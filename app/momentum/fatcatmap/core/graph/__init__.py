@@ -0,0 +1 @@
+## FCM GRAPH CORE
\ No newline at end of file
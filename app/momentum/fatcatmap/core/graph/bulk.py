@@ -0,0 +1,109 @@
+import logging
+
+from google.appengine.ext import db
+
+from momentum.fatcatmap.models.graph import Node as GraphNode
+from momentum.fatcatmap.core.graph.registry import get_node_type
+from momentum.fatcatmap.core.search.index import index_nodes
+
+
+_DEFAULT_CHUNK_SIZE = 250
+
+
+def resolve_node_types(type_names):
+
+	''' Resolves each distinct NodeType named in type_names through the type registry. Returns a dict of name => (NodeType, native class). '''
+
+	resolved = {}
+	for name in set(type_names):
+		resolved[name] = get_node_type(name)
+
+	return resolved
+
+
+def allocate_node_keys(count, supernode=None):
+
+	''' Pre-allocates count Node keys (under supernode, if given) with a single allocate_ids RPC. '''
+
+	if count == 0:
+		return []
+
+	start, end = db.allocate_ids(db.Key.from_path(GraphNode.kind(), 1, parent=supernode), count)
+	return [db.Key.from_path(GraphNode.kind(), node_id, parent=supernode) for node_id in xrange(start, end+1)]
+
+
+def build_nodes(nodes, node_types=None):
+
+	'''
+
+	Builds (but does not save) Node and Native entities for a list of node specs.
+
+	Each spec is a (type, label, native_kwargs) tuple, optionally followed by a
+	supernode key as a fourth member. Node keys are pre-allocated in batch (one RPC
+	per distinct supernode) so natives can be parented to their node before either
+	is written. Returns a list of (node, native) tuples, in the same order as nodes.
+
+	'''
+
+	if node_types is None:
+		node_types = resolve_node_types([spec[0] for spec in nodes])
+
+	## Group specs by supernode so keys are allocated once per entity group
+	by_supernode = {}
+	for index, spec in enumerate(nodes):
+		supernode = None
+		if len(spec) > 3:
+			supernode = spec[3]
+		by_supernode.setdefault(supernode, []).append(index)
+
+	node_keys = [None]*len(nodes)
+	for supernode, indexes in by_supernode.items():
+		for index, key in zip(indexes, allocate_node_keys(len(indexes), supernode)):
+			node_keys[index] = key
+
+	built = []
+	for spec, node_key in zip(nodes, node_keys):
+
+		type_name, label, native_kwargs = spec[0], spec[1], spec[2]
+		node_type, native_class = node_types[type_name]
+
+		node = GraphNode(key=node_key, label=label, type=node_type.key())
+		native = native_class(node_key, node=node_key)
+
+		if native_kwargs is not None:
+			for prop_name, prop_value in native_kwargs.items():
+				setattr(native, prop_name, prop_value)
+
+		built.append((node, native))
+
+	return built
+
+
+def put_nodes(nodes, chunk_size=_DEFAULT_CHUNK_SIZE, index=True):
+
+	'''
+
+	Creates a list of nodes without transactions, writing each chunk of Node and
+	Native entities with a single batched put. NodeTypes and native impl classes are
+	resolved once for the whole list. Unless index is False, each chunk is then added
+	to the search index. Returns a list of (node key, native key) tuples.
+
+	'''
+
+	node_types = resolve_node_types([spec[0] for spec in nodes])
+
+	results = []
+	for offset in xrange(0, len(nodes), chunk_size):
+
+		built = build_nodes(nodes[offset:offset+chunk_size], node_types)
+
+		entities = [node for node, native in built]+[native for node, native in built]
+		keys = db.put(entities)
+
+		results.extend(zip(keys[0:len(built)], keys[len(built):]))
+		logging.debug('Bulk-stored '+str(len(built))+' nodes (chunk at offset '+str(offset)+').')
+
+		if index:
+			index_nodes(built)
+
+	return results
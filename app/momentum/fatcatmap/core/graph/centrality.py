@@ -0,0 +1,427 @@
+import sys
+import math
+import time
+import config
+import random
+import struct
+import logging
+
+from array import array
+from collections import deque
+
+## Both optional: NumPy vectorises the spectral measures, and a process pool spreads
+## betweenness sampling over cores. Neither is available on App Engine itself, where
+## everything falls back to pure Python over the snapshot's arrays.
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+try:
+	import multiprocessing
+except ImportError:
+	multiprocessing = None
+
+from momentum.fatcatmap.models.graph import GraphScoreFile
+from momentum.fatcatmap.core.graph.snapshot import Column
+from momentum.fatcatmap.core.graph.snapshot import read_blob
+from momentum.fatcatmap.core.graph.snapshot import write_blob
+from momentum.fatcatmap.core.graph.snapshot import open_snapshot
+
+
+_SCORES_MAGIC = 'FCMS'
+_SCORES_VERSION = 1
+_SCORES_PREFIX = struct.Struct('<4sHHI')
+
+## Score files opened by this instance, by GraphScoreFile key
+_opened = {}
+
+## The SimpleGraph of the stored snapshot this instance used most recently, by GraphSnapshotFile key
+_graphs = {}
+
+## The graph shared with pool workers (inherited when the pool forks, rather than pickled per task)
+_shared = {}
+
+
+class SimpleGraph(object):
+
+	'''
+
+	A snapshot reduced to a simple undirected graph for centrality: parallel entries
+	(one per edge type) merged into a single edge with their weights summed,
+	self-loops dropped, and any edges overlaid since the snapshot was taken folded
+	in. Same CSR layout as GraphSnapshot, with weights in double precision.
+
+	'''
+
+	def __init__(self, snapshot):
+
+		self.size = len(snapshot)
+		self.offsets = array('I', [0])
+		self.targets = array('I')
+		self.weights = array('d')
+		self._vectors = None
+
+		for node_id in xrange(0, self.size):
+			merged = {}
+			for target, weight, edge_type in snapshot.entries(node_id):
+				if target != node_id:
+					merged[target] = merged.get(target, 0.0)+weight
+			self.targets.extend(merged.keys())
+			self.weights.extend(merged.values())
+			self.offsets.append(len(self.targets))
+
+	def __len__(self):
+		return self.size
+
+	def vectors(self):
+
+		''' The graph as NumPy vectors: (sources, targets, weights), one element per directed entry. Targets and weights share the arrays' memory. Needs NumPy. '''
+
+		if self._vectors is None:
+			offsets = numpy.frombuffer(self.offsets, dtype=numpy.uint32)
+			sources = numpy.repeat(numpy.arange(self.size), numpy.diff(offsets).astype(numpy.int64))
+			self._vectors = (sources, numpy.frombuffer(self.targets, dtype=numpy.uint32), numpy.frombuffer(self.weights, dtype=numpy.float64))
+		return self._vectors
+
+
+def simple_graph(record):
+
+	''' The SimpleGraph of a stored snapshot (a GraphSnapshotFile), kept in instance memory so the tasks of a chunked computation only build it once per instance. '''
+
+	key = str(record.key())
+	if key not in _graphs:
+		_graphs.clear()
+		_graphs[key] = SimpleGraph(open_snapshot(record))
+	return _graphs[key]
+
+
+def _centrality_config():
+	return config.config.get('momentum.fatcatmap.graph.centrality')
+
+
+#### ==== Degree ==== ####
+def degree_centrality(graph, weighted=False):
+
+	''' Degree of every node over n-1 (as networkx), or with weighted, its total edge weight. Returns a list indexed by node ID. '''
+
+	scale = 1.0
+	if not weighted and len(graph) > 1:
+		scale = 1.0/(len(graph)-1)
+
+	if numpy is not None:
+		if weighted:
+			sources, targets, weights = graph.vectors()
+			return numpy.bincount(sources, weights=weights, minlength=len(graph)).tolist()
+		return (numpy.diff(numpy.frombuffer(graph.offsets, dtype=numpy.uint32)).astype(numpy.float64)*scale).tolist()
+
+	if weighted:
+		return [sum(graph.weights[graph.offsets[node_id]:graph.offsets[node_id+1]]) for node_id in xrange(0, len(graph))]
+	return [(graph.offsets[node_id+1]-graph.offsets[node_id])*scale for node_id in xrange(0, len(graph))]
+
+
+#### ==== Spectral ==== ####
+def _spread(graph, values):
+
+	''' One weighted sparse matrix-vector product: for every node, the sum of weight*values[neighbour] over its edges. '''
+
+	if numpy is not None:
+		sources, targets, weights = graph.vectors()
+		return numpy.bincount(targets, weights=weights*values[sources], minlength=len(graph))
+
+	result = [0.0]*len(graph)
+	for node_id in xrange(0, len(graph)):
+		value = values[node_id]
+		if value == 0.0:
+			continue
+		start, end = graph.offsets[node_id], graph.offsets[node_id+1]
+		for target, weight in zip(graph.targets[start:end], graph.weights[start:end]):
+			result[target] += weight*value
+	return result
+
+
+def eigenvector_centrality(graph, max_iterations=None, tolerance=None):
+
+	'''
+
+	Weighted eigenvector centrality by power iteration, normalised to unit length like
+	networkx's. Iterates x <- x + Ax rather than x <- Ax: the same leading eigenvector,
+	but it also converges on bipartite graphs (e.g. donors and recipients), where plain
+	power iteration oscillates. Returns a list indexed by node ID.
+
+	'''
+
+	cfg = _centrality_config()
+	max_iterations = max_iterations or cfg['max_iterations']
+	tolerance = tolerance or cfg['tolerance']
+
+	size = len(graph)
+	if size == 0:
+		return []
+
+	if numpy is not None:
+		values = numpy.ones(size)/size
+		for iteration in xrange(0, max_iterations):
+			updated = values+_spread(graph, values)
+			updated /= (numpy.sqrt((updated*updated).sum()) or 1.0)
+			change = numpy.abs(updated-values).sum()
+			values = updated
+			if change < size*tolerance:
+				break
+		return values.tolist()
+
+	values = [1.0/size]*size
+	for iteration in xrange(0, max_iterations):
+		updated = [value+spread for value, spread in zip(values, _spread(graph, values))]
+		norm = math.sqrt(sum([value*value for value in updated])) or 1.0
+		updated = [value/norm for value in updated]
+		change = sum([abs(new-old) for new, old in zip(updated, values)])
+		values = updated
+		if change < size*tolerance:
+			break
+	return values
+
+
+def pagerank(graph, damping=None, max_iterations=None, tolerance=None):
+
+	'''
+
+	Weighted PageRank by power iteration, summing to 1 (as networkx's pagerank_scipy,
+	which this follows). A node passes its score to its neighbours in proportion to
+	edge weight, and the score of nodes without edges is spread over every node.
+	Returns a list indexed by node ID.
+
+	'''
+
+	cfg = _centrality_config()
+	damping = damping or cfg['damping']
+	max_iterations = max_iterations or cfg['max_iterations']
+	tolerance = tolerance or cfg['tolerance']
+
+	size = len(graph)
+	if size == 0:
+		return []
+
+	strength = degree_centrality(graph, weighted=True)
+
+	if numpy is not None:
+		strength = numpy.array(strength)
+		inverse = numpy.zeros(size)
+		connected = strength > 0
+		inverse[connected] = 1.0/strength[connected]
+		dangling = ~connected
+
+		values = numpy.ones(size)/size
+		for iteration in xrange(0, max_iterations):
+			updated = damping*(_spread(graph, values*inverse)+values[dangling].sum()/size)+(1.0-damping)/size
+			change = numpy.abs(updated-values).sum()
+			values = updated
+			if change < size*tolerance:
+				break
+		return values.tolist()
+
+	inverse = [weight > 0 and 1.0/weight or 0.0 for weight in strength]
+	values = [1.0/size]*size
+	for iteration in xrange(0, max_iterations):
+		dangling = sum([value for value, weight in zip(values, strength) if weight == 0])/size
+		spread = _spread(graph, [value*factor for value, factor in zip(values, inverse)])
+		updated = [damping*(flow+dangling)+(1.0-damping)/size for flow in spread]
+		change = sum([abs(new-old) for new, old in zip(updated, values)])
+		values = updated
+		if change < size*tolerance:
+			break
+	return values
+
+
+#### ==== Betweenness ==== ####
+def sample_size(size, epsilon, delta):
+
+	'''
+
+	Sources to sample so that every node's estimated (normalised) betweenness is
+	within epsilon of the exact value with probability at least 1-delta: by Hoeffding's
+	bound and a union bound over the nodes, ln(2n/delta)/(2*epsilon^2).
+
+	'''
+
+	if size < 1:
+		return 0
+	return min(size, int(math.ceil(math.log(2.0*size/delta)/(2.0*epsilon*epsilon))))
+
+
+def betweenness_sources(size, epsilon=None, delta=None, seed=None):
+
+	'''
+
+	The random sample of source nodes that approximate betweenness is computed from,
+	sized by sample_size() for the error bound (epsilon, delta) and capped at
+	max_samples. The same seed always gives the same sample, so the tasks of a chunked
+	computation can each work through their own slice of it.
+
+	'''
+
+	cfg = _centrality_config()
+	epsilon = epsilon or cfg['epsilon']
+	delta = delta or cfg['delta']
+
+	if size < 3:
+		return []
+
+	count = min(sample_size(size, epsilon, delta), cfg['max_samples'])
+	if count < sample_size(size, epsilon, delta):
+		logging.warning('Betweenness sample capped at '+str(count)+' sources: error bound is '+str(math.sqrt(math.log(2.0*size/delta)/(2.0*count)))+', not '+str(epsilon)+'.')
+
+	return random.Random(seed).sample(xrange(0, size), count)
+
+
+def _dependencies(graph, sources):
+
+	''' Brandes' single-source dependency accumulation (unweighted shortest paths) from each source, summed per node. '''
+
+	offsets, targets = graph.offsets, graph.targets
+	totals = [0.0]*len(graph)
+
+	for source in sources:
+
+		sigma = {source: 1.0}
+		distance = {source: 0}
+		predecessors = {}
+		order = []
+
+		queue = deque([source])
+		while queue:
+			node_id = queue.popleft()
+			order.append(node_id)
+			next_distance = distance[node_id]+1
+			for neighbor in targets[offsets[node_id]:offsets[node_id+1]]:
+				if neighbor not in distance:
+					distance[neighbor] = next_distance
+					queue.append(neighbor)
+				if distance[neighbor] == next_distance:
+					sigma[neighbor] = sigma.get(neighbor, 0.0)+sigma[node_id]
+					predecessors.setdefault(neighbor, []).append(node_id)
+
+		dependency = dict.fromkeys(order, 0.0)
+		while order:
+			node_id = order.pop()
+			for predecessor in predecessors.get(node_id, []):
+				dependency[predecessor] += (sigma[predecessor]/sigma[node_id])*(1.0+dependency[node_id])
+			if node_id != source:
+				totals[node_id] += dependency[node_id]
+
+	return totals
+
+
+def _pool_dependencies(sources):
+	return _dependencies(_shared['graph'], sources)
+
+
+def dependencies(graph, sources, processes=None):
+
+	'''
+
+	Sums every node's shortest-path dependency on each of sources: the unscaled partial
+	betweenness for that slice of a sample. Sources are split over a process pool when
+	multiprocessing is available and more than one process is configured; the graph is
+	shared with the workers by forking. Returns a list indexed by node ID.
+
+	'''
+
+	if processes is None:
+		processes = _centrality_config()['processes']
+
+	started = time.time()
+	if multiprocessing is None or processes <= 1:
+		totals = _dependencies(graph, sources)
+	else:
+		_shared['graph'] = graph
+		pool = multiprocessing.Pool(processes)
+		try:
+			totals = [sum(values) for values in zip(*pool.map(_pool_dependencies, [sources[offset::processes] for offset in xrange(0, processes)]))]
+		finally:
+			pool.close()
+			pool.join()
+			_shared.clear()
+
+	logging.info('Accumulated dependencies from '+str(len(sources))+' of '+str(len(graph))+' sources in '+str(int(time.time()-started))+'s.')
+	return totals
+
+
+def scale_betweenness(totals, size, count):
+
+	''' Turns dependencies summed over a sample of count sources into normalised betweenness estimates. '''
+
+	if count == 0 or size < 3:
+		return [0.0]*size
+
+	scale = float(size)/(count*(size-1)*(size-2))
+	return [value*scale for value in totals]
+
+
+def approximate_betweenness(graph, epsilon=None, delta=None, processes=None, seed=None):
+
+	'''
+
+	Approximate normalised betweenness centrality (comparable with networkx's
+	betweenness_centrality(normalized=True)) from a random sample of source nodes (see
+	betweenness_sources), in one go. Exact when the sample covers every node. For
+	graphs too big to sample within one request, the ComputeInfluence pipeline works
+	through the sample in chunks instead. Returns a list indexed by node ID.
+
+	'''
+
+	sources = betweenness_sources(len(graph), epsilon, delta, seed)
+	return scale_betweenness(dependencies(graph, sources, processes), len(graph), len(sources))
+
+
+#### ==== Results ==== ####
+def top_nodes(snapshot, values, limit=10):
+
+	''' The limit highest-scoring nodes as (node key, score), best first. '''
+
+	best = sorted(xrange(0, len(values)), key=values.__getitem__, reverse=True)[0:limit]
+	return [(snapshot.key_for(node_id), values[node_id]) for node_id in best]
+
+
+def write_values(values, name):
+
+	''' Writes per-node values to a new blob, as little-endian floats by node ID. Returns the blob key. '''
+
+	data = array('f', values)
+	if sys.byteorder == 'big':
+		data.byteswap()
+
+	blob_key, size = write_blob([_SCORES_PREFIX.pack(_SCORES_MAGIC, _SCORES_VERSION, 0, len(values)), data.tostring()], 'graph-scores-'+name+'.fcms')
+	return blob_key
+
+
+def read_values(blob_key):
+
+	''' Loads a blob written by write_values as a zero-copy column of floats by node ID. '''
+
+	data = read_blob(blob_key)
+	magic, version, reserved, count = _SCORES_PREFIX.unpack_from(data, 0)
+	if magic != _SCORES_MAGIC or version != _SCORES_VERSION:
+		raise ValueError('Unrecognised score file.')
+	return Column(data, _SCORES_PREFIX.size, count, 'f')
+
+
+def save_scores(record, name, values):
+
+	''' Stores per-node scores computed from a stored snapshot (a GraphSnapshotFile). They're pruned along with the snapshot. '''
+
+	scores = GraphScoreFile(snapshot=record, name=name, blob=write_values(values, name), count=len(values))
+	scores.put()
+	return scores
+
+
+def open_scores(scores):
+
+	''' Loads a GraphScoreFile as a zero-copy column of floats by node ID, keeping the most recently opened one in instance memory. '''
+
+	key = str(scores.key())
+	if key not in _opened:
+		_opened.clear()
+		_opened[key] = read_values(GraphScoreFile.blob.get_value_for_datastore(scores))
+
+	return _opened[key]
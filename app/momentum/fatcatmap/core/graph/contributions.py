@@ -0,0 +1,125 @@
+import math
+import logging
+
+from google.appengine.ext import db
+
+from momentum.fatcatmap.models.services import ExtIDIndex
+from momentum.fatcatmap.models.opensecrets import ContributionTotal
+from momentum.fatcatmap.models.opensecrets import ContributionPartial
+from momentum.fatcatmap.core.graph.loader import build_edge_pair
+from momentum.fatcatmap.core.graph.registry import get_edge_type
+
+
+_PUT_CHUNK_SIZE = 500
+
+## Distinct triples held in memory before a combiner flushes early
+_MAX_COMBINED = 20000
+
+
+class ContributionCombiner(object):
+
+	'''
+
+	In-mapper combine step for bulk contribution loads. Registered as a pool on the
+	mapreduce context, so it's flushed at the end of every slice along with the
+	mutation pool.
+
+	Contributions are summed in memory per (contributor, recipient, cycle). On flush,
+	each sum is written as a ContributionPartial under its ContributionTotal, keyed by
+	run, shard, the byte offset the slice started at, and a flush sequence number - a
+	retried slice reads the same lines and rewrites the same partials, so nothing is
+	counted twice.
+
+	'''
+
+	def __init__(self, run, loader, shard_id):
+		self.run = run
+		self.loader = loader
+		self.shard_id = shard_id
+		self.start = None
+		self.sequence = 0
+		self.sums = {}
+
+	def add(self, offset, contributor, recipient, cycle, amount):
+
+		if self.start is None:
+			self.start = offset
+
+		triple = (contributor, recipient, cycle)
+		total, count = self.sums.get(triple, (0, 0))
+		self.sums[triple] = (total+amount, count+1)
+
+		if len(self.sums) >= _MAX_COMBINED:
+			self.flush()
+
+	def flush(self):
+
+		if len(self.sums) == 0:
+			return
+
+		edge_type = self.loader.mapping['contribution']['type']
+		partial_name = self.run+':'+self.shard_id+':'+str(self.start)+':'+str(self.sequence)
+
+		entities = []
+		for (contributor, recipient, cycle), (total, count) in self.sums.items():
+			total_key = ContributionTotal.key_for(cycle, contributor, recipient)
+			entities.append(ContributionTotal(key=total_key, loader=self.loader.name, run=self.run, edge_type=edge_type, contributor=contributor, recipient=recipient, cycle=cycle))
+			entities.append(ContributionPartial(key=db.Key.from_path(ContributionPartial.kind(), partial_name, parent=total_key), run=self.run, total=total, count=count))
+
+		for offset in xrange(0, len(entities), _PUT_CHUNK_SIZE):
+			db.put(entities[offset:offset+_PUT_CHUNK_SIZE])
+
+		logging.debug('Combined contributions into '+str(len(self.sums))+' partial sums ('+partial_name+').')
+
+		self.sums = {}
+		self.sequence += 1
+
+
+def sum_partials(total):
+
+	''' Sums a ContributionTotal's partials from its latest run (one ancestor query). Returns (total, count, the partials' keys). '''
+
+	amount, count, keys = 0, 0, []
+	for partial in ContributionPartial.all().ancestor(total.key()):
+		if partial.run == total.run:
+			amount += partial.total
+			count += partial.count
+		keys.append(partial.key())
+
+	return (amount, count, keys)
+
+
+def resolve_party(party):
+
+	''' Key of the ExtIDIndex entry for a "<service>:<id>" party. '''
+
+	service, value = party.split(':', 1)
+	return ExtIDIndex.key_for(service, value)
+
+
+def contribution_score(amount):
+
+	''' Edge score for a contribution total, in dollars: log10 of the amount, so a $1,000 total scores 3 and a $1,000,000 one 6. Refunds can leave a total negative - those score 0. '''
+
+	return math.log10(1.0+max(amount or 0, 0))
+
+
+def contribution_edges(total, amount, count):
+
+	''' Builds the CampaignContribution edge pair for a ContributionTotal, with total, count and a score derived from the total (see contribution_score) filled in. Returns [] if either party doesn't resolve to a node. '''
+
+	contributor, recipient = db.get([resolve_party(total.contributor), resolve_party(total.recipient)])
+	if contributor is None or recipient is None:
+		return []
+
+	edge_type, edge_class = get_edge_type(total.edge_type)
+
+	source = ExtIDIndex.node.get_value_for_datastore(contributor)
+	target = ExtIDIndex.node.get_value_for_datastore(recipient)
+	cycle = db.Key.from_path('ElectionCycle', total.cycle)
+
+	edges = build_edge_pair(edge_class, edge_type.key(), source, target, 'c:'+total.key().name(), total=amount, count=count, cycle=cycle, score=contribution_score(amount))
+	edges[0].is_source = True
+	edges[1].is_source = False
+
+	return edges
@@ -0,0 +1,183 @@
+import base64
+import binascii
+import simplejson as json
+
+from google.appengine.ext import db
+
+from momentum.fatcatmap.models.graph import Node
+from momentum.fatcatmap.models.graph import Edge
+
+
+_NODE_FIELDS = ['label', 'type', 'parent']
+_LINK_FIELDS = ['type', 'score']
+
+_PHASES = ['nodes', 'links']
+
+
+def encode_cursor(phase, cursor):
+	return base64.urlsafe_b64encode(phase+':'+(cursor or ''))
+
+
+def decode_cursor(token):
+
+	''' Returns a (phase, datastore cursor) tuple from an export cursor token. Raises ValueError for a malformed token. '''
+
+	if not token:
+		return ('nodes', None)
+
+	try:
+		decoded = base64.urlsafe_b64decode(str(token))
+	except (TypeError, binascii.Error):
+		raise ValueError('Invalid export cursor.')
+
+	if ':' not in decoded:
+		raise ValueError('Invalid export cursor.')
+
+	phase, cursor = decoded.split(':', 1)
+	if phase not in _PHASES:
+		raise ValueError('Invalid export cursor.')
+	return (phase, cursor or None)
+
+
+class GraphExport(object):
+
+	'''
+
+	Pages through every Node and then every Edge with datastore cursors, yielding
+	('node', dict) and ('link', dict) records until limit records have been produced.
+	Links reference nodes by key string, and only one edge of each partner pair is
+	exported. After iteration, next_cursor holds a token to resume from (or None when
+	the export is complete).
+
+	'''
+
+	def __init__(self, cursor=None, limit=1000, page_size=200, node_fields=None, link_fields=None):
+
+		self.phase, self.cursor = decode_cursor(cursor)
+		self.limit = limit
+		self.page_size = min(page_size, limit)
+		self.node_fields = [field for field in (node_fields or _NODE_FIELDS) if field in _NODE_FIELDS]
+		self.link_fields = [field for field in (link_fields or _LINK_FIELDS) if field in _LINK_FIELDS]
+		self.next_cursor = None
+
+		## A bad datastore cursor only fails once it's queried - fetch the first page now, rather than failing part way through a streamed response
+		self.first_page = None
+		if self.cursor is not None:
+			try:
+				self.first_page = self.fetch(self.page_size)
+			except (db.BadValueError, db.BadRequestError):
+				raise ValueError('Invalid export cursor.')
+
+	def query(self):
+		if self.phase == 'nodes':
+			query = Node.all()
+		else:
+			query = Edge.all()
+		if self.cursor is not None:
+			query.with_cursor(self.cursor)
+		return query
+
+	def fetch(self, count):
+
+		''' Fetches the next count entities of the current phase, and moves the cursor past them. '''
+
+		query = self.query()
+		batch = query.fetch(count)
+		self.cursor = query.cursor()
+		return batch
+
+	def encode_node(self, node):
+
+		record = {'id': str(node.key())}
+		if 'label' in self.node_fields:
+			record['label'] = node.label
+		if 'type' in self.node_fields:
+			node_type = Node.type.get_value_for_datastore(node)
+			record['type'] = node_type and node_type.name() or None
+		if 'parent' in self.node_fields:
+			record['parent'] = node.parent_key() and str(node.parent_key()) or None
+		return record
+
+	def encode_link(self, edge):
+
+		source = Edge.source.get_value_for_datastore(edge)
+		target = Edge.target.get_value_for_datastore(edge)
+
+		## Edges come in partner pairs - only export one direction
+		if source is None or target is None or str(source) > str(target):
+			return None
+
+		record = {'source': str(source), 'target': str(target)}
+		if 'type' in self.link_fields:
+			edge_type = Edge.type.get_value_for_datastore(edge)
+			record['type'] = edge_type and edge_type.name() or None
+		if 'score' in self.link_fields:
+			record['score'] = edge.score
+		return record
+
+	def __iter__(self):
+
+		produced = 0
+		while produced < self.limit:
+
+			requested = min(self.page_size, self.limit-produced)
+			if self.first_page is not None:
+				batch, self.first_page = self.first_page, None
+			else:
+				batch = self.fetch(requested)
+
+			for entity in batch:
+				produced += 1
+				if self.phase == 'nodes':
+					yield ('node', self.encode_node(entity))
+				else:
+					record = self.encode_link(entity)
+					if record is not None:
+						yield ('link', record)
+
+			## Page came back short: this phase is done
+			if len(batch) < requested:
+				if self.phase == 'links':
+					self.next_cursor = None
+					return
+				self.phase, self.cursor = 'links', None
+
+		self.next_cursor = encode_cursor(self.phase, self.cursor)
+
+
+def stream_ndjson(export):
+
+	''' Newline-delimited JSON: one {"node": ...} or {"link": ...} object per line, then a {"cursor": ...} line. '''
+
+	for kind, record in export:
+		yield json.dumps({kind: record})+'\n'
+	yield json.dumps({'cursor': export.next_cursor})+'\n'
+
+
+def stream_json(export):
+
+	''' A single {"nodes": [...], "links": [...], "cursor": ...} document, produced incrementally. '''
+
+	records = iter(export)
+	first_link = None
+
+	## Nodes always come before links
+	yield '{"nodes":['
+	separator = ''
+	for kind, record in records:
+		if kind == 'link':
+			first_link = record
+			break
+		yield separator+json.dumps(record)
+		separator = ','
+
+	yield '],"links":['
+	separator = ''
+	if first_link is not None:
+		yield json.dumps(first_link)
+		separator = ','
+	for kind, record in records:
+		yield separator+json.dumps(record)
+		separator = ','
+
+	yield '],"cursor":'+json.dumps(export.next_cursor)+'}'
@@ -0,0 +1,70 @@
+import logging
+
+from google.appengine.ext import db
+
+from momentum.fatcatmap.models.services import NodeID
+from momentum.fatcatmap.models.services import ExtService
+from momentum.fatcatmap.models.services import ExtIDIndex
+
+
+_PUT_CHUNK_SIZE = 500
+_GET_CHUNK_SIZE = 1000
+
+
+def build_ext_ids(node_key, ids, names=None, links=None):
+
+	'''
+
+	Builds (but does not save) the NodeID entities and reverse index entries for one
+	node's external IDs. ids is a dict of service => value; names optionally maps a
+	service to the ID's name (e.g. 'opensecrets' => 'crp_id'), which is also the
+	NodeID's key name, and links optionally maps a service to a URL.
+
+	'''
+
+	names = names or {}
+	links = links or {}
+
+	entities = []
+	for service, value in ids.items():
+
+		if value is None or value == '':
+			continue
+
+		name = names.get(service, service)
+		entities.append(NodeID(node_key, key_name=name, name=name, value=unicode(value), link=links.get(service), service=db.Key.from_path(ExtService.kind(), service)))
+		entities.append(ExtIDIndex(key=ExtIDIndex.key_for(service, value), node=node_key, name=name))
+
+	return entities
+
+
+def put_ext_ids(ext_ids, names=None):
+
+	''' Writes external IDs for many nodes at once. ext_ids is a list of (node key, {service: value}) tuples. Returns the number of IDs written. '''
+
+	entities = []
+	for node_key, ids in ext_ids:
+		entities.extend(build_ext_ids(node_key, ids, names))
+
+	for offset in xrange(0, len(entities), _PUT_CHUNK_SIZE):
+		db.put(entities[offset:offset+_PUT_CHUNK_SIZE])
+
+	logging.debug('Stored '+str(len(entities)/2)+' external IDs for '+str(len(ext_ids))+' nodes.')
+
+	return len(entities)/2
+
+
+def resolve_ext_ids(service, values):
+
+	''' Resolves external IDs to node keys without fetching the nodes: one batch get of the reverse index per _GET_CHUNK_SIZE values. Returns a dict of value => node key, for the values that resolved. '''
+
+	values = list(values)
+
+	resolved = {}
+	for offset in xrange(0, len(values), _GET_CHUNK_SIZE):
+		chunk = values[offset:offset+_GET_CHUNK_SIZE]
+		for value, entry in zip(chunk, db.get([ExtIDIndex.key_for(service, value) for value in chunk])):
+			if entry is not None:
+				resolved[value] = ExtIDIndex.node.get_value_for_datastore(entry)
+
+	return resolved
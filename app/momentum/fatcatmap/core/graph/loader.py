@@ -0,0 +1,456 @@
+import csv
+import config
+import hashlib
+import logging
+import time
+import datetime
+import simplejson as json
+
+from google.appengine.ext import db
+from google.appengine.api import taskqueue
+
+from momentum.fatcatmap.models.graph import SuperEdge
+from momentum.fatcatmap.models.graph import NodeAdjacency
+from momentum.fatcatmap.models.graph import Edge as GraphEdge
+from momentum.fatcatmap.models.graph import Node as GraphNode
+from momentum.fatcatmap.core.graph.extids import build_ext_ids
+from momentum.fatcatmap.core.graph.extids import resolve_ext_ids
+from momentum.fatcatmap.core.graph.registry import get_node_type
+from momentum.fatcatmap.core.graph.registry import get_edge_type
+
+
+## Loaders built from config, by name
+_loaders = {}
+
+## Lines a LoaderPool buffers before writing them out
+_MAX_BUFFERED = 250
+
+_PUT_CHUNK_SIZE = 500
+
+## Seconds between SuperEdge roll-ups for a node pair, and the queue they run on
+_ROLLUP_INTERVAL = 60
+_ROLLUP_QUEUE = 'graph-worker'
+
+
+class LoaderError(Exception):
+	pass
+
+
+#### ==== Value Converters ==== ####
+def _to_bool(value):
+	return value.lower() in ['1', 'y', 'yes', 't', 'true']
+
+def _to_date(value):
+	for date_format in ['%Y-%m-%d', '%m/%d/%Y', '%Y%m%d']:
+		try:
+			return datetime.datetime.strptime(value, date_format).date()
+		except ValueError:
+			continue
+	raise ValueError('Unrecognised date "'+value+'".')
+
+_CONVERTERS = {
+
+	'str': unicode,
+	'int': int,
+	'float': float,
+	'bool': _to_bool,
+	'date': _to_date,
+	'lower': lambda value: value.lower(),
+	'upper': lambda value: value.upper(),
+	'strip': lambda value: value.strip()
+
+}
+
+
+def convert(value, converters):
+
+	''' Runs a column value through a chain of named converters. Empty values become None and skip conversion. "key:<Kind>" converts to a key of that kind, with the value as key name. '''
+
+	if value is None or (isinstance(value, basestring) and value.strip() == ''):
+		return None
+
+	for name in converters:
+		if name.startswith('key:'):
+			value = db.Key.from_path(name[4:], value)
+		elif name in _CONVERTERS:
+			value = _CONVERTERS[name](value)
+		else:
+			raise LoaderError('Unknown converter "'+name+'".')
+
+	return value
+
+
+#### ==== Edges ==== ####
+def build_edge_pair(edge_class, edge_type, source, target, key_name, **kwargs):
+
+	''' Builds (but does not save) the two partnered entities of an edge, one in each node's entity group. Both share key_name, so each can name its partner before either is written. '''
+
+	source_key = db.Key.from_path(GraphEdge.kind(), key_name, parent=source)
+	target_key = db.Key.from_path(GraphEdge.kind(), key_name, parent=target)
+	super_edge_key = SuperEdge.key_for(source, target)
+
+	return [edge_class(source, key_name=key_name, source=source, target=target, partner=target_key, type=edge_type, connection=super_edge_key, **kwargs),
+			edge_class(target, key_name=key_name, source=target, target=source, partner=source_key, type=edge_type, connection=super_edge_key, **kwargs)]
+
+
+def connect_edges(edges, type_name):
+
+	''' Adds edges to their SuperEdge counters and to the adjacency index, and schedules a roll-up of each SuperEdge whose counters changed. Both are idempotent per edge (a re-run that changed an edge's score applies only the difference), and a retry after a failure between the two steps completes the second. '''
+
+	for edge in edges:
+		source = GraphEdge.source.get_value_for_datastore(edge)
+		target = GraphEdge.target.get_value_for_datastore(edge)
+		super_edge_key = GraphEdge.connection.get_value_for_datastore(edge)
+		if SuperEdge.accumulate(super_edge_key, edge.key(), edge.score):
+			schedule_rollup(super_edge_key, [source, target])
+		NodeAdjacency.add_neighbor(source, target, type_name, edge.score, edge.key())
+
+
+def schedule_rollup(super_edge_key, nodes):
+
+	''' Queues a roll-up of a SuperEdge's counters (see workers.graph). At most one runs per node pair per interval, when the interval ends, so it sees every accumulation made during it: the task is named for the pair and the interval's end, so later edges in the same interval find it already queued. '''
+
+	now = time.time()
+	interval_end = (int(now) / _ROLLUP_INTERVAL + 1) * _ROLLUP_INTERVAL
+	name = 'superedge-rollup-'+super_edge_key.name()+'-'+str(interval_end)
+
+	try:
+		taskqueue.Task(name=name, url='/_pc/workers/graph/rollup', countdown=max(interval_end-now, 0),
+					   params={'super_edge': str(super_edge_key), 'nodes': ','.join([str(node) for node in nodes])}).add(_ROLLUP_QUEUE)
+	except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+		logging.debug('SuperEdge roll-up already scheduled for '+str(super_edge_key)+'.')
+
+
+class _Record(dict):
+
+	''' A parsed line. Missing columns read as empty strings, so label templates never fail on a sparse record. '''
+
+	def __missing__(self, name):
+		return ''
+
+
+class BulkLoader(object):
+
+	'''
+
+	Turns lines of an offline dataset (CSV or JSON lines) into graph entities, driven by
+	a declarative mapping in config['momentum.fatcatmap.loaders']. A mapping has:
+
+		format			'csv' (default) or 'jsonl'
+		columns			CSV column names, in order (shards can't see a header line)
+		skip_header		skip the first line of the file
+		delimiter,
+		quotechar		CSV dialect (e.g. OpenSecrets bulk files quote with '|')
+		encoding		the file's text encoding (default 'utf-8' - OpenSecrets files
+						are 'latin-1'); lines that don't decode are skipped
+
+	plus a 'node', 'edge' or 'contribution' section. Fields map to a column name or to a
+	(column, converter, ...) tuple - see convert(). JSON columns may be dotted paths.
+
+		node:	type, label (a %(column)s template), native {property: field},
+				ext_ids {service: column}, ext_id_names {service: ID name}, and
+				dedup (the service whose ID identifies a record)
+
+		edge:	type, source and target (service, column) ext IDs of the nodes to
+				connect, fields {property: field}, score (a field) and id (a
+				field identifying a record, if the dataset has one)
+
+		contribution:	type, contributor and recipient (service, column), cycle and
+						amount - aggregated per (contributor, recipient, cycle) by the
+						contribution mapper (see core.graph.contributions)
+
+	Node keys are derived from the dedup ID (or the line itself), so re-running a load
+	or meeting the same record twice rewrites the same entities instead of duplicating
+	them; records whose dedup ID already resolves to a node are skipped. Loaded nodes
+	are not indexed for search - rebuild the search index after a large load. Loaded
+	edges aren't counted into SuperEdges or the adjacency index either - that's a
+	follow-up pass (mappers.loader.connect_loaded_edge).
+
+	'''
+
+	def __init__(self, name, mapping):
+
+		self.name = name
+		self.mapping = mapping
+		self.format = mapping.get('format', 'csv')
+		self.columns = mapping.get('columns')
+		self.skip_header = mapping.get('skip_header', False)
+		self.delimiter = str(mapping.get('delimiter', ','))
+		self.quotechar = str(mapping.get('quotechar', '"'))
+		self.encoding = str(mapping.get('encoding', 'utf-8'))
+
+		if 'node' not in mapping and 'edge' not in mapping and 'contribution' not in mapping:
+			raise LoaderError('Loader "'+name+'" maps neither nodes, edges nor contributions.')
+
+		if self.format == 'csv' and self.columns is None:
+			raise LoaderError('CSV loader "'+name+'" must declare its columns.')
+
+		dedup = mapping.get('node', {}).get('dedup')
+		if dedup is not None and dedup not in mapping['node'].get('ext_ids', {}):
+			raise LoaderError('Loader "'+name+'" dedups on "'+dedup+'", which is not one of its ext_ids.')
+
+	#### ==== Parsing ==== ####
+	def parse(self, line):
+
+		''' Parses one line into a record (a dict of column => value), or None for a blank line or one that isn't valid text in the mapping's encoding. '''
+
+		if line.strip() == '':
+			return None
+
+		try:
+			if self.format == 'jsonl':
+				return _Record(json.loads(line, encoding=self.encoding))
+
+			values = csv.reader([line], delimiter=self.delimiter, quotechar=self.quotechar).next()
+			return _Record([(column, value.decode(self.encoding)) for column, value in zip(self.columns, values)])
+
+		except UnicodeDecodeError, e:
+			logging.warning('Bulk loader "'+self.name+'" skipped a line that is not valid '+self.encoding+': '+str(e))
+			return None
+
+	def column(self, record, column):
+		value = record
+		for part in column.split('.'):
+			if not isinstance(value, dict):
+				return None
+			value = value.get(part)
+		return value
+
+	def field(self, record, field):
+
+		''' Value of a mapped field: a column name, or a (column, converter, ...) tuple. '''
+
+		if isinstance(field, (list, tuple)):
+			return convert(self.column(record, field[0]), field[1:])
+		return convert(self.column(record, field), [])
+
+	def record_id(self, record, line):
+
+		''' Stable identity for a record: a node's dedup ID or an edge's id field if the mapping has one, otherwise a hash of the line. '''
+
+		if 'node' in self.mapping:
+			dedup = self.mapping['node'].get('dedup')
+			if dedup is not None:
+				value = self.field(record, self.mapping['node']['ext_ids'][dedup])
+				if value is not None:
+					return dedup+':'+unicode(value)
+
+		elif 'id' in self.mapping['edge']:
+			value = self.field(record, self.mapping['edge']['id'])
+			if value is not None:
+				return self.name+':'+unicode(value)
+
+		return self.name+':'+hashlib.sha1(line).hexdigest()
+
+	def lookups(self, record):
+
+		''' The (service, value) external IDs a record needs resolved to nodes: a node's dedup ID, or an edge's source and target. '''
+
+		if 'node' in self.mapping:
+			section = self.mapping['node']
+			dedup = section.get('dedup')
+			if dedup is None or dedup not in section.get('ext_ids', {}):
+				return []
+			value = self.field(record, section['ext_ids'][dedup])
+			if value is None:
+				return []
+			return [(dedup, value)]
+
+		lookups = []
+		for service, column in [self.mapping['edge']['source'], self.mapping['edge']['target']]:
+			value = self.field(record, column)
+			if value is not None:
+				lookups.append((service, value))
+		return lookups
+
+	def resolve(self, records):
+
+		''' Resolves every external ID a list of records needs, with batched gets of the ext ID index per service. Returns a dict of (service, value) => node key, for the IDs that resolved. '''
+
+		by_service = {}
+		for record in records:
+			for service, value in self.lookups(record):
+				by_service.setdefault(service, set([])).add(value)
+
+		resolved = {}
+		for service, values in by_service.items():
+			for value, node_key in resolve_ext_ids(service, values).items():
+				resolved[(service, value)] = node_key
+
+		return resolved
+
+	#### ==== Nodes ==== ####
+	def node_entities(self, record, line, resolved):
+
+		''' Node, native and external ID entities for a record, or [] if its dedup ID already belongs to a node (resolved is the result of resolve()). '''
+
+		section = self.mapping['node']
+
+		ext_ids = {}
+		for service, field in section.get('ext_ids', {}).items():
+			value = self.field(record, field)
+			if value is not None:
+				ext_ids[service] = value
+
+		dedup = section.get('dedup')
+		if dedup is not None and dedup in ext_ids:
+			if (dedup, ext_ids[dedup]) in resolved:
+				return []
+
+		node_type, native_class = get_node_type(section['type'])
+
+		node_key = db.Key.from_path(GraphNode.kind(), self.record_id(record, line))
+		node = GraphNode(key=node_key, label=section['label'] % record, type=node_type.key())
+		native = native_class(node_key, key_name='native', node=node_key)
+
+		for prop_name, field in section.get('native', {}).items():
+			setattr(native, prop_name, self.field(record, field))
+
+		return [node, native]+build_ext_ids(node_key, ext_ids, section.get('ext_id_names'))
+
+	#### ==== Edges ==== ####
+	def edge_endpoints(self, record, resolved):
+
+		''' Source and target node keys for an edge record, from the result of resolve(). Returns (None, None) if either doesn't resolve. '''
+
+		section = self.mapping['edge']
+
+		keys = []
+		for service, column in [section['source'], section['target']]:
+			value = self.field(record, column)
+			if value is None or (service, value) not in resolved:
+				return (None, None)
+			keys.append(resolved[(service, value)])
+
+		return tuple(keys)
+
+	def edge_entities(self, record, line, resolved):
+
+		''' The two Edge entities (one in each node's entity group, partnered) for a record, or [] if its endpoints don't resolve. '''
+
+		section = self.mapping['edge']
+
+		source, target = self.edge_endpoints(record, resolved)
+		if source is None:
+			return []
+
+		edge_type, edge_class = get_edge_type(section['type'])
+
+		kwargs = {}
+		for prop_name, field in section.get('fields', {}).items():
+			kwargs[prop_name] = self.field(record, field)
+		if 'score' in section:
+			kwargs['score'] = self.field(record, section['score'])
+
+		return build_edge_pair(edge_class, edge_type.key(), source, target, 'l:'+self.record_id(record, line), **kwargs)
+
+	#### ==== Contributions ==== ####
+	def contribution(self, line):
+
+		''' Parses a contribution line into (contributor, recipient, cycle, amount), with both parties as "<service>:<id>", or None if any part is missing. '''
+
+		record = self.parse(line)
+		if record is None:
+			return None
+
+		section = self.mapping['contribution']
+
+		parties = []
+		for service, column in [section['contributor'], section['recipient']]:
+			value = self.field(record, column)
+			if value is None:
+				return None
+			parties.append(service+':'+unicode(value))
+
+		cycle = self.field(record, section['cycle'])
+		amount = self.field(record, section['amount'])
+		if cycle is None or amount is None:
+			return None
+
+		return (parties[0], parties[1], unicode(cycle), amount)
+
+	#### ==== Loading ==== ####
+	def entities(self, lines):
+
+		''' Parses a batch of lines and returns (entities to put, number of records loaded, number skipped). External IDs for the whole batch are resolved at once. '''
+
+		if 'node' not in self.mapping and 'edge' not in self.mapping:
+			raise LoaderError('Loader "'+self.name+'" does not map nodes or edges.')
+
+		parsed = []
+		for line in lines:
+			record = self.parse(line)
+			if record is not None:
+				parsed.append((record, line))
+
+		resolved = self.resolve([record for record, line in parsed])
+
+		entities, loaded = [], 0
+		for record, line in parsed:
+			if 'node' in self.mapping:
+				record_entities = self.node_entities(record, line, resolved)
+			else:
+				record_entities = self.edge_entities(record, line, resolved)
+			if len(record_entities) > 0:
+				entities.extend(record_entities)
+				loaded += 1
+
+		return (entities, loaded, len(lines)-loaded)
+
+
+class LoaderPool(object):
+
+	'''
+
+	Batches a bulk load for a mapper shard. Registered as a pool on the mapreduce
+	context (like ContributionCombiner), so it's flushed at the end of every slice
+	along with the mutation pool.
+
+	Lines are buffered, then loaded together: external IDs are resolved with batched
+	gets and entities are written with batched puts. Entity keys are deterministic, so
+	a retried slice just rewrites what it wrote before.
+
+	'''
+
+	def __init__(self, loader, counters=None):
+		self.loader = loader
+		self.counters = counters
+		self.lines = []
+
+	def add(self, line):
+
+		self.lines.append(line)
+
+		if len(self.lines) >= _MAX_BUFFERED:
+			self.flush()
+
+	def flush(self):
+
+		if len(self.lines) == 0:
+			return
+
+		entities, loaded, skipped = self.loader.entities(self.lines)
+
+		for offset in xrange(0, len(entities), _PUT_CHUNK_SIZE):
+			db.put(entities[offset:offset+_PUT_CHUNK_SIZE])
+
+		if self.counters is not None:
+			self.counters.increment('loader-records', loaded)
+			self.counters.increment('loader-skipped', skipped)
+
+		logging.debug('Bulk loader "'+self.loader.name+'" loaded '+str(loaded)+' of '+str(len(self.lines))+' lines.')
+
+		self.lines = []
+
+
+def get_loader(name):
+
+	''' Returns the instance-wide BulkLoader for a mapping in config['momentum.fatcatmap.loaders']. '''
+
+	if name not in _loaders:
+		mappings = config.config.get('momentum.fatcatmap.loaders')
+		if name not in mappings:
+			raise LoaderError('No bulk loader mapping named "'+name+'".')
+		_loaders[name] = BulkLoader(name, mappings[name])
+
+	return _loaders[name]
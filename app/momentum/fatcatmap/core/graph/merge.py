@@ -0,0 +1,224 @@
+import config
+import hashlib
+import logging
+import datetime
+
+from google.appengine.ext import db
+
+from momentum.fatcatmap.models.graph import SuperEdge
+from momentum.fatcatmap.models.graph import NodeAdjacency
+from momentum.fatcatmap.models.graph import AdjacencyMark
+from momentum.fatcatmap.models.graph import Edge as GraphEdge
+from momentum.fatcatmap.models.graph import Native as GraphNative
+from momentum.fatcatmap.models.services import NodeID
+from momentum.fatcatmap.models.services import ExtIDIndex
+from momentum.fatcatmap.models.resolution import NodeMerge
+from momentum.fatcatmap.models.resolution import MergeLock
+from momentum.fatcatmap.core.graph.extids import build_ext_ids
+from momentum.fatcatmap.core.graph.loader import build_edge_pair
+from momentum.fatcatmap.core.graph.loader import connect_edges
+from momentum.fatcatmap.core.search.index import unindex_node
+
+
+_PAGE_SIZE = 200
+
+## Edge properties that describe the edge's position, and are rebuilt rather than copied
+_POSITIONAL_PROPERTIES = frozenset(['source', 'target', 'partner', 'connection', 'type'])
+
+
+class MergeLocked(Exception):
+
+	''' Raised when another merge holds one of the nodes, or moved it first. The merge should be retried later. '''
+
+
+def _descendants(model_class, ancestor):
+
+	''' Every descendant of ancestor of a kind, in pages. '''
+
+	results = []
+	last = None
+	while True:
+		query = model_class.all().ancestor(ancestor).order('__key__')
+		if last is not None:
+			query.filter('__key__ >', last)
+		page = query.fetch(_PAGE_SIZE)
+		results.extend(page)
+		if len(page) < _PAGE_SIZE:
+			return results
+		last = page[-1].key()
+
+
+def _copy_properties(source, target):
+	for name, prop in source.properties().items():
+		if not name.startswith('_') and name not in _POSITIONAL_PROPERTIES:
+			setattr(target, name, prop.get_value_for_datastore(source))
+
+
+def resolve_merged(node_key):
+
+	''' Follows NodeMerge records from a node to the node it was (eventually) merged into. Returns node_key itself if it was never merged. '''
+
+	seen = set([])
+	while node_key not in seen:
+		seen.add(node_key)
+		merge = db.get(NodeMerge.key_for(node_key))
+		if merge is None:
+			return node_key
+		node_key = NodeMerge.canonical.get_value_for_datastore(merge)
+
+	return node_key
+
+
+def acquire_lock(node_key, holder):
+
+	''' Takes a node's MergeLock for holder, in a transaction. Re-entrant for the same holder, and a lock older than lock_timeout is taken over. Returns False if someone else holds it. '''
+
+	timeout = datetime.timedelta(seconds=config.config.get('momentum.fatcatmap.resolution')['lock_timeout'])
+
+	def txn():
+		now = datetime.datetime.now()
+		lock = db.get(MergeLock.key_for(node_key))
+		if lock is not None and lock.holder != holder and now-lock.acquired < timeout:
+			return False
+		MergeLock(key=MergeLock.key_for(node_key), holder=holder, acquired=now).put()
+		return True
+
+	return db.run_in_transaction(txn)
+
+
+def release_lock(node_key, holder):
+
+	''' Releases a node's MergeLock, if holder still holds it. '''
+
+	def txn():
+		lock = db.get(MergeLock.key_for(node_key))
+		if lock is not None and lock.holder == holder:
+			lock.delete()
+
+	db.run_in_transaction(txn)
+
+
+def merge_nodes(canonical_key, duplicate_key, score=None):
+
+	'''
+
+	Merges a duplicate node into a canonical one, holding both nodes' MergeLocks so no
+	other merge touching either runs at the same time (see _merge_nodes). Raises
+	MergeLocked if a lock is held elsewhere, or if the canonical node was itself merged
+	away while this merge waited: a retry resolves the new canonical node.
+
+	'''
+
+	canonical_key = resolve_merged(canonical_key)
+	if canonical_key == duplicate_key:
+		return False
+
+	holder = 'merge:'+str(duplicate_key)
+
+	## Always lock in key order, so two merges can't each hold the lock the other waits on
+	locked = []
+	try:
+		for node_key in sorted([canonical_key, duplicate_key], key=str):
+			if not acquire_lock(node_key, holder):
+				raise MergeLocked('Node '+str(node_key)+' is being merged elsewhere.')
+			locked.append(node_key)
+
+		if resolve_merged(canonical_key) != canonical_key:
+			raise MergeLocked('Node '+str(canonical_key)+' was merged while waiting.')
+
+		return _merge_nodes(canonical_key, duplicate_key, score)
+
+	finally:
+		for node_key in locked:
+			release_lock(node_key, holder)
+
+
+def _merge_nodes(canonical_key, duplicate_key, score=None):
+
+	'''
+
+	Merges a duplicate node into a canonical one:
+
+		1) the duplicate's external IDs are re-created on the canonical node, which
+		   repoints the ext ID index (so later loads resolve to the canonical node) -
+		   where the canonical node has its own ID of the same name, that's kept and
+		   only the index entry is repointed
+		2) each of its edges is rebuilt between the canonical node and the other end,
+		   keeping the edge's properties, and the old edge pair is deleted
+		3) the other ends' adjacency entries and SuperEdges for the duplicate go, its
+		   search postings and autocomplete entries are removed, and the duplicate's
+		   node, native, IDs and adjacency are deleted
+		4) a NodeMerge records where the duplicate went
+
+	Every step can be repeated safely, so a failed merge is simply retried. Returns
+	False if there was nothing to merge.
+
+	'''
+
+	duplicate = db.get(duplicate_key)
+	if duplicate is None:
+		return False
+
+	## 1) External IDs (NodeID shares its kind with EdgeID, so keep only the node's own)
+	node_ids = [node_id for node_id in _descendants(NodeID, duplicate_key) if isinstance(node_id, NodeID) and node_id.parent_key() == duplicate_key]
+	existing = db.get([db.Key.from_path(node_id.key().kind(), node_id.key().name(), parent=canonical_key) for node_id in node_ids])
+	for node_id, canonical_id in zip(node_ids, existing):
+		service = NodeID.service.get_value_for_datastore(node_id)
+		if service is None or node_id.value is None:
+			continue
+
+		## NodeIDs are named by ID name, so the canonical node's own ID for the service is kept - only the index entry moves
+		if canonical_id is not None:
+			db.put(ExtIDIndex(key=ExtIDIndex.key_for(service.name(), node_id.value), node=canonical_key, name=node_id.name))
+		else:
+			db.put(build_ext_ids(canonical_key, {service.name(): node_id.value}, {service.name(): node_id.name}, {service.name(): node_id.link}))
+
+	## 2) Edges
+	edges = [edge for edge in _descendants(GraphEdge, duplicate_key) if GraphEdge.source.get_value_for_datastore(edge) == duplicate_key]
+	partners = db.get([GraphEdge.partner.get_value_for_datastore(edge) for edge in edges])
+
+	rebuilt, stale, neighbors = [], [], set([])
+	for edge, partner in zip(edges, partners):
+
+		other = GraphEdge.target.get_value_for_datastore(edge)
+		stale.append(edge.key())
+		if partner is not None:
+			stale.append(partner.key())
+		neighbors.add(other)
+
+		## An edge between the two nodes being merged just disappears
+		if other == canonical_key:
+			continue
+
+		## Named for the whole old edge key (IDs are only unique per parent), so edges from different duplicates never collide
+		pair = build_edge_pair(edge.__class__, GraphEdge.type.get_value_for_datastore(edge), canonical_key, other, 'm:'+hashlib.sha1(str(edge.key())).hexdigest())
+		_copy_properties(edge, pair[0])
+		if partner is not None:
+			_copy_properties(partner, pair[1])
+		rebuilt.append((GraphEdge.type.get_value_for_datastore(edge).name(), pair))
+
+	if len(rebuilt) > 0:
+		db.put([entity for type_name, pair in rebuilt for entity in pair])
+		for type_name, pair in rebuilt:
+			connect_edges(pair, type_name)
+
+	## 3) Drop the duplicate from the graph
+	for neighbor in neighbors:
+		NodeAdjacency.remove_neighbor(neighbor, duplicate_key)
+		super_edge_key = SuperEdge.key_for(duplicate_key, neighbor)
+		db.delete([super_edge_key]+SuperEdge.shard_keys(super_edge_key))
+
+	natives = GraphNative.all().ancestor(duplicate_key).fetch(_PAGE_SIZE)
+	unindex_node(duplicate, len(natives) > 0 and natives[0] or None)
+	adjacency = NodeAdjacency.shard_keys(duplicate_key, duplicate.adjacency_shards or 1)+[mark.key() for mark in _descendants(AdjacencyMark, duplicate_key)]
+	deleted = stale+[node_id.key() for node_id in node_ids]+[native.key() for native in natives]+adjacency
+	for offset in xrange(0, len(deleted), _PAGE_SIZE):
+		db.delete(deleted[offset:offset+_PAGE_SIZE])
+
+	## 4) Record the merge before the node itself goes, so references can always be followed
+	NodeMerge(key=NodeMerge.key_for(duplicate_key), canonical=canonical_key, label=duplicate.label, score=score).put()
+	db.delete(duplicate_key)
+
+	logging.info('Merged node '+str(duplicate_key)+' ("'+unicode(duplicate.label)+'") into '+str(canonical_key)+', moving '+str(len(rebuilt))+' edges.')
+
+	return True
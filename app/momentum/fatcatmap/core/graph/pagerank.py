@@ -0,0 +1,168 @@
+import config
+
+from google.appengine.ext import db
+
+from momentum.fatcatmap.models.graph import Node
+from momentum.fatcatmap.models.graph import PageRankScore
+from momentum.fatcatmap.core.graph.query import fetch_adjacency
+
+
+_GET_CHUNK_SIZE = 500
+
+## Mapreduce counters only hold integers, so sums of scores are counted in millionths
+_PRECISION = 1000000.0
+
+
+def to_counter(value):
+	return int(round(value*_PRECISION))
+
+
+def from_counter(count):
+	return count/_PRECISION
+
+
+def popularity(rank):
+
+	''' Maps a PageRank score (1.0 for an average node) onto a 0-1 popularity: an average node scores 0.5, the most connected approach 1. '''
+
+	return rank/(1.0+rank)
+
+
+class PopularityWriter(object):
+
+	'''
+
+	Writes a PageRank run's converged scores as Node.popularity for a mapper shard.
+	Registered as a pool on the mapreduce context, so it's flushed at the end of every
+	slice along with the mutation pool.
+
+	Node keys are buffered, and on flush their scores and the nodes themselves are
+	read with one batch get. Only nodes whose popularity actually changes are
+	written, each with Node.set_score (a transaction that re-reads the node, so
+	concurrent writes to it aren't lost). The run's last two iterations of scores
+	are deleted here too, after they've been read: the context flushes its pools
+	in no particular order, so the deletes can't go through the mutation pool.
+
+	'''
+
+	def __init__(self, run, iteration, counters=None):
+		self.run = run
+		self.iteration = iteration
+		self.counters = counters
+		self.node_keys = []
+
+	def add(self, node_key):
+
+		self.node_keys.append(node_key)
+
+		if len(self.node_keys) >= _GET_CHUNK_SIZE:
+			self.flush()
+
+	def flush(self):
+
+		if len(self.node_keys) == 0:
+			return
+
+		entities = db.get([PageRankScore.key_for(self.run, self.iteration, node_key) for node_key in self.node_keys]+self.node_keys)
+		scores, nodes = entities[0:len(self.node_keys)], entities[len(self.node_keys):]
+
+		written = 0
+		for node_key, score, node in zip(self.node_keys, scores, nodes):
+			if score is None or node is None or node.popularity == popularity(score.rank):
+				continue
+			if Node.set_score(node_key, 'popularity', popularity(score.rank)):
+				written += 1
+
+		db.delete([PageRankScore.key_for(self.run, previous, node_key) for node_key in self.node_keys for previous in xrange(max(self.iteration-1, 0), self.iteration+1)])
+
+		if self.counters is not None:
+			self.counters.increment('pagerank-written', written)
+
+		self.node_keys = []
+
+
+def weighted_neighbors(node):
+
+	''' A node's neighbours as a list of (neighbour key, total edge weight), with parallel edges of different types summed and self-loops dropped. '''
+
+	weights = {}
+	for neighbor, edge_type, score in fetch_adjacency([node])[node.key()]:
+		if neighbor != node.key():
+			key, weight = weights.get(str(neighbor), (neighbor, 0.0))
+			weights[str(neighbor)] = (key, weight+(score or 0.0))
+	return weights.values()
+
+
+def initial_score(run, node):
+
+	''' Iteration 0 of a run: every node starts at 1.0, with its total edge weight recorded. '''
+
+	strength = sum([weight for neighbor, weight in weighted_neighbors(node)])
+	return PageRankScore(key=PageRankScore.key_for(run, 0, node.key()), rank=1.0, strength=strength)
+
+
+def iterate_score(run, iteration, node, nodes, dangling):
+
+	'''
+
+	One PageRank iteration for one node, as a gather: the node reads its neighbours'
+	scores from the previous iteration (one batch get per 500) and sums the share of
+	each that flows along the edge between them, in proportion to the edge's weight
+	in the neighbour's total. The adjacency index is symmetric, so a node's
+	neighbours are exactly the nodes that link to it.
+
+		rank = (1-d) + d*(sum of shares + dangling/nodes)
+
+	Scores average 1.0, and the score of nodes without edges (dangling) is spread
+	evenly over every node so none is lost. Returns the new PageRankScore and the
+	node's previous rank.
+
+	'''
+
+	cfg = config.config.get('momentum.fatcatmap.graph.pagerank')
+	damping = cfg['damping']
+
+	neighbors = weighted_neighbors(node)
+	keys = [PageRankScore.key_for(run, iteration-1, neighbor) for neighbor, weight in neighbors]+[PageRankScore.key_for(run, iteration-1, node.key())]
+
+	scores = []
+	for offset in xrange(0, len(keys), _GET_CHUNK_SIZE):
+		scores.extend(db.get(keys[offset:offset+_GET_CHUNK_SIZE]))
+
+	shares = 0.0
+	for (neighbor, weight), score in zip(neighbors, scores):
+		if score is not None and score.strength > 0:
+			shares += score.rank*(weight/score.strength)
+
+	## A node created during the run has no previous score: work out its strength now
+	previous = scores[-1]
+	if previous is None:
+		previous = PageRankScore(rank=1.0, strength=sum([weight for neighbor, weight in neighbors]))
+
+	rank = (1.0-damping)+damping*(shares+(dangling/max(nodes, 1)))
+	return (PageRankScore(key=PageRankScore.key_for(run, iteration, node.key()), rank=rank, strength=previous.strength), previous.rank)
+
+
+def next_step(iteration, counters):
+
+	'''
+
+	Decides what follows a finished PageRank pass, from the pass's mapreduce counters:
+	('iterate', nodes, dangling) to run another iteration, or ('write', nodes, mean
+	change) once scores have converged or max_iterations is reached.
+
+	'''
+
+	cfg = config.config.get('momentum.fatcatmap.graph.pagerank')
+
+	nodes = counters.get('pagerank-nodes')
+	dangling = from_counter(counters.get('pagerank-dangling'))
+
+	if iteration == 0:
+		return ('iterate', nodes, dangling)
+
+	change = from_counter(counters.get('pagerank-change'))/max(nodes, 1)
+	if change < cfg['tolerance'] or iteration >= cfg['max_iterations']:
+		return ('write', nodes, change)
+
+	return ('iterate', nodes, dangling)
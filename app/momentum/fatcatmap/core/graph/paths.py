@@ -0,0 +1,284 @@
+import time
+import config
+import hashlib
+import logging
+
+from google.appengine.ext import db
+from google.appengine.api import memcache
+
+from momentum.fatcatmap.models.graph import Node
+from momentum.fatcatmap.core.graph.query import encode_node
+from momentum.fatcatmap.core.graph.query import filter_entries
+from momentum.fatcatmap.core.graph.query import fetch_adjacency
+
+
+_GET_CHUNK_SIZE = 500
+_MEMCACHE_NAMESPACE = 'graph-paths'
+
+
+class PathSearch(object):
+
+	'''
+
+	One side of a bidirectional path search, grown a hop at a time from its root.
+	Holds every node reached so far with its distance in hops from the root, and the
+	edges it was first reached by - every edge from the previous hop, so all of the
+	shortest routes back to the root can be followed. With every_route, it also keeps
+	edges between nodes it had already reached, so routes longer than the shortest
+	(up to the hops searched) can be followed too.
+
+	'''
+
+	def __init__(self, root, every_route=False):
+		self.root = root
+		self.every_route = every_route
+		self.level = 0
+		self.frontier = [root]
+		self.depth = {root: 0}
+		self.parents = {root: []}
+
+	def expand(self, nodes, types=None, min_score=None, fanout=None, budget=None):
+
+		'''
+
+		Grows the search by one hop, with one batch get for the whole frontier's
+		adjacency shards (nodes holds the frontier's Node entities, by key). Parallel
+		edges of different types count once, as the best-scoring one; at most fanout
+		neighbours are followed from each node, and at most budget new nodes are taken.
+		Returns the keys of the new frontier.
+
+		'''
+
+		frontier = [nodes[key] for key in self.frontier if nodes.get(key) is not None]
+		adjacency = fetch_adjacency(frontier)
+		self.level += 1
+
+		discovered = []
+		for node in frontier:
+
+			followed = {}
+			for neighbor, edge_type, score in filter_entries(adjacency[node.key()], types, min_score):
+				if fanout is not None and len(followed) >= fanout:
+					break
+				if neighbor != node.key() and neighbor not in followed:
+					followed[neighbor] = True
+
+					depth = self.depth.get(neighbor)
+					if depth is None:
+						if budget is not None and len(discovered) >= budget:
+							continue
+						depth = self.depth[neighbor] = self.level
+						self.parents[neighbor] = []
+						discovered.append(neighbor)
+
+					if neighbor != self.root and (depth == self.level or self.every_route):
+						self.parents[neighbor].append((node.key(), edge_type, score or 0.0))
+
+		self.frontier = discovered
+		return discovered
+
+	def routes(self, key, limit, hops=None, avoid=()):
+
+		''' Up to limit simple routes of at most hops (by default, the hops searched) from the root to a reached node, each a list of (node key, edge type, score) with the edge each node was reached by (None for the root). '''
+
+		if key == self.root:
+			return [[(key, None, None)]]
+
+		if hops is None:
+			hops = self.level
+
+		routes = []
+		if hops <= 0:
+			return routes
+
+		for parent, edge_type, score in self.parents[key]:
+			if parent in avoid:
+				continue
+			for route in self.routes(parent, limit-len(routes), hops-1, avoid+(key,)):
+				routes.append(route+[(key, edge_type, score)])
+			if len(routes) >= limit:
+				break
+		return routes
+
+
+def edge_cost(score):
+
+	''' Length of an edge when paths are weighted by score: stronger connections are shorter, and no edge is longer than one hop. '''
+
+	return 1.0/(1.0+max(score, 0.0))
+
+
+def join_paths(forward, backward, limit, deadline=None):
+
+	'''
+
+	Joins the routes of two searches wherever they meet, into distinct simple paths
+	from the forward root to the backward root. Meeting nodes are taken shortest
+	first, and at most limit paths are built. Returns a list of (node keys, edges),
+	with an (edge type, score) for each hop.
+
+	If deadline (a timestamp) passes, joining stops after the current meeting node
+	and the paths built so far are returned.
+
+	'''
+
+	if len(backward.depth) < len(forward.depth):
+		meetings = [key for key in backward.depth if key in forward.depth]
+	else:
+		meetings = [key for key in forward.depth if key in backward.depth]
+	meetings.sort(key=lambda key: forward.depth[key]+backward.depth[key])
+
+	paths = []
+	seen = set()
+	for meeting in meetings:
+
+		for head in forward.routes(meeting, limit):
+			for tail in backward.routes(meeting, limit):
+
+				tail = list(reversed(tail))
+				keys = [key for key, edge_type, score in head]+[key for key, edge_type, score in tail[1:]]
+				path = tuple([str(key) for key in keys])
+				if path in seen or len(set(path)) < len(path):
+					continue
+				seen.add(path)
+
+				edges = [(edge_type, score) for key, edge_type, score in head[1:]]+[(edge_type, score) for key, edge_type, score in tail[0:-1]]
+				paths.append((keys, edges))
+				if len(paths) >= limit:
+					return paths
+
+		if deadline is not None and time.time() > deadline:
+			break
+
+	return paths
+
+
+def _get_nodes(keys, nodes):
+
+	''' Batch gets any of keys not already in nodes (a dict of key => Node, updated in place). '''
+
+	missing = [key for key in keys if key not in nodes]
+	for offset in xrange(0, len(missing), _GET_CHUNK_SIZE):
+		chunk = missing[offset:offset+_GET_CHUNK_SIZE]
+		nodes.update(zip(chunk, Node.get(chunk)))
+
+
+def _cache_key(source, target, k, max_hops, types, min_score, fanout, weight):
+	return hashlib.md5('|'.join([str(source), str(target), str(k), str(max_hops), ','.join(sorted(types or [])), str(min_score), str(fanout), weight])).hexdigest()
+
+
+def find_paths(source, target, k=None, max_hops=None, types=None, min_score=None, fanout=None, weight='hops'):
+
+	'''
+
+	Answers "how are these two connected": the k shortest distinct paths between two
+	nodes, up to max_hops long, as {'source', 'target', 'nodes', 'paths', 'complete'}.
+
+	Searches outwards from both nodes at once, over the adjacency index rather than a
+	loaded graph, growing whichever side has the smaller frontier by a hop at a time -
+	so each hop costs two batch gets (the frontier's nodes, then their adjacency
+	shards), and a path of four hops is found by reaching two hops out from each end.
+	The type and score filters, fan-out and node budgets (see config) keep each hop
+	bounded.
+
+	With weight 'hops', paths are ranked by length, and the search stops as soon as it
+	has k of them. With weight 'score', edges are shorter the stronger they are (see
+	edge_cost), so the search runs to max_hops, keeping every route, and ranks up to
+	max_candidates of the paths it found by total length: the best weighted paths
+	within max_hops, as a bidirectional Dijkstra limited to that many hops would find.
+
+	Complete results are cached per node pair and parameters. A search that runs out
+	of time or node budget returns the paths found so far, with complete set to False,
+	and isn't cached.
+
+	'''
+
+	cfg = config.config.get('momentum.fatcatmap.graph.paths')
+	started = time.time()
+	deadline = started+cfg['deadline']
+
+	k = k or cfg['paths']
+	max_hops = max_hops or cfg['max_hops']
+	fanout = fanout or cfg['fanout']
+
+	source, target = db.Key(str(source)), db.Key(str(target))
+
+	cache_key = _cache_key(source, target, k, max_hops, types, min_score, fanout, weight)
+	result = memcache.get(cache_key, namespace=_MEMCACHE_NAMESPACE)
+	if result is not None:
+		return result
+
+	nodes = {}
+	_get_nodes([source, target], nodes)
+	if nodes[source] is None or nodes[target] is None:
+		return None
+
+	forward, backward = PathSearch(source, weight != 'hops'), PathSearch(target, weight != 'hops')
+
+	complete = True
+	found = []
+	while source != target and forward.level+backward.level < max_hops:
+
+		if time.time() > deadline:
+			logging.warning('Path search from '+str(source)+' to '+str(target)+' stopped at the deadline, '+str(forward.level+backward.level)+' hops out.')
+			complete = False
+			break
+
+		## Grow the side with the smaller frontier: fewer gets, and fewer new nodes to check
+		sides = [side for side in [forward, backward] if len(side.frontier) > 0]
+		if len(sides) == 0:
+			break
+		side = min(sides, key=lambda side: len(side.frontier))
+
+		budget = min(cfg['level_nodes'], cfg['max_nodes']-len(forward.depth)-len(backward.depth))
+		if budget <= 0:
+			logging.warning('Path search from '+str(source)+' to '+str(target)+' stopped at the node budget, '+str(forward.level+backward.level)+' hops out.')
+			complete = False
+			break
+
+		_get_nodes(side.frontier, nodes)
+		side.expand(nodes, types, min_score, fanout, budget)
+
+		if weight == 'hops':
+			found = join_paths(forward, backward, k, deadline)
+			if len(found) >= k:
+				break
+
+	if source == target:
+		found = [([source], [])]
+	elif weight != 'hops':
+		found = join_paths(forward, backward, cfg['max_candidates'], deadline)
+		found.sort(key=lambda path: sum([edge_cost(score) for edge_type, score in path[1]]))
+	found = found[0:k]
+
+	## Joining may have been cut short too (score-ranked paths can be missing better ones even with k found)
+	if time.time() > deadline and (weight != 'hops' or len(found) < k):
+		complete = False
+
+	## Encode each node on a path once, with its distance from the source
+	_get_nodes([key for keys, edges in found for key in keys], nodes)
+
+	encoded = {}
+	paths = []
+	for keys, edges in found:
+
+		for position, key in enumerate(keys):
+			if str(key) not in encoded and nodes.get(key) is not None:
+				encoded[str(key)] = encode_node(nodes[key], position)
+			elif str(key) in encoded:
+				encoded[str(key)]['depth'] = min(encoded[str(key)]['depth'], position)
+
+		links = []
+		for (node_a, node_b), (edge_type, score) in zip(zip(keys[0:-1], keys[1:]), edges):
+			links.append({'source': str(node_a), 'target': str(node_b), 'type': edge_type, 'score': score})
+
+		paths.append({'nodes': [str(key) for key in keys], 'links': links, 'hops': len(links), 'length': sum([edge_cost(score) for edge_type, score in edges])})
+
+	result = {'source': str(source), 'target': str(target), 'nodes': encoded.values(), 'paths': paths, 'complete': complete}
+
+	logging.info('Found '+str(len(paths))+' paths from '+str(source)+' to '+str(target)+', reaching '+str(len(forward.depth)+len(backward.depth))+' nodes in '+str(int((time.time()-started)*1000))+'ms.')
+
+	if complete:
+		memcache.set(cache_key, result, time=cfg['cache_ttl'], namespace=_MEMCACHE_NAMESPACE)
+
+	return result
@@ -0,0 +1,118 @@
+from google.appengine.ext import db
+
+from momentum.fatcatmap.models.graph import Node
+from momentum.fatcatmap.models.graph import SuperEdge
+from momentum.fatcatmap.models.graph import NodeAdjacency
+
+
+def fetch_adjacency(nodes):
+
+	''' Fetches the adjacency shards for a list of nodes with one batch get. Returns a dict of node key => list of (neighbor key, edge type, score). '''
+
+	shard_keys = []
+	for node in nodes:
+		shard_keys.extend(NodeAdjacency.shard_keys(node.key(), node.adjacency_shards or 1))
+
+	adjacency = dict([(node.key(), []) for node in nodes])
+	for shard in db.get(shard_keys):
+		if shard is not None:
+			adjacency[shard.parent_key()].extend(shard.entries())
+
+	return adjacency
+
+
+def filter_entries(entries, types=None, min_score=None, fanout=None):
+
+	''' Applies edge type and score filters to a node's adjacency entries, keeping the fanout highest-scoring. '''
+
+	if types is not None:
+		entries = [entry for entry in entries if entry[1] in types]
+	if min_score is not None:
+		entries = [entry for entry in entries if entry[2] >= min_score]
+
+	entries = sorted(entries, key=lambda entry: entry[2], reverse=True)
+	if fanout is not None:
+		entries = entries[0:fanout]
+	return entries
+
+
+def fetch_super_scores(pairs):
+
+	''' Fetches SuperEdge scores for a list of (node, node) pairs with one batch get. Missing SuperEdges score 0. '''
+
+	keys = [SuperEdge.key_for(node_a, node_b) for node_a, node_b in pairs]
+
+	scores = {}
+	for key, super_edge in zip(keys, db.get(keys)):
+		scores[key] = super_edge is not None and super_edge.score or 0.0
+	return scores
+
+
+def encode_node(node, depth):
+
+	node_type = Node.type.get_value_for_datastore(node)
+	return {'id': str(node.key()), 'label': node.label, 'type': node_type and node_type.name() or None, 'depth': depth}
+
+
+def neighborhood(root, depth=2, fanout=25, types=None, min_score=None, min_super_score=None, max_nodes=500):
+
+	'''
+
+	Returns the k-hop neighbourhood around root as {'root', 'nodes', 'links'}, or None
+	if there's no such root node.
+
+	Works one frontier level at a time, so each hop costs a fixed number of batch
+	gets (adjacency shards, optionally SuperEdges, then the next frontier's nodes)
+	regardless of how many nodes are on the frontier. At every node only the fanout
+	best-scoring edges that pass the type and score filters are followed, and
+	expansion stops once max_nodes nodes have been collected.
+
+	'''
+
+	root = db.Key(str(root))
+	root_node = Node.get(root)
+	if root_node is None:
+		return None
+
+	nodes = {root: encode_node(root_node, 0)}
+	links = {}
+	frontier = [root_node]
+
+	for level in xrange(1, depth+1):
+
+		if len(frontier) == 0 or len(nodes) >= max_nodes:
+			break
+
+		adjacency = fetch_adjacency(frontier)
+
+		candidates = []
+		for node in frontier:
+			for neighbor, edge_type, score in filter_entries(adjacency[node.key()], types, min_score, fanout):
+				candidates.append((node.key(), neighbor, edge_type, score))
+
+		## Prune on aggregate connection strength between the two nodes
+		if min_super_score is not None and len(candidates) > 0:
+			super_scores = fetch_super_scores([(source, target) for source, target, edge_type, score in candidates])
+			candidates = [candidate for candidate in candidates if super_scores[SuperEdge.key_for(candidate[0], candidate[1])] >= min_super_score]
+
+		next_keys = []
+		next_seen = set()
+		for source, target, edge_type, score in candidates:
+
+			if target not in nodes and target not in next_seen:
+				if len(nodes)+len(next_keys) >= max_nodes:
+					continue
+				next_keys.append(target)
+				next_seen.add(target)
+
+			pair = tuple(sorted([str(source), str(target)]))+(edge_type,)
+			if pair not in links:
+				links[pair] = {'source': str(source), 'target': str(target), 'type': edge_type, 'score': score}
+
+		frontier = [node for node in Node.get(next_keys) if node is not None]
+		for node in frontier:
+			nodes[node.key()] = encode_node(node, level)
+
+	## Drop links to nodes we didn't keep
+	node_ids = dict([(str(key), True) for key in nodes.keys()])
+	return {'root': str(root), 'nodes': nodes.values(), 'links': [link for link in links.values() if link['source'] in node_ids and link['target'] in node_ids]}
@@ -0,0 +1,117 @@
+import time
+import logging
+
+from google.appengine.ext import db
+from google.appengine.api import memcache
+
+from tipfy import import_string
+
+from momentum.fatcatmap.models.graph import NodeType
+from momentum.fatcatmap.models.graph import EdgeType
+
+
+_VERSION_KEY = 'graph-type-registry-version'
+_VERSION_CHECK_INTERVAL = 30
+
+## Seconds a type name that failed to resolve is remembered, before a lookup may reload again
+_MISS_TTL = 60
+
+_registry = None
+
+
+class TypeRegistry(object):
+
+	'''
+
+	Holds every NodeType and EdgeType, plus their resolved implementation classes, in
+	instance memory. Types are loaded once per instance; a version counter in memcache
+	(checked at most every _VERSION_CHECK_INTERVAL seconds) tells instances to reload
+	after a type changes. An unknown name reloads once, in case the type is new, and
+	is then remembered as missing for _MISS_TTL seconds (or until the next load), so
+	repeated lookups of a bad name don't reload every time.
+
+	'''
+
+	def __init__(self):
+		self.version = None
+		self.checked = 0
+		self.node_types = {}
+		self.edge_types = {}
+		self.misses = {}
+
+	def load(self):
+
+		node_types = {}
+		for node_type in NodeType.all().fetch(1000):
+			node_types[node_type.key().name()] = (node_type, import_string('.'.join(node_type.native_impl_class)))
+
+		edge_types = {}
+		for edge_type in EdgeType.all().fetch(1000):
+			edge_types[edge_type.key().name()] = (edge_type, import_string('.'.join(edge_type.edge_impl_class)))
+
+		self.node_types = node_types
+		self.edge_types = edge_types
+		self.misses = {}
+		self.version = current_version()
+		self.checked = time.time()
+
+		logging.debug('Loaded type registry version '+str(self.version)+' ('+str(len(node_types))+' node types, '+str(len(edge_types))+' edge types).')
+
+	def check(self):
+
+		if self.version is None:
+			return self.load()
+
+		if time.time()-self.checked > _VERSION_CHECK_INTERVAL:
+			self.checked = time.time()
+			if current_version() != self.version:
+				self.load()
+
+	def resolve(self, kind, name):
+
+		self.check()
+		if name not in getattr(self, kind+'_types'):
+
+			## Might be a type created since we last loaded - unless it was missing from a recent load too
+			if time.time()-self.misses.get((kind, name), 0) > _MISS_TTL:
+				self.load()
+
+			if name not in getattr(self, kind+'_types'):
+				self.misses.setdefault((kind, name), time.time())
+				raise db.BadValueError('Could not resolve '+kind+' type "'+str(name)+'".')
+
+		return getattr(self, kind+'_types')[name]
+
+
+def current_version():
+	return memcache.get(_VERSION_KEY) or 0
+
+
+def get_registry():
+
+	global _registry
+	if _registry is None:
+		_registry = TypeRegistry()
+	return _registry
+
+
+def get_node_type(name):
+
+	''' Returns a (NodeType, native impl class) tuple. '''
+
+	return get_registry().resolve('node', name)
+
+
+def get_edge_type(name):
+
+	''' Returns an (EdgeType, edge impl class) tuple. '''
+
+	return get_registry().resolve('edge', name)
+
+
+def invalidate():
+
+	''' Bumps the registry version, so every instance reloads its types. Call after writing NodeTypes or EdgeTypes. '''
+
+	memcache.incr(_VERSION_KEY, initial_value=0)
+	get_registry().version = None
@@ -0,0 +1,224 @@
+import re
+import config
+import logging
+
+from google.appengine.ext import db
+
+from nltk.metrics.distance import edit_distance
+
+from momentum.fatcatmap.models.resolution import ResolutionBlock
+
+
+_NON_ALPHANUMERIC = re.compile(r'[^a-z0-9 ]+')
+
+## Tokens that don't distinguish one contributor from another
+_STOP_TOKENS = frozenset(['mr', 'mrs', 'ms', 'dr', 'hon', 'jr', 'sr', 'ii', 'iii', 'the', 'of', 'and',
+						  'inc', 'incorporated', 'llc', 'llp', 'lp', 'corp', 'corporation', 'co', 'company', 'ltd', 'plc'])
+
+_SOUNDEX_CODES = {}
+for letters, code in [('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'), ('l', '4'), ('mn', '5'), ('r', '6')]:
+	for letter in letters:
+		_SOUNDEX_CODES[letter] = code
+
+
+#### ==== Normalisation ==== ####
+def normalize_name(name):
+
+	'''
+
+	Normalises a contributor name for matching: lowercased, punctuation and stop
+	tokens (honorifics, suffixes, corporate forms) removed, whitespace collapsed.
+	"LAST, FIRST M" (the OpenSecrets/FEC form) is reordered to "first m last".
+
+	'''
+
+	if name is None:
+		return u''
+
+	name = unicode(name).lower().strip()
+
+	## "SMITH, JOHN A" => "john a smith"
+	if name.count(',') == 1:
+		last, first = name.split(',')
+		name = first+' '+last
+
+	tokens = [token for token in _NON_ALPHANUMERIC.sub(' ', name).split() if token not in _STOP_TOKENS]
+	return u' '.join(tokens)
+
+
+def soundex(token):
+
+	''' American Soundex code for a token (e.g. "robert" => "r163"). '''
+
+	token = ''.join([letter for letter in token.lower() if letter.isalpha()])
+	if token == '':
+		return ''
+
+	code = token[0]
+	last = _SOUNDEX_CODES.get(token[0], '')
+	for letter in token[1:]:
+		digit = _SOUNDEX_CODES.get(letter, '')
+		if digit != '' and digit != last:
+			code += digit
+			if len(code) == 4:
+				break
+		if letter not in 'hw':
+			last = digit
+
+	return (code+'000')[0:4]
+
+
+def blocking_keys(normalized):
+
+	'''
+
+	Blocking keys for a normalised name. Two names are only ever compared if they
+	share a key, so each name gets a few keys that survive the usual variations:
+
+		s:	soundex of the last token, plus the first token's initial
+			(typos and spelling variants in the surname)
+		p:	the first four letters of the two longest tokens, sorted
+			(word order, and missing middle names or initials)
+
+	'''
+
+	tokens = normalized.split()
+	if len(tokens) == 0:
+		return []
+
+	keys = []
+
+	surname = soundex(tokens[-1])
+	if surname != '':
+		keys.append('s:'+surname+':'+tokens[0][0])
+
+	longest = sorted(sorted(tokens, key=len, reverse=True)[0:2])
+	keys.append('p:'+'|'.join([token[0:4] for token in longest]))
+
+	return keys
+
+
+#### ==== Scoring ==== ####
+def similarity(a, b):
+
+	''' Similarity of two normalised names, from 0 to 1: one minus the edit distance over the longer length, taking the better of the names as given and with their tokens sorted. '''
+
+	longest = float(max(len(a), len(b)))
+	if longest == 0:
+		return 0.0
+
+	sorted_a = ' '.join(sorted(a.split()))
+	sorted_b = ' '.join(sorted(b.split()))
+
+	return 1.0-(min(edit_distance(a, b), edit_distance(sorted_a, sorted_b))/longest)
+
+
+class ContributorResolver(object):
+
+	'''
+
+	Finds duplicate contributors through a blocking index of ResolutionBlocks.
+
+	match() adds a node to the blocks for its name (one transaction per block, which
+	returns the block's other members) and scores it against those members only, so
+	matching stays linear in the number of contributors. Blocks that reach
+	max_block_size (very common names) overflow, and are no longer compared against.
+
+	'''
+
+	def __init__(self):
+
+		cfg = config.config.get('momentum.fatcatmap.resolution')
+
+		self.threshold = cfg['threshold']
+		self.max_block_size = cfg['max_block_size']
+		self.min_name_length = cfg['min_name_length']
+
+	def add_to_block(self, block, node_key, normalized):
+
+		'''
+
+		Adds a node to a block, returning the block's other (node key, name) members.
+		Idempotent. Once a block reaches max_block_size it's marked overflowed and
+		emptied: nothing is compared against it, and nothing more is added, so very
+		common names don't become a contended (and ever growing) entity. Returns None
+		for an overflowed block.
+
+		'''
+
+		block_key = ResolutionBlock.key_for(block)
+
+		## Overflowed blocks never change again, so a plain get keeps them out of any transaction
+		entity = db.get(block_key)
+		if entity is not None and entity.overflowed:
+			return None
+
+		def txn():
+
+			entity = db.get(block_key)
+			if entity is None:
+				entity = ResolutionBlock(key=block_key)
+
+			if entity.overflowed:
+				return None
+
+			members = zip(entity.nodes, entity.names)
+			if node_key not in entity.nodes:
+
+				if len(entity.nodes) >= self.max_block_size:
+					entity.overflowed = True
+					entity.nodes, entity.names = [], []
+					entity.put()
+					return None
+
+				entity.nodes.append(node_key)
+				entity.names.append(normalized)
+				entity.put()
+
+			return [(key, name) for key, name in members if key != node_key]
+
+		return db.run_in_transaction(txn)
+
+	def candidates(self, node_key, normalized):
+
+		candidates = {}
+		for block in blocking_keys(normalized):
+			members = self.add_to_block(block, node_key, normalized)
+			if members is None:
+				logging.debug('Resolution block "'+block+'" is too large to compare against.')
+				continue
+			for key, name in members:
+				candidates[key] = name
+
+		return candidates
+
+	def match(self, node_key, name):
+
+		''' Returns the (node key, score) pairs of nodes that look like duplicates of this one, best first. '''
+
+		normalized = normalize_name(name)
+		if len(normalized) < self.min_name_length:
+			return []
+
+		matches = []
+		for key, candidate in self.candidates(node_key, normalized).items():
+
+			## Cheap bound first: edit distance is at least the difference in length
+			if abs(len(candidate)-len(normalized)) > (1.0-self.threshold)*max(len(candidate), len(normalized)):
+				continue
+
+			score = similarity(normalized, candidate)
+			if score >= self.threshold:
+				matches.append((key, score))
+
+		matches.sort(key=lambda match: match[1], reverse=True)
+		return matches
+
+
+def canonical_pair(node_a, node_b):
+
+	''' Orders a matched pair as (canonical, duplicate): the lower key always survives, so both sides of a match agree on the merge. '''
+
+	if str(node_a) < str(node_b):
+		return (node_a, node_b)
+	return (node_b, node_a)
@@ -0,0 +1,768 @@
+import sys
+import time
+import config
+import struct
+import logging
+import datetime
+import simplejson as json
+
+from array import array
+
+from google.appengine.api import files
+from google.appengine.ext import db
+from google.appengine.ext import blobstore
+
+from momentum.fatcatmap.models.graph import Node
+from momentum.fatcatmap.models.graph import GraphScoreFile
+from momentum.fatcatmap.models.graph import NodeAdjacency
+from momentum.fatcatmap.models.graph import GraphSnapshotFile
+
+
+## Snapshot file layout version - bump on any change to the layout below
+FORMAT_VERSION = 1
+
+_MAGIC = 'FCMG'
+_BUILD_MAGIC = 'FCMB'
+_PREFIX = struct.Struct('<4sHHI')
+_ALIGNMENT = 8
+_WRITE_SIZE = 512*1024
+_ITER_SIZE = 65536
+
+## Column type codes, shared by the in-memory arrays and the file (always little-endian there)
+_OFFSET_TYPE = 'I'
+_TARGET_TYPE = 'I'
+_WEIGHT_TYPE = 'f'
+_EDGE_TYPE = 'H'
+
+## The snapshot file most recently opened by this instance, by GraphSnapshotFile key
+_opened = {}
+
+
+class SnapshotFormatError(Exception):
+	pass
+
+
+class GraphSnapshot(object):
+
+	'''
+
+	A read-only copy of the graph in compressed sparse row (CSR) form, for analytics
+	that need the whole graph in memory.
+
+	Nodes are numbered 0..n-1 in key order. Node i's adjacency entries are positions
+	offsets[i] to offsets[i+1] of three parallel arrays:
+
+		targets		neighbour node ID
+		weights		edge score (single precision)
+		types		edge type, as an index into type_names
+
+	That's 10 bytes per entry, against several hundred for a networkx.Graph. Both
+	partners of an edge are in the adjacency index, so every edge appears once from
+	each end. keys maps node IDs back to key strings, and id_for() the other way.
+
+	The arrays are either array.arrays (a fresh build) or zero-copy views over a
+	snapshot file (see load_snapshot).
+
+	'''
+
+	def __init__(self, keys, offsets, targets, weights, types, type_names, built=None, index=None):
+
+		self.keys = keys
+		self.offsets = offsets
+		self.targets = targets
+		self.weights = weights
+		self.types = types
+		self.type_names = type_names
+		self.built = built
+
+		self.index = index
+		if index is None:
+			self.index = dict((key, node_id) for node_id, key in enumerate(keys))
+
+	def __len__(self):
+		return len(self.keys)
+
+	@property
+	def node_count(self):
+		return len(self)
+
+	@property
+	def edge_count(self):
+		return len(self.targets)
+
+	def id_for(self, key):
+
+		''' Node ID for a node key (or key string), or None if the node isn't in the snapshot. '''
+
+		return self.index.get(str(key))
+
+	def key_for(self, node_id):
+		return db.Key(self.keys[node_id])
+
+	def type_ids(self, type_names):
+
+		''' The set of edge type indexes for a list of type names, ignoring types the snapshot has never seen. '''
+
+		return set([self.type_names.index(name) for name in type_names if name in self.type_names])
+
+	def degree(self, node_id):
+		return self.offsets[node_id+1]-self.offsets[node_id]
+
+	def neighbors(self, node_id):
+		return [entry[0] for entry in self.entries(node_id)]
+
+	def entries(self, node_id, type_ids=None):
+
+		''' Yields (neighbour ID, weight, type index) for a node's adjacency entries, optionally only those of some edge types. '''
+
+		start, end = self.offsets[node_id], self.offsets[node_id+1]
+		for entry in zip(self.targets[start:end], self.weights[start:end], self.types[start:end]):
+			if type_ids is None or entry[2] in type_ids:
+				yield entry
+
+	def graph(self, types=None):
+
+		''' A networkx-style view of the snapshot (see SnapshotGraph), optionally restricted to some edge types. '''
+
+		return SnapshotGraph(self, types)
+
+
+class SnapshotBuilder(object):
+
+	'''
+
+	Builds a GraphSnapshot from the datastore in two cursor-paged phases:
+
+		nodes		Node keys, keys-only and in key order, are numbered as they arrive
+		adjacency	NodeAdjacency shards are read in key order too, which groups them
+					by parent node in the same order, so each node's entries can be
+					appended to the arrays as they arrive (no sort, no second copy)
+
+	Edges are read through the adjacency index rather than as Edge entities: one shard
+	carries up to 2500 entries, and an Edge key alone doesn't say where the edge goes.
+
+	step() reads one page, so a build can be spread over several requests or tasks
+	with the builder kept in between; build() steps until done or out of time.
+	Entries pointing at nodes that aren't in the snapshot (e.g. deleted since) are
+	dropped and counted in skipped.
+
+	'''
+
+	def __init__(self, node_page_size=None, adjacency_page_size=None):
+
+		cfg = config.config.get('momentum.fatcatmap.graph.snapshot')
+
+		self.node_page_size = node_page_size or cfg['node_page_size']
+		self.adjacency_page_size = adjacency_page_size or cfg['adjacency_page_size']
+
+		self.phase = 'nodes'
+		self.cursor = None
+		self.skipped = 0
+		self.started = time.time()
+
+		self.keys = []
+		self.index = {}
+		self.offsets = array(_OFFSET_TYPE, [0])
+		self.targets = array(_TARGET_TYPE)
+		self.weights = array(_WEIGHT_TYPE)
+		self.types = array(_EDGE_TYPE)
+		self.type_names = []
+
+	@property
+	def done(self):
+		return self.phase == 'done'
+
+	def type_index(self, type_name):
+		try:
+			return self.type_names.index(type_name)
+		except ValueError:
+			self.type_names.append(type_name)
+			return len(self.type_names)-1
+
+	def close_until(self, node_id):
+
+		''' Closes off every node before node_id, so entries appended next belong to node_id. '''
+
+		while len(self.offsets) <= node_id:
+			self.offsets.append(len(self.targets))
+
+	#### ==== Phases ==== ####
+	def read_nodes(self):
+
+		query = Node.all(keys_only=True).order('__key__')
+		if self.cursor is not None:
+			query.with_cursor(self.cursor)
+
+		page = query.fetch(self.node_page_size)
+		self.cursor = query.cursor()
+
+		for key in page:
+			key = str(key)
+			self.index[key] = len(self.keys)
+			self.keys.append(key)
+
+		return len(page) == self.node_page_size
+
+	def read_adjacency(self):
+
+		query = NodeAdjacency.all().order('__key__')
+		if self.cursor is not None:
+			query.with_cursor(self.cursor)
+
+		page = query.fetch(self.adjacency_page_size)
+		self.cursor = query.cursor()
+
+		for shard in page:
+
+			source = self.index.get(str(shard.parent_key()))
+
+			## Orphaned shards, and (defensively) any that arrive out of order
+			if source is None or source < len(self.offsets)-1:
+				self.skipped += len(shard.neighbors)
+				continue
+
+			self.close_until(source)
+			for neighbor, edge_type, score in shard.entries():
+				target = self.index.get(str(neighbor))
+				if target is None:
+					self.skipped += 1
+					continue
+				self.targets.append(target)
+				self.weights.append(score or 0.0)
+				self.types.append(self.type_index(edge_type))
+
+		return len(page) == self.adjacency_page_size
+
+	#### ==== Building ==== ####
+	def step(self):
+
+		''' Reads one page of the current phase. Returns True once the build is complete. '''
+
+		if self.phase == 'nodes':
+			if not self.read_nodes():
+				logging.info('Graph snapshot: read '+str(len(self.keys))+' nodes.')
+				self.phase, self.cursor = 'adjacency', None
+
+		elif self.phase == 'adjacency':
+			if not self.read_adjacency():
+				self.close_until(len(self.keys))
+				logging.info('Graph snapshot: read '+str(len(self.targets))+' adjacency entries ('+str(self.skipped)+' skipped).')
+				self.phase, self.cursor = 'done', None
+
+		return self.done
+
+	def build(self, deadline=None):
+
+		''' Steps until the build is complete, or until deadline (a time.time() value) passes. Returns the GraphSnapshot, or None if time ran out first. '''
+
+		while not self.done:
+			if deadline is not None and time.time() >= deadline:
+				return None
+			self.step()
+
+		return self.snapshot()
+
+	def snapshot(self):
+
+		if not self.done:
+			raise ValueError('Graph snapshot build is not complete.')
+
+		return GraphSnapshot(self.keys, self.offsets, self.targets, self.weights, self.types, self.type_names, built=self.started, index=self.index)
+
+	#### ==== Resuming ==== ####
+	def dump(self):
+
+		''' The builder's state as a list of strings (a JSON header, then the raw arrays), for SnapshotBuilder.load to carry on with in another request. '''
+
+		columns = [self.offsets, self.targets, self.weights, self.types]
+		header = json.dumps({'phase': self.phase, 'cursor': self.cursor, 'skipped': self.skipped, 'started': self.started,
+							 'node_page_size': self.node_page_size, 'adjacency_page_size': self.adjacency_page_size,
+							 'keys': self.keys, 'type_names': self.type_names, 'lengths': [len(column) for column in columns]})
+
+		return [_PREFIX.pack(_BUILD_MAGIC, FORMAT_VERSION, 0, len(header)), header]+[column.tostring() for column in columns]
+
+	@classmethod
+	def load(cls, data):
+
+		''' Restores a builder from the output of dump(). '''
+
+		magic, version, reserved, header_length = _PREFIX.unpack_from(data, 0)
+		if magic != _BUILD_MAGIC or version != FORMAT_VERSION:
+			raise SnapshotFormatError('Not a graph snapshot build in progress.')
+
+		header = json.loads(data[_PREFIX.size:_PREFIX.size+header_length])
+
+		builder = cls(header['node_page_size'], header['adjacency_page_size'])
+		builder.phase, builder.cursor, builder.skipped, builder.started = str(header['phase']), header['cursor'], header['skipped'], header['started']
+		builder.keys = [str(key) for key in header['keys']]
+		builder.index = dict([(key, node_id) for node_id, key in enumerate(builder.keys)])
+		builder.type_names = [str(type_name) for type_name in header['type_names']]
+
+		position = _PREFIX.size+header_length
+		for column, length in zip([builder.offsets, builder.targets, builder.weights, builder.types], header['lengths']):
+			del column[:]
+			column.fromstring(data[position:position+length*column.itemsize])
+			position += length*column.itemsize
+
+		return builder
+
+
+def build_snapshot(deadline=None):
+
+	''' Builds a GraphSnapshot of the whole graph in one go. Returns None if deadline passes first. '''
+
+	return SnapshotBuilder().build(deadline)
+
+
+def save_build(builder):
+
+	''' Stores an unfinished SnapshotBuilder in the blobstore, so the build can carry on in another task. Returns the blob key. '''
+
+	return write_blob(builder.dump(), 'graph-snapshot-build.fcmb')[0]
+
+
+def resume_build(blob_key):
+
+	''' Loads a SnapshotBuilder stored by save_build. '''
+
+	return SnapshotBuilder.load(read_blob(blob_key))
+
+
+class SnapshotGraph(object):
+
+	'''
+
+	Read-only adapter giving a GraphSnapshot the part of the networkx.Graph API that
+	the algorithms we run (traversal, shortest paths, centrality, components) rely on,
+	so they work on a snapshot unchanged. Nodes are snapshot node IDs.
+
+	The graph is undirected, and parallel entries between two nodes (different edge
+	types) are merged into one edge whose 'weight' is their summed score. G[n] is
+	built on demand from the arrays rather than stored, so it's cheap to hold but not
+	to index repeatedly in a tight loop - use the snapshot's arrays for that.
+
+	'''
+
+	def __init__(self, snapshot, types=None, name='snapshot'):
+
+		self.snapshot = snapshot
+		self.name = name
+		self.type_ids = None
+		if types is not None:
+			self.type_ids = snapshot.type_ids(types)
+
+	def __str__(self):
+		return self.name
+
+	def __iter__(self):
+		return iter(xrange(len(self.snapshot)))
+
+	def __contains__(self, n):
+		return isinstance(n, (int, long)) and 0 <= n < len(self.snapshot)
+
+	def __len__(self):
+		return len(self.snapshot)
+
+	def __getitem__(self, n):
+
+		''' Neighbours of n, as {neighbour: {'weight': summed score}}. '''
+
+		adjacency = {}
+		for target, weight, edge_type in self.snapshot.entries(n, self.type_ids):
+			if target in adjacency:
+				adjacency[target]['weight'] += weight
+			else:
+				adjacency[target] = {'weight': weight}
+		return adjacency
+
+	#### ==== Nodes ==== ####
+	def nodes_iter(self, data=False):
+		if data:
+			return ((n, {}) for n in self)
+		return iter(self)
+
+	def nodes(self, data=False):
+		return list(self.nodes_iter(data))
+
+	def number_of_nodes(self):
+		return len(self.snapshot)
+
+	def order(self):
+		return len(self.snapshot)
+
+	def has_node(self, n):
+		return n in self
+
+	def nbunch_iter(self, nbunch=None):
+		if nbunch is None:
+			return iter(self)
+		if nbunch in self:
+			return iter([nbunch])
+		return (n for n in nbunch if n in self)
+
+	#### ==== Edges ==== ####
+	def neighbors_iter(self, n):
+		return iter(self[n])
+
+	def neighbors(self, n):
+		return self[n].keys()
+
+	def has_edge(self, u, v):
+		return u in self and v in self[u]
+
+	def get_edge_data(self, u, v, default=None):
+		return self[u].get(v, default)
+
+	def edges_iter(self, nbunch=None, data=False):
+
+		''' Yields each edge once (from its lower-numbered end, when both ends are in nbunch). '''
+
+		seen = set([])
+		for u in self.nbunch_iter(nbunch):
+			for v, edge_data in self[u].iteritems():
+				if v not in seen:
+					if data:
+						yield (u, v, edge_data)
+					else:
+						yield (u, v)
+			seen.add(u)
+
+	def edges(self, nbunch=None, data=False):
+		return list(self.edges_iter(nbunch, data))
+
+	def adjacency_iter(self):
+		return ((n, self[n]) for n in self)
+
+	def adjacency_list(self):
+		return [self[n].keys() for n in self]
+
+	def degree_iter(self, nbunch=None, weighted=False):
+		for n in self.nbunch_iter(nbunch):
+			adjacency = self[n]
+			if weighted:
+				degree = sum([edge_data['weight'] for edge_data in adjacency.values()])
+			else:
+				degree = len(adjacency)
+			## Self-loops count twice, as in networkx
+			if n in adjacency:
+				if weighted:
+					degree += adjacency[n]['weight']
+				else:
+					degree += 1
+			yield (n, degree)
+
+	def degree(self, nbunch=None, weighted=False):
+		if nbunch in self:
+			return self.degree_iter(nbunch, weighted).next()[1]
+		return dict(self.degree_iter(nbunch, weighted))
+
+	def size(self, weighted=False):
+		total = sum([degree for n, degree in self.degree_iter(weighted=weighted)])
+		if weighted:
+			return total/2.0
+		return total/2
+
+	def number_of_edges(self, u=None, v=None):
+		if u is None:
+			return self.size()
+		return int(self.has_edge(u, v))
+
+	def is_directed(self):
+		return False
+
+	def is_multigraph(self):
+		return False
+
+	#### ==== Conversion ==== ####
+	def subgraph(self, nbunch):
+
+		''' A real (mutable) networkx.Graph of the induced subgraph on nbunch - for small pieces only. '''
+
+		import networkx
+
+		nodes = set(self.nbunch_iter(nbunch))
+
+		subgraph = networkx.Graph(name=self.name)
+		subgraph.add_nodes_from(nodes)
+		for u in nodes:
+			for v, edge_data in self[u].iteritems():
+				if v in nodes:
+					subgraph.add_edge(u, v, edge_data)
+		return subgraph
+
+	def copy(self):
+
+		''' Another view of the same snapshot - the snapshot itself is never modified, so there's nothing to copy. '''
+
+		view = SnapshotGraph(self.snapshot, name=self.name)
+		view.type_ids = self.type_ids
+		return view
+
+
+#### ==== Binary Format ==== ####
+class Column(object):
+
+	''' Zero-copy, read-only view of a little-endian array inside a snapshot file. Indexing unpacks one value in place; slicing copies just the slice into an array.array. '''
+
+	def __init__(self, data, start, length, typecode):
+		self.data = data
+		self.start = start
+		self.length = length
+		self.typecode = typecode
+		self.format = struct.Struct('<'+typecode)
+		self.itemsize = self.format.size
+
+	def __len__(self):
+		return self.length
+
+	def __iter__(self):
+		for offset in xrange(0, self.length, _ITER_SIZE):
+			for value in self[offset:offset+_ITER_SIZE]:
+				yield value
+
+	def __getitem__(self, index):
+
+		if isinstance(index, slice):
+			start, stop, step = index.indices(self.length)
+			values = array(self.typecode)
+			if stop > start:
+				values.fromstring(self.data[self.start+start*self.itemsize:self.start+stop*self.itemsize])
+				if sys.byteorder == 'big':
+					values.byteswap()
+			return values[::step]
+
+		if index < 0:
+			index += self.length
+		if index < 0 or index >= self.length:
+			raise IndexError('Snapshot column index out of range.')
+		return self.format.unpack_from(self.data, self.start+index*self.itemsize)[0]
+
+	def buffer(self):
+
+		''' The column's raw bytes as a buffer (no copy), e.g. for numpy.frombuffer. '''
+
+		return buffer(self.data, self.start, self.length*self.itemsize)
+
+
+class _KeyTable(object):
+
+	''' Zero-copy node key table inside a snapshot file: key strings by node ID, and lookup by key through a binary search of the IDs in key string order. Stands in for both GraphSnapshot.keys and GraphSnapshot.index. '''
+
+	def __init__(self, data, start, offsets, order):
+		self.data = data
+		self.start = start
+		self.offsets = offsets
+		self.order = order
+
+	def __len__(self):
+		return len(self.order)
+
+	def __iter__(self):
+		for node_id in xrange(0, len(self)):
+			yield self[node_id]
+
+	def __getitem__(self, node_id):
+		if node_id < 0 or node_id >= len(self):
+			raise IndexError('Snapshot node ID out of range.')
+		return self.data[self.start+self.offsets[node_id]:self.start+self.offsets[node_id+1]]
+
+	def get(self, key, default=None):
+		low, high = 0, len(self.order)
+		while low < high:
+			middle = (low+high)/2
+			node_id = self.order[middle]
+			found = self[node_id]
+			if found == key:
+				return node_id
+			if found < key:
+				low = middle+1
+			else:
+				high = middle
+		return default
+
+
+def _column_bytes(values):
+	if sys.byteorder == 'big':
+		values = array(values.typecode, values)
+		values.byteswap()
+	return values.tostring()
+
+
+def dump_snapshot(snapshot):
+
+	'''
+
+	Serialises a freshly built GraphSnapshot (no overlay) into the binary snapshot
+	format, as a list of strings to be written in order:
+
+		prefix		'FCMG', format version (uint16), reserved (uint16) and the
+					length of the header (uint32), little-endian
+		header		JSON: node and entry counts, build time, edge type names,
+					and each section's [byte offset, item count] in the file
+		sections	key_offsets, key_data, key_order, offsets, targets, weights,
+					types - each aligned to 8 bytes, numbers little-endian
+
+	key_order lists node IDs sorted by key string, which lets readers find a key's ID
+	by binary search rather than building a dict of every key.
+
+	'''
+
+	keys = list(snapshot.keys)
+
+	key_offsets = array(_OFFSET_TYPE, [0])
+	for key in keys:
+		key_offsets.append(key_offsets[-1]+len(key))
+
+	order = range(0, len(keys))
+	order.sort(key=keys.__getitem__)
+
+	sections = [('key_offsets', key_offsets, len(key_offsets)),
+				('key_data', ''.join(keys), key_offsets[-1]),
+				('key_order', array(_TARGET_TYPE, order), len(order)),
+				('offsets', snapshot.offsets, len(snapshot.offsets)),
+				('targets', snapshot.targets, len(snapshot.targets)),
+				('weights', snapshot.weights, len(snapshot.weights)),
+				('types', snapshot.types, len(snapshot.types))]
+
+	chunks = []
+	for name, values, count in sections:
+		if isinstance(values, basestring):
+			chunks.append((name, values, count))
+		else:
+			chunks.append((name, _column_bytes(values), count))
+
+	header = {'nodes': len(keys), 'entries': len(snapshot.targets), 'built': snapshot.built, 'types': snapshot.type_names, 'sections': {}}
+
+	## Section offsets depend on the header's length, which depends on the offsets - lay out until the length settles
+	encoded = ''
+	while True:
+		position = _PREFIX.size+len(encoded)
+		for name, data, count in chunks:
+			position += -position % _ALIGNMENT
+			header['sections'][name] = [position, count]
+			position += len(data)
+		layout = json.dumps(header)
+		if len(layout) == len(encoded):
+			break
+		encoded = layout
+	encoded = layout
+
+	output = [_PREFIX.pack(_MAGIC, FORMAT_VERSION, 0, len(encoded)), encoded]
+	position = _PREFIX.size+len(encoded)
+	for name, data, count in chunks:
+		padding = header['sections'][name][0]-position
+		output.extend(['\0'*padding, data])
+		position += padding+len(data)
+
+	return output
+
+
+def load_snapshot(data):
+
+	''' Opens a snapshot file's contents (a string) as a GraphSnapshot. Every array and the key table are views over data, so nothing is copied or decoded up front. '''
+
+	if len(data) < _PREFIX.size:
+		raise SnapshotFormatError('Snapshot is truncated.')
+
+	magic, version, reserved, header_length = _PREFIX.unpack_from(data, 0)
+	if magic != _MAGIC:
+		raise SnapshotFormatError('Not a graph snapshot.')
+	if version != FORMAT_VERSION:
+		raise SnapshotFormatError('Unsupported snapshot format version '+str(version)+' (expected '+str(FORMAT_VERSION)+').')
+
+	header = json.loads(data[_PREFIX.size:_PREFIX.size+header_length])
+	sections = header['sections']
+
+	def column(name, typecode):
+		start, count = sections[name]
+		if start+count*struct.calcsize('<'+typecode) > len(data):
+			raise SnapshotFormatError('Snapshot is truncated (section '+name+').')
+		return Column(data, start, count, typecode)
+
+	keys = _KeyTable(data, sections['key_data'][0], column('key_offsets', _OFFSET_TYPE), column('key_order', _TARGET_TYPE))
+
+	return GraphSnapshot(keys,
+						 column('offsets', _OFFSET_TYPE),
+						 column('targets', _TARGET_TYPE),
+						 column('weights', _WEIGHT_TYPE),
+						 column('types', _EDGE_TYPE),
+						 [str(name) for name in header['types']],
+						 built=header['built'],
+						 index=keys)
+
+
+#### ==== Storage ==== ####
+def write_blob(chunks, filename):
+
+	''' Writes a list of strings to a new blob with the files API. Returns (blob key, size in bytes). '''
+
+	name = files.blobstore.create(mime_type='application/octet-stream', _blobinfo_uploaded_filename=filename)
+
+	size = 0
+	handle = files.open(name, 'a')
+	try:
+		for data in chunks:
+			for offset in xrange(0, len(data), _WRITE_SIZE):
+				handle.write(data[offset:offset+_WRITE_SIZE])
+			size += len(data)
+	finally:
+		handle.close()
+
+	files.finalize(name)
+	return (files.blobstore.get_blob_key(name), size)
+
+
+def read_blob(blob_key):
+	return blobstore.BlobReader(blob_key, buffer_size=_WRITE_SIZE).read()
+
+
+def save_snapshot(snapshot):
+
+	''' Writes a freshly built snapshot to the blobstore, and records it as the latest GraphSnapshotFile. '''
+
+	started = datetime.datetime.utcfromtimestamp(snapshot.built)
+	blob_key, size = write_blob(dump_snapshot(snapshot), 'graph-snapshot-'+started.strftime('%Y%m%d%H%M%S')+'.fcmg')
+
+	record = GraphSnapshotFile(blob=blob_key, version=FORMAT_VERSION, started=started,
+							   node_count=snapshot.node_count, entry_count=snapshot.edge_count, size=size)
+	record.put()
+
+	logging.info('Saved graph snapshot of '+str(record.node_count)+' nodes and '+str(record.entry_count)+' adjacency entries ('+str(size)+' bytes).')
+
+	return record
+
+
+def open_snapshot(record):
+
+	''' Loads a stored snapshot (a GraphSnapshotFile), keeping the most recently opened one in instance memory. '''
+
+	key = str(record.key())
+	if key not in _opened:
+		started = time.time()
+		snapshot = load_snapshot(read_blob(GraphSnapshotFile.blob.get_value_for_datastore(record)))
+		_opened.clear()
+		_opened[key] = snapshot
+		logging.info('Loaded graph snapshot from '+str(record.started)+' in '+str(int((time.time()-started)*1000))+'ms.')
+
+	return _opened[key]
+
+
+def prune_snapshots(keep):
+
+	''' Deletes all but the keep latest snapshots (records and blobs). '''
+
+	records = GraphSnapshotFile.all().order('-started').fetch(keep+50)
+	if len(records) <= keep:
+		return 0
+
+	stale = records[keep:]
+
+	## Score files computed from a snapshot go with it
+	scores = []
+	for record in stale:
+		scores.extend(GraphScoreFile.all().filter('snapshot =', record).fetch(100))
+
+	blobstore.delete([GraphSnapshotFile.blob.get_value_for_datastore(record) for record in stale]+[GraphScoreFile.blob.get_value_for_datastore(record) for record in scores])
+	db.delete(stale+scores)
+
+	return len(stale)
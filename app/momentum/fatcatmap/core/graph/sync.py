@@ -0,0 +1,267 @@
+import hashlib
+import logging
+import simplejson as json
+
+from google.appengine.ext import db
+
+from momentum.fatcatmap.models.graph import Native
+from momentum.fatcatmap.models.services import SyncRecord
+from momentum.fatcatmap.core.graph.extids import resolve_ext_ids
+from momentum.fatcatmap.core.search.index import index_nodes
+
+
+_PUT_CHUNK_SIZE = 500
+
+## Most values an IN filter takes
+_IN_CHUNK_SIZE = 30
+
+## Bookkeeping fields, left out of field-level change counts
+_UNREPORTED_FIELDS = frozenset(['fingerprint'])
+
+
+#### ==== Fingerprints ==== ####
+def normalize_record(value):
+
+	''' Normalises an upstream payload for fingerprinting: strings are stripped unicode, empty values are dropped from dicts, and nested dicts and lists are normalised in turn. '''
+
+	if isinstance(value, dict):
+		normalized = {}
+		for name, item in value.items():
+			item = normalize_record(item)
+			if item is not None and item != '' and item != [] and item != {}:
+				normalized[unicode(name)] = item
+		return normalized
+
+	elif isinstance(value, (list, tuple)):
+		return [normalize_record(item) for item in value]
+
+	elif isinstance(value, str):
+		return value.decode('utf-8').strip()
+
+	elif isinstance(value, unicode):
+		return value.strip()
+
+	elif isinstance(value, db.Key):
+		return unicode(value)
+
+	return value
+
+
+def fingerprint(record, exclude=None):
+
+	''' SHA1 of the normalised record (less any names in exclude), as canonical JSON. Two payloads with the same content have the same fingerprint, whatever their key order or whitespace. '''
+
+	if exclude is not None:
+		record = dict([(name, value) for name, value in record.items() if name not in exclude])
+
+	return hashlib.sha1(json.dumps(normalize_record(record), sort_keys=True)).hexdigest()
+
+
+#### ==== Sync Reports ==== ####
+class SyncReport(object):
+
+	''' Counts for one sync run: records created, updated and unchanged, related records removed upstream, and how often each field changed. Serialises to a dict, so reports can be passed between pipelines and merged. '''
+
+	def __init__(self, created=0, updated=0, unchanged=0, removed=0, fields=None):
+		self.created = created
+		self.updated = updated
+		self.unchanged = unchanged
+		self.removed = removed
+		self.fields = fields or {}
+
+	def count_fields(self, names):
+		for name in names:
+			if name not in _UNREPORTED_FIELDS:
+				self.fields[name] = self.fields.get(name, 0)+1
+
+	def merge(self, other):
+
+		if isinstance(other, dict):
+			other = SyncReport.from_dict(other)
+
+		self.created += other.created
+		self.updated += other.updated
+		self.unchanged += other.unchanged
+		self.removed += other.removed
+		for name, count in other.fields.items():
+			self.fields[name] = self.fields.get(name, 0)+count
+
+		return self
+
+	def total(self):
+		return self.created+self.updated+self.unchanged
+
+	def to_dict(self):
+		return {'created':self.created, 'updated':self.updated, 'unchanged':self.unchanged, 'removed':self.removed, 'fields':self.fields}
+
+	@classmethod
+	def from_dict(cls, report):
+		return cls(report.get('created', 0), report.get('updated', 0), report.get('unchanged', 0), report.get('removed', 0), dict(report.get('fields', {})))
+
+	def summary(self):
+
+		summary = str(self.total())+' records: '+str(self.created)+' created, '+str(self.updated)+' updated, '+str(self.unchanged)+' unchanged, '+str(self.removed)+' removed upstream.'
+		if len(self.fields) > 0:
+			summary += ' Changed fields: '+', '.join([name+' ('+str(count)+')' for name, count in sorted(self.fields.items())])+'.'
+
+		return summary
+
+
+#### ==== Diffing ==== ####
+def diff_records(service, kind, records, id_service=None):
+
+	'''
+
+	Diff stage for a sync: compares a list of (record id, fingerprint) pairs against
+	their SyncRecords with one batch get. Returns a dict per record - id, status
+	('new', 'changed' or 'unchanged'), fingerprint, and the node, native and related
+	IDs from the last sync (keys as strings, so results can be passed to pipelines).
+
+	Records synced before fingerprints existed have no SyncRecord. If id_service is
+	given, record IDs are also external IDs with that service, and such records are
+	matched to their existing node through the ext ID index (and always count as
+	changed, so their fingerprint is recorded).
+
+	'''
+
+	sync_records = db.get([SyncRecord.key_for(service, kind, record_id) for record_id, record_fingerprint in records])
+
+	results = []
+	for (record_id, record_fingerprint), sync_record in zip(records, sync_records):
+
+		result = {'id':record_id, 'status':'new', 'fingerprint':record_fingerprint, 'node':None, 'native':None, 'related':[]}
+
+		if sync_record is not None:
+			result['node'] = str(SyncRecord.node.get_value_for_datastore(sync_record))
+			result['native'] = str(SyncRecord.native.get_value_for_datastore(sync_record))
+			result['related'] = list(sync_record.related)
+			if sync_record.fingerprint == record_fingerprint:
+				result['status'] = 'unchanged'
+			else:
+				result['status'] = 'changed'
+
+		results.append(result)
+
+	## Adopt nodes that were imported before they had a SyncRecord
+	if id_service is not None:
+
+		unsynced = [result for result in results if result['status'] == 'new']
+		resolved = resolve_ext_ids(id_service, [result['id'] for result in unsynced])
+
+		native_keys = resolve_natives([node_key for node_key in resolved.values() if node_key is not None])
+
+		for result in unsynced:
+			node_key = resolved.get(result['id'])
+			if node_key is not None and node_key in native_keys:
+				result.update({'status':'changed', 'node':str(node_key), 'native':str(native_keys[node_key])})
+
+	return results
+
+
+def resolve_natives(node_keys):
+
+	''' Returns a dict of node key => native key for a list of node keys, with one keys-only query per _IN_CHUNK_SIZE nodes (natives are children of their node). Nodes without a native are left out. '''
+
+	node_keys = list(set(node_keys))
+
+	native_keys = {}
+	for offset in xrange(0, len(node_keys), _IN_CHUNK_SIZE):
+		for native_key in Native.all(keys_only=True).filter('node IN', node_keys[offset:offset+_IN_CHUNK_SIZE]):
+			native_keys[native_key.parent()] = native_key
+
+	return native_keys
+
+
+def diff_fields(entity, values):
+
+	''' Returns the subset of values (a dict of property name => new value) that differs from what entity holds. Reference properties are compared by key, without dereferencing them. '''
+
+	properties = entity.properties()
+
+	changed = {}
+	for name, value in values.items():
+
+		if name in properties:
+			current = properties[name].get_value_for_datastore(entity)
+		else:
+			current = getattr(entity, name, None)
+
+		if isinstance(value, db.Model):
+			value = value.key()
+
+		if current != value:
+			changed[name] = value
+
+	return changed
+
+
+#### ==== Applying Changes ==== ####
+def update_nodes(updates, report=None, index=True):
+
+	'''
+
+	Writes changed records onto their existing nodes. updates is a list of (node key,
+	native key, label, native_kwargs) tuples. Nodes and natives are fetched with one
+	batch get, only the fields that actually differ are set, and only entities with
+	changes are written back (one batch put). Changed nodes are re-indexed for search
+	unless index is False. Returns the keys of the nodes that changed.
+
+	'''
+
+	if report is None:
+		report = SyncReport()
+
+	if len(updates) == 0:
+		return []
+
+	entities = db.get([db.Key(str(node_key)) for node_key, native_key, label, native_kwargs in updates]+[db.Key(str(native_key)) for node_key, native_key, label, native_kwargs in updates])
+	nodes, natives = entities[0:len(updates)], entities[len(updates):]
+
+	changed_pairs = []
+	for (node_key, native_key, label, native_kwargs), node, native in zip(updates, nodes, natives):
+
+		if node is None or native is None:
+			logging.warning('Could not sync node '+str(node_key)+': node or native ('+str(native_key)+') is missing.')
+			continue
+
+		changed = diff_fields(native, native_kwargs or {})
+		for name, value in changed.items():
+			setattr(native, name, value)
+
+		if label is not None and node.label != label:
+			node.label = label
+			changed['label'] = label
+
+		report.count_fields(changed.keys())
+
+		if len(changed) > 0:
+			changed_pairs.append((node, native))
+
+	to_put = []
+	for node, native in changed_pairs:
+		to_put.extend([node, native])
+
+	for offset in xrange(0, len(to_put), _PUT_CHUNK_SIZE):
+		db.put(to_put[offset:offset+_PUT_CHUNK_SIZE])
+
+	if index and len(changed_pairs) > 0:
+		index_nodes(changed_pairs)
+
+	logging.debug('Synced '+str(len(updates))+' nodes, '+str(len(changed_pairs))+' with changes.')
+
+	return [node.key() for node, native in changed_pairs]
+
+
+def record_syncs(service, kind, synced):
+
+	''' Stores SyncRecords for a list of (record id, fingerprint, node key, native key, related IDs) tuples, with batched puts. '''
+
+	entities = []
+	for record_id, record_fingerprint, node_key, native_key, related in synced:
+		entities.append(SyncRecord(key=SyncRecord.key_for(service, kind, record_id), fingerprint=record_fingerprint,
+								   node=db.Key(str(node_key)), native=db.Key(str(native_key)), related=list(related or [])))
+
+	for offset in xrange(0, len(entities), _PUT_CHUNK_SIZE):
+		db.put(entities[offset:offset+_PUT_CHUNK_SIZE])
+
+	return len(entities)
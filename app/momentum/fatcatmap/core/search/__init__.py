@@ -0,0 +1,139 @@
+## FCM SEARCH CORE
+from google.appengine.ext import db
+
+from nltk.stem.porter import PorterStemmer
+from nltk.tokenize.regexp import WordPunctTokenizer
+
+from momentum.fatcatmap.core.data.properties.indexing import stored_entry
+
+
+_LABEL_WEIGHT = 1.0
+_NATIVE_WEIGHT = 0.5
+_POPULARITY_WEIGHT = 1.0
+_GET_CHUNK_SIZE = 500
+
+_STOPWORDS = frozenset(['a', 'an', 'and', 'as', 'at', 'by', 'for', 'from', 'in', 'of', 'on', 'or', 'the', 'to', 'with'])
+
+_tokenizer = WordPunctTokenizer()
+_stemmer = PorterStemmer()
+
+
+def normalize(text):
+
+	''' Lowercases text and collapses it to single-spaced alphanumeric tokens, keeping stopwords. '''
+
+	if not text:
+		return ''
+	return ' '.join([token.lower() for token in _tokenizer.tokenize(unicode(text)) if token.isalnum()])
+
+
+def tokenize(text):
+
+	''' Splits text into lowercased alphanumeric tokens, dropping punctuation and stopwords. '''
+
+	if not text:
+		return []
+	return [token.lower() for token in _tokenizer.tokenize(unicode(text)) if token.isalnum() and token.lower() not in _STOPWORDS]
+
+
+def stem(token):
+	return _stemmer.stem(token)
+
+
+def analyze(text):
+
+	''' Returns the stemmed search terms for a piece of text, in order (with repeats). '''
+
+	return [stem(token) for token in tokenize(text)]
+
+
+def search_fields(native):
+
+	''' Returns the text values to index for a native. Natives may list them in search_fields; otherwise every string property is used. '''
+
+	if native is None:
+		return []
+
+	names = getattr(native, 'search_fields', None)
+	if names is None:
+		names = [name for name, prop in native.properties().items() if isinstance(prop, db.StringProperty)]
+
+	values = []
+	for name in names:
+		value = getattr(native, name, None)
+		if isinstance(value, basestring) and value:
+			values.append(value)
+	return values
+
+
+def final_score(relevance, popularity):
+	return relevance*(1.0+(_POPULARITY_WEIGHT*popularity))
+
+
+def score_node(node, native=None):
+
+	'''
+
+	Computes the postings for a node, as a dict of term => (popularity, relevance, final).
+
+	Each field contributes its weight, spread over the field's length, for every
+	occurrence of a term: a short label that is all one term scores that term highest.
+	The label is weighted above native fields, and the final score boosts relevance by
+	the node's popularity.
+
+	'''
+
+	popularity = getattr(node, 'popularity', None) or 0.0
+
+	fields = [(node.label, _LABEL_WEIGHT)]+[(value, _NATIVE_WEIGHT) for value in search_fields(native)]
+
+	relevance = {}
+	for text, weight in fields:
+		terms = analyze(text)
+		for term in terms:
+			relevance[term] = relevance.get(term, 0.0)+(weight/len(terms))
+
+	postings = {}
+	for term, term_relevance in relevance.items():
+		postings[term] = (popularity, term_relevance, final_score(term_relevance, popularity))
+	return postings
+
+
+def node_popularity(keys):
+
+	''' Current popularity of a list of nodes, as a dict of str(node key) => popularity, with batch gets. Nodes that are gone are left out. '''
+
+	keys = list(keys)
+
+	popularity = {}
+	for offset in xrange(0, len(keys), _GET_CHUNK_SIZE):
+		for node in db.get(keys[offset:offset+_GET_CHUNK_SIZE]):
+			if node is not None:
+				popularity[str(node.key())] = getattr(node, 'popularity', None) or 0.0
+
+	return popularity
+
+
+def rescore_entries(entries, popularity=None):
+
+	'''
+
+	Refreshes the popularity, and so the final score, of every (node key, popularity,
+	relevance, final) entry in a posting list or prefix bucket. popularity is a dict
+	from node_popularity() - if it isn't given, the nodes are read with batch gets.
+	Entries for nodes not in it (gone, or added since it was read) keep their scores.
+	Returns (entry, original position) tuples, best first, scores rounded as stored.
+
+	'''
+
+	entries = list(entries)
+	if popularity is None:
+		popularity = node_popularity([entry[0] for entry in entries])
+
+	rescored = []
+	for position, entry in enumerate(entries):
+		current = popularity.get(str(entry[0]), entry[1])
+		rescored.append((stored_entry((entry[0], current, entry[2], final_score(entry[2], current))), position))
+
+	rescored.sort(key=lambda item: item[0][3], reverse=True)
+	return rescored
@@ -0,0 +1,204 @@
+import logging
+
+from google.appengine.ext import db
+
+from momentum.fatcatmap.core.search import normalize
+from momentum.fatcatmap.core.search import final_score
+from momentum.fatcatmap.core.search import rescore_entries
+from momentum.fatcatmap.core.search import node_popularity
+
+from momentum.fatcatmap.core.data.caching import entity_cache
+from momentum.fatcatmap.core.data.properties.indexing import stored_entry
+
+from momentum.fatcatmap.models.search import SearchPrefix
+
+
+_MAX_PREFIX_LENGTH = 12
+_BUCKET_SIZE = 25
+_GET_CHUNK_SIZE = 500
+
+_LABEL_START_RELEVANCE = 1.0
+_WORD_START_RELEVANCE = 0.5
+
+
+def label_prefixes(label):
+
+	'''
+
+	Returns a dict of prefix => relevance for a label. Prefixes are taken (up to
+	_MAX_PREFIX_LENGTH characters) from the start of the normalised label, and from
+	the start of every later word in it, so "nancy pelosi" can be found by typing
+	"pel". Matching from the start of the label ranks higher.
+
+	'''
+
+	text = normalize(label)
+	if not text:
+		return {}
+
+	starts = [(0, _LABEL_START_RELEVANCE)]
+	for index, character in enumerate(text):
+		if character == ' ':
+			starts.append((index+1, _WORD_START_RELEVANCE))
+
+	prefixes = {}
+	for start, relevance in starts:
+		suffix = text[start:start+_MAX_PREFIX_LENGTH].rstrip()
+		for length in xrange(1, len(suffix)+1):
+			prefix = suffix[0:length]
+			if prefix[-1] != ' ' and prefixes.get(prefix, 0.0) < relevance:
+				prefixes[prefix] = relevance
+	return prefixes
+
+
+def merge_bucket(bucket, updates):
+
+	''' Merges a dict of str(node key) => (entry, label) into a prefix bucket, keeping its _BUCKET_SIZE best. Returns True if the bucket changed. '''
+
+	current = zip(bucket.entries, bucket.labels)
+
+	## Scores are stored single precision: round the new ones the same way, so an unchanged entry compares equal
+	merged = [(entry, label) for entry, label in current if str(entry[0]) not in updates]+[(stored_entry(entry), label) for entry, label in updates.values()]
+	merged.sort(key=lambda item: item[0][3], reverse=True)
+	merged = merged[0:_BUCKET_SIZE]
+
+	if merged == current:
+		return False
+
+	bucket.entries = [entry for entry, label in merged]
+	bucket.labels = [label for entry, label in merged]
+	return True
+
+
+def index_prefixes(nodes):
+
+	'''
+
+	Adds nodes to the prefix buckets for their labels. Each bucket keeps only its
+	_BUCKET_SIZE best nodes, so most buckets a node touches (short, popular prefixes)
+	don't take it: buckets are read with batch gets first, and only those the nodes
+	would actually change are updated, each in a transaction that re-reads and merges
+	it, so concurrent writers never drop each other's entries.
+
+	'''
+
+	updates = {}
+	for node in nodes:
+		popularity = getattr(node, 'popularity', None) or 0.0
+		for prefix, relevance in label_prefixes(node.label).items():
+			updates.setdefault(prefix, {})[str(node.key())] = ((node.key(), popularity, relevance, final_score(relevance, popularity)), node.label)
+
+	if len(updates) == 0:
+		return []
+
+	prefixes = updates.keys()
+	keys = [SearchPrefix.key_for(prefix) for prefix in prefixes]
+
+	buckets = []
+	for offset in xrange(0, len(keys), _GET_CHUNK_SIZE):
+		buckets.extend(db.get(keys[offset:offset+_GET_CHUNK_SIZE]))
+
+	def txn(key, prefix):
+		bucket = db.get(key)
+		if bucket is None:
+			bucket = SearchPrefix(key=key)
+		if merge_bucket(bucket, updates[prefix]):
+			bucket.put()
+
+	changed = []
+	for prefix, key, bucket in zip(prefixes, keys, buckets):
+		if bucket is None or merge_bucket(bucket, updates[prefix]):
+			db.run_in_transaction(txn, key, prefix)
+			changed.append(key)
+
+	entity_cache.invalidate(changed)
+
+	logging.debug('AUTOCOMPLETE: Indexed '+str(len(nodes))+' nodes under '+str(len(prefixes))+' prefixes ('+str(len(changed))+' buckets changed).')
+
+	return changed
+
+
+def unindex_prefixes(node):
+
+	''' Removes a node (e.g. one merged away) from the prefix buckets for its label, with one transaction per bucket so concurrent writers' entries survive. '''
+
+	removed = str(node.key())
+	keys = [SearchPrefix.key_for(prefix) for prefix in label_prefixes(node.label).keys()]
+
+	def txn(key):
+		bucket = db.get(key)
+		if bucket is not None:
+			kept = [(entry, label) for entry, label in zip(bucket.entries, bucket.labels) if str(entry[0]) != removed]
+			if len(kept) < len(bucket.entries):
+				bucket.entries = [entry for entry, label in kept]
+				bucket.labels = [label for entry, label in kept]
+				bucket.put()
+
+	for key in keys:
+		db.run_in_transaction(txn, key)
+	entity_cache.invalidate(keys)
+
+	return keys
+
+
+def rescore_prefix(key):
+
+	''' Re-sorts a prefix bucket (labels alongside) after refreshing its nodes' popularity. Like rescore_term, popularity is read first and the bucket re-read and rescored in a transaction, so entries merged in meanwhile survive. Returns False if the bucket is gone. '''
+
+	bucket = db.get(key)
+	if bucket is None:
+		return False
+
+	popularity = node_popularity([entry[0] for entry in bucket.entries])
+
+	def txn():
+		bucket = db.get(key)
+		if bucket is None:
+			return False
+		rescored = rescore_entries(bucket.entries, popularity)
+		bucket.labels = [bucket.labels[position] for entry, position in rescored]
+		bucket.entries = [entry for entry, position in rescored]
+		bucket.put()
+		return True
+
+	rescored = db.run_in_transaction(txn)
+	entity_cache.invalidate([key])
+	return rescored
+
+
+def complete(text, limit=10):
+
+	'''
+
+	Returns up to limit (node key, label, score) completions for a partial query.
+
+	Answering costs a single key lookup: the bucket for the (truncated) prefix. It
+	goes through the entity cache, so hot prefixes are served from instance memory
+	or memcache. Queries longer than _MAX_PREFIX_LENGTH are filtered in memory
+	against the bucket's labels.
+
+	'''
+
+	text = normalize(text)
+	if not text:
+		return []
+
+	bucket = SearchPrefix.get(SearchPrefix.key_for(text[0:_MAX_PREFIX_LENGTH].rstrip()))
+	if bucket is None:
+		return []
+
+	completions = []
+	for index, label in enumerate(bucket.labels):
+
+		if len(completions) >= limit:
+			break
+
+		if len(text) > _MAX_PREFIX_LENGTH:
+			normalized = normalize(label)
+			if not normalized.startswith(text) and (' '+text) not in normalized:
+				continue
+
+		entry = bucket.entries[index]
+		completions.append((entry[0], label, entry[3]))
+
+	return completions
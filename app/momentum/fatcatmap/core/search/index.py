@@ -0,0 +1,389 @@
+import time
+import heapq
+import logging
+
+from google.appengine.ext import db
+
+from momentum.fatcatmap.core.search import analyze
+from momentum.fatcatmap.core.search import score_node
+from momentum.fatcatmap.core.search import rescore_entries
+from momentum.fatcatmap.core.search import node_popularity
+from momentum.fatcatmap.core.search.autocomplete import index_prefixes
+from momentum.fatcatmap.core.search.autocomplete import unindex_prefixes
+
+from momentum.fatcatmap.core.data.caching import entity_cache
+from momentum.fatcatmap.core.data.properties.indexing import stored_entry
+
+from momentum.fatcatmap.models.search import SearchTerm
+from momentum.fatcatmap.models.search import SearchPosting
+
+
+_MAX_POSTINGS = 5000
+_CHECK_INTERVAL = 8
+_DELETE_CHUNK_SIZE = 500
+_GET_CHUNK_SIZE = 500
+_PUT_CHUNK_SIZE = 500
+
+## Natives a PostingPool buffers before writing their postings
+_MAX_BUFFERED = 100
+
+
+#### ==== Writing ==== ####
+def merge_postings(entries, updates):
+
+	''' Merges a dict of str(node key) => (key, popularity, relevance, final) into a posting list, replacing existing entries for the same nodes. Returns a new list sorted by final score and capped at _MAX_POSTINGS. '''
+
+	## Scores are stored single precision: round the new ones the same way, so an unchanged entry compares equal
+	merged = [entry for entry in entries if str(entry[0]) not in updates]+[stored_entry(entry) for entry in updates.values()]
+	merged.sort(key=lambda entry: entry[3], reverse=True)
+	return merged[0:_MAX_POSTINGS]
+
+
+def merge_term(search_term, updates):
+
+	''' Merges updates (see merge_postings) into a SearchTerm's posting list. Returns True if the list changed. '''
+
+	entries = merge_postings(search_term.entries, updates)
+	if entries == list(search_term.entries):
+		return False
+
+	search_term.entries = entries
+	return True
+
+
+def index_nodes(pairs):
+
+	'''
+
+	Adds a list of (node, native) pairs to the search index, and to the autocomplete
+	prefix buckets for their labels. The terms they touch are read with chunked batch
+	gets first, and only those whose posting lists would change are updated, each in a
+	transaction that re-reads and merges it, so concurrent writers never drop each
+	other's postings.
+
+	This is the incremental path, used as nodes are created. Terms a node no longer
+	contains are left in place - the rebuild job (mappers.search + pipelines.search)
+	is authoritative and corrects that.
+
+	'''
+
+	index_prefixes([node for node, native in pairs])
+
+	updates = {}
+	for node, native in pairs:
+		for term, (popularity, relevance, final) in score_node(node, native).items():
+			updates.setdefault(term, {})[str(node.key())] = (node.key(), popularity, relevance, final)
+
+	if len(updates) == 0:
+		return []
+
+	terms = updates.keys()
+	keys = [SearchTerm.key_for(term) for term in terms]
+
+	search_terms = []
+	for offset in xrange(0, len(keys), _GET_CHUNK_SIZE):
+		search_terms.extend(db.get(keys[offset:offset+_GET_CHUNK_SIZE]))
+
+	def txn(key, term):
+		search_term = db.get(key)
+		if search_term is None:
+			search_term = SearchTerm(key=key, generation=int(time.time()))
+		if merge_term(search_term, updates[term]):
+			search_term.put()
+
+	changed = []
+	for term, key, search_term in zip(terms, keys, search_terms):
+		if search_term is None or merge_term(search_term, updates[term]):
+			db.run_in_transaction(txn, key, term)
+			changed.append(key)
+
+	entity_cache.invalidate(changed)
+
+	logging.debug('SEARCH: Indexed '+str(len(pairs))+' nodes under '+str(len(terms))+' terms ('+str(len(changed))+' changed).')
+
+	return changed
+
+
+class PostingPool(object):
+
+	'''
+
+	Batches the search index rebuild for a mapper shard. Registered as a pool on the
+	mapreduce context, so it's flushed at the end of every slice along with the
+	mutation pool. Natives are buffered, and on flush their nodes are read with
+	chunked batch gets and their SearchPostings written with chunked puts.
+
+	'''
+
+	def __init__(self, generation, counters=None):
+		self.generation = generation
+		self.counters = counters
+		self.natives = []
+
+	def add(self, native):
+
+		self.natives.append(native)
+
+		if len(self.natives) >= _MAX_BUFFERED:
+			self.flush()
+
+	def flush(self):
+
+		if len(self.natives) == 0:
+			return
+
+		node_keys = [native.parent_key() for native in self.natives]
+		nodes = []
+		for offset in xrange(0, len(node_keys), _GET_CHUNK_SIZE):
+			nodes.extend(db.get(node_keys[offset:offset+_GET_CHUNK_SIZE]))
+
+		postings = []
+		for node, native in zip(nodes, self.natives):
+			if node is None:
+				continue
+			for term, (popularity, relevance, final) in score_node(node, native).items():
+				postings.append(SearchPosting(key_name=SearchPosting.key_name_for(term, node.key()), term=term, node=node.key(), popularity=popularity, relevance=relevance, final=final, generation=self.generation))
+
+		for offset in xrange(0, len(postings), _PUT_CHUNK_SIZE):
+			db.put(postings[offset:offset+_PUT_CHUNK_SIZE])
+
+		if self.counters is not None:
+			self.counters.increment('search-postings', len(postings))
+
+		self.natives = []
+
+
+def unindex_node(node, native=None):
+
+	'''
+
+	Removes a node (e.g. one merged away) from the search index: from the posting list
+	of every term it was indexed under, with one transaction per term so concurrent
+	writers' postings survive, along with its SearchPostings and its entries in the
+	prefix buckets for its label.
+
+	'''
+
+	removed = str(node.key())
+	terms = score_node(node, native).keys()
+	keys = [SearchTerm.key_for(term) for term in terms]
+
+	def txn(key):
+		search_term = db.get(key)
+		if search_term is not None:
+			entries = [entry for entry in search_term.entries if str(entry[0]) != removed]
+			if len(entries) < len(search_term.entries):
+				search_term.entries = entries
+				search_term.put()
+
+	for key in keys:
+		db.run_in_transaction(txn, key)
+	entity_cache.invalidate(keys)
+
+	postings = [db.Key.from_path(SearchPosting.kind(), SearchPosting.key_name_for(term, node.key())) for term in terms]
+	for offset in xrange(0, len(postings), _DELETE_CHUNK_SIZE):
+		db.delete(postings[offset:offset+_DELETE_CHUNK_SIZE])
+
+	unindex_prefixes(node)
+
+	return keys
+
+
+def compact_term(term, generation):
+
+	'''
+
+	Rebuilds one term's posting list from its SearchPosting entities, which sit in a
+	contiguous key range. Postings from an older generation belong to a previous
+	rebuild and are deleted.
+
+	'''
+
+	query = SearchPosting.all()
+	query.filter('__key__ >=', db.Key.from_path(SearchPosting.kind(), 't/'+term+':'))
+	query.filter('__key__ <', db.Key.from_path(SearchPosting.kind(), 't/'+term+';'))
+
+	entries = []
+	stale = []
+	for posting in query:
+		if posting.generation < generation:
+			stale.append(posting.key())
+		else:
+			entries.append((SearchPosting.node.get_value_for_datastore(posting), posting.popularity, posting.relevance, posting.final))
+
+	key = SearchTerm.key_for(term)
+	if len(entries) > 0:
+		entries.sort(key=lambda entry: entry[3], reverse=True)
+		SearchTerm(key=key, entries=entries[0:_MAX_POSTINGS], generation=generation).put()
+	else:
+		db.delete(key)
+		entity_cache.invalidate([key])
+
+	for offset in xrange(0, len(stale), _DELETE_CHUNK_SIZE):
+		db.delete(stale[offset:offset+_DELETE_CHUNK_SIZE])
+
+	return len(entries)
+
+
+def compact_terms(generation, start=None, batch_size=50):
+
+	'''
+
+	Compacts up to batch_size terms, starting from the SearchPosting key name start.
+
+	Distinct terms are found with a skip scan: fetch the first posting key at or after
+	the current position, read the term off its key name, compact it, then jump past
+	the term's key range (':' sorts just before ';'). Returns the position to resume
+	from, or None once every term has been compacted.
+
+	'''
+
+	position = start
+	for i in xrange(0, batch_size):
+
+		query = SearchPosting.all(keys_only=True).order('__key__')
+		if position is not None:
+			query.filter('__key__ >=', db.Key.from_path(SearchPosting.kind(), position))
+
+		posting_key = query.get()
+		if posting_key is None:
+			return None
+
+		term = posting_key.name()[2:].split(':', 1)[0]
+		compact_term(term, generation)
+		position = 't/'+term+';'
+
+	return position
+
+
+def sweep_terms(generation, cursor=None, page_size=200):
+
+	''' Deletes SearchTerm posting lists last written before generation (terms that no longer have any postings). Returns a cursor to continue from, or None when done. '''
+
+	query = SearchTerm.all()
+	if cursor is not None:
+		query.with_cursor(cursor)
+
+	search_terms = query.fetch(page_size)
+	stale = [search_term.key() for search_term in search_terms if (search_term.generation or 0) < generation]
+	if len(stale) > 0:
+		db.delete(stale)
+		entity_cache.invalidate(stale)
+
+	if len(search_terms) < page_size:
+		return None
+	return query.cursor()
+
+
+def rescore_term(key):
+
+	'''
+
+	Refreshes the popularity scores held in a term's posting list (e.g. after a
+	PageRank run) and re-sorts it. The nodes' popularity is read first; the list is
+	then re-read and rescored in a transaction, so postings merged in by index_nodes
+	meanwhile survive. Returns False if the term is gone.
+
+	'''
+
+	search_term = db.get(key)
+	if search_term is None:
+		return False
+
+	popularity = node_popularity([entry[0] for entry in search_term.entries])
+
+	def txn():
+		search_term = db.get(key)
+		if search_term is None:
+			return False
+		search_term.entries = [entry for entry, position in rescore_entries(search_term.entries, popularity)]
+		search_term.put()
+		return True
+
+	rescored = db.run_in_transaction(txn)
+	entity_cache.invalidate([key])
+	return rescored
+
+
+#### ==== Querying ==== ####
+def top_k(posting_lists, k):
+
+	'''
+
+	Merges posting lists (each sorted by final score, highest first) into the k
+	best-scoring nodes, where a node's score is the sum of its final scores across
+	lists. Returns a list of (node key, score), best first.
+
+	Lists are walked in lockstep, one rank at a time. Every node seen so far has a
+	lower bound (the scores found for it) and an upper bound (plus the last score
+	read from each list it hasn't turned up in yet); any unseen node can score at most
+	the sum of those last scores. Once the k-th best lower bound beats every other
+	upper bound, no deeper entry can change the result and the merge stops. Only the
+	keys of entries actually read are ever decoded. Returned scores are those lower
+	bounds, so the order within the top k is approximate once the merge stops early.
+
+	'''
+
+	lists = [entries for entries in posting_lists if len(entries) > 0]
+	if len(lists) == 0 or k < 1:
+		return []
+
+	## A single list is already in order
+	if len(lists) == 1:
+		return [(entry[0], entry[3]) for entry in lists[0][0:k]]
+
+	seen = {}
+	frontier = [list_entries[0][3] for list_entries in lists]
+	longest = max([len(list_entries) for list_entries in lists])
+
+	for depth in xrange(0, longest):
+
+		for index, list_entries in enumerate(lists):
+
+			if depth >= len(list_entries):
+				frontier[index] = 0.0
+				continue
+
+			entry = list_entries[depth]
+			frontier[index] = entry[3]
+
+			record = seen.setdefault(str(entry[0]), [entry[0], 0.0, set()])
+			record[1] += entry[3]
+			record[2].add(index)
+
+		if len(seen) < k or (depth+1) % _CHECK_INTERVAL != 0:
+			continue
+
+		best = heapq.nlargest(k, seen.values(), key=lambda record: record[1])
+		kth_score = best[-1][1]
+
+		if kth_score < sum(frontier):
+			continue
+
+		winners = set([str(record[0]) for record in best])
+		for key_string, record in seen.items():
+			if key_string in winners:
+				continue
+			upper = record[1]+sum([frontier[index] for index in xrange(0, len(lists)) if index not in record[2]])
+			if upper > kth_score:
+				break
+		else:
+			return [(record[0], record[1]) for record in best]
+
+	return [(record[0], record[1]) for record in heapq.nlargest(k, seen.values(), key=lambda record: record[1])]
+
+
+def search(query, limit=10):
+
+	''' Returns up to limit (node key, score) tuples for a free-text query. Posting lists come from the entity cache, so a warm query costs no datastore RPCs. '''
+
+	terms = []
+	for term in analyze(query):
+		if term not in terms:
+			terms.append(term)
+
+	if len(terms) == 0:
+		return []
+
+	search_terms = SearchTerm.get([SearchTerm.key_for(term) for term in terms])
+	return top_k([search_term.entries for search_term in search_terms if search_term is not None], limit)
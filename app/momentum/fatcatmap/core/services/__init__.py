@@ -0,0 +1 @@
+## FCM SERVICES CORE
\ No newline at end of file
@@ -0,0 +1,169 @@
+import time
+import zlib
+import calendar
+import config
+import urllib
+import hashlib
+import logging
+import datetime
+import simplejson as json
+
+from google.appengine.ext import db
+from google.appengine.api import memcache
+
+from momentum.fatcatmap.models.services import ExtService
+from momentum.fatcatmap.models.services import ExtInteraction
+
+
+_MEMCACHE_NAMESPACE = 'momentum.fatcatmap.services'
+
+
+def canonical_request(method, params):
+
+	''' Returns a deterministic string for an API request: the method, then its params sorted by name and URL-encoded as UTF-8. '''
+
+	items = []
+	for name in sorted(params.keys()):
+		value = params[name]
+		if isinstance(value, unicode):
+			value = value.encode('utf-8')
+		items.append((str(name), str(value)))
+
+	return method+'?'+urllib.urlencode(items)
+
+
+def request_key(service, method, params):
+
+	''' Cache key for a request: "<service>:<method>:<sha1 of the canonical request>". Doubles as the ExtInteraction key name. '''
+
+	return service+':'+method+':'+hashlib.sha1(canonical_request(method, params)).hexdigest()
+
+
+class ResponseCache(object):
+
+	'''
+
+	Two-tier cache for external API responses, consulted by the vendored service
+	clients (sunlightapi, crpapi) before they go to the network:
+
+		1) memcache: (fetched timestamp, JSON response), for hot requests
+		2) datastore: an ExtInteraction per request, keyed by request_key, holding the
+		   canonical request and the zlib-compressed JSON response
+
+	Responses stay fresh for a per-method TTL (config 'ttls'). Expired responses are
+	refreshed from upstream only when next requested; if that refresh fails, the stale
+	response is served for up to max_stale more seconds rather than failing the caller.
+
+	'''
+
+	def __init__(self):
+
+		cfg = config.config.get('momentum.fatcatmap.services.caching')
+
+		self.ttls = cfg['ttls']
+		self.default_ttl = cfg['default_ttl']
+		self.max_stale = cfg['max_stale']
+		self.memcache_ttl = cfg['memcache_ttl']
+		self.enable_datastore = cfg['enable_datastore']
+		self.debug = cfg['debug']
+
+	def ttl(self, service, method):
+		return self.ttls.get(service, {}).get(method, self.default_ttl)
+
+	#### ==== Tiers ==== ####
+	def _read(self, key):
+
+		''' Returns (fetched timestamp, JSON string) for a key, or None. Datastore hits are copied up into memcache. '''
+
+		cached = memcache.get(key, namespace=_MEMCACHE_NAMESPACE)
+		if cached is not None:
+			return cached
+
+		if not self.enable_datastore:
+			return None
+
+		interaction = ExtInteraction.get_by_key_name(key)
+		if interaction is None or interaction.result != 'success' or interaction.response is None:
+			return None
+
+		cached = (calendar.timegm(interaction.timestamp.timetuple()), zlib.decompress(interaction.response))
+		memcache.set(key, cached, time=self.memcache_ttl, namespace=_MEMCACHE_NAMESPACE)
+		return cached
+
+	def _write(self, service, method, params, key, response):
+
+		cached = (time.time(), response)
+		memcache.set(key, cached, time=self.memcache_ttl, namespace=_MEMCACHE_NAMESPACE)
+
+		if self.enable_datastore:
+			ExtInteraction(key_name=key, method=method, result='success', enable_caching=True,
+						   request=db.Blob(canonical_request(method, params)),
+						   response=db.Blob(zlib.compress(response)),
+						   service=db.Key.from_path(ExtService.kind(), service),
+						   timestamp=datetime.datetime.utcfromtimestamp(cached[0])).put()
+
+	#### ==== Public API ==== ####
+	def lookup(self, service, method, params):
+
+		''' Returns (response, age in seconds) for the cached copy of a request, fresh or not, or (None, None). '''
+
+		cached = self._read(request_key(service, method, params))
+		if cached is None:
+			return (None, None)
+		return (json.loads(cached[1]), time.time()-cached[0])
+
+	def is_fresh(self, service, method, age):
+		return age is not None and age < self.ttl(service, method)
+
+	def is_servable(self, service, method, age):
+
+		''' Whether a cached response of this age may stand in for a failed refresh. '''
+
+		return age is not None and age < self.ttl(service, method)+self.max_stale
+
+	def store(self, service, method, params, result):
+		self._write(service, method, params, request_key(service, method, params), json.dumps(result))
+
+	def fetch(self, service, method, params, fetch, force_refresh=False):
+
+		'''
+
+		Returns the (decoded JSON) response for a request, calling fetch(method, params)
+		only when there's no fresh copy. fetch is the client's uncached call and should
+		raise on failure.
+
+		'''
+
+		cached, age = None, None
+		if not force_refresh:
+			cached, age = self.lookup(service, method, params)
+			if self.is_fresh(service, method, age):
+				if self.debug:
+					logging.debug('SERVICE CACHE: hit for '+service+' '+method+' (age '+str(int(age))+'s).')
+				return cached
+
+		try:
+			result = fetch(method, params)
+
+		except Exception, e:
+			if self.is_servable(service, method, age):
+				logging.warning('SERVICE CACHE: refresh of '+service+' '+method+' failed ('+str(e)+'), serving stale response.')
+				return cached
+			raise
+
+		if self.debug:
+			logging.debug('SERVICE CACHE: fetched '+service+' '+method+' from upstream.')
+
+		self.store(service, method, params, result)
+		return result
+
+	def invalidate(self, service, method, params):
+
+		key = request_key(service, method, params)
+		memcache.delete(key, namespace=_MEMCACHE_NAMESPACE)
+		if self.enable_datastore:
+			db.delete(db.Key.from_path(ExtInteraction.kind(), key))
+
+
+## Shared process-wide cache, installed on the service clients by their pipelines
+response_cache = ResponseCache()
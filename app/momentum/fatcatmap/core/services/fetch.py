@@ -0,0 +1,166 @@
+import config
+import logging
+
+from google.appengine.api import urlfetch
+
+from momentum.fatcatmap.core.services.caching import response_cache
+from momentum.fatcatmap.core.services.ratelimit import TokenBucket
+
+
+_PENDING = object()
+
+## One limiter per service, shared by every client in the instance
+_rate_limiters = {}
+
+
+class ServiceFetchError(Exception):
+
+	def __init__(self, service, method, status_code, content=None):
+		self.service = service
+		self.method = method
+		self.status_code = status_code
+		self.content = content
+		Exception.__init__(self, service+' '+method+' returned HTTP '+str(status_code))
+
+
+def get_rate_limiter(service):
+
+	''' Returns the instance-wide TokenBucket for a service, configured from momentum.fatcatmap.services.fetch. '''
+
+	if service not in _rate_limiters:
+		cfg = config.config.get('momentum.fatcatmap.services.fetch')
+		rate, burst = cfg['rate_limits'].get(service, cfg['default_rate_limit'])
+		_rate_limiters[service] = TokenBucket(rate, burst)
+	return _rate_limiters[service]
+
+
+class ServiceFuture(object):
+
+	''' The eventual response to one API call. get_result() blocks until it's available, returning the decoded response or raising the call's error. '''
+
+	def __init__(self, client, method, params):
+		self.client = client
+		self.method = method
+		self.params = params
+		self.rpc = None
+		self.result = _PENDING
+		self.error = None
+		self.stale = None
+
+	def done(self):
+		return self.result is not _PENDING or self.error is not None
+
+	def get_result(self):
+
+		## Not started yet: keep finishing in-flight calls (which starts queued ones) until it is
+		while not self.done() and self.rpc is None:
+			self.client._wait_one()
+
+		if not self.done():
+			self.client._complete(self)
+
+		if self.error is not None:
+			raise self.error
+		return self.result
+
+
+class AsyncServiceClient(object):
+
+	'''
+
+	Concurrent, rate-limited batch interface over one of the vendored service clients
+	(sunlightapi.sunlight, crpapi.CRP), using async urlfetch RPCs.
+
+	get_many() takes a list of (method, params) calls and returns a ServiceFuture for
+	each. Calls with a fresh copy in the response cache resolve immediately; the rest
+	are queued, and at most max_concurrency are in flight at once. Every request takes
+	a token from the service's rate limiter before it's sent, so a large batch runs at
+	the rate limit rather than at serial latency.
+
+	Requests go to the client's base_url, so a client can be pointed at a local stub
+	server.
+
+	'''
+
+	def __init__(self, service, client, max_concurrency=None, deadline=None, rate_limiter=None, cache=response_cache):
+
+		cfg = config.config.get('momentum.fatcatmap.services.fetch')
+
+		self.service = service
+		self.client = client
+		self.max_concurrency = max_concurrency or cfg['max_concurrency']
+		self.deadline = deadline or cfg['deadline']
+		self.rate_limiter = rate_limiter or get_rate_limiter(service)
+		self.cache = cache
+
+		self.queued = []
+		self.in_flight = []
+
+	def get_many(self, calls):
+
+		futures = []
+		for method, params in calls:
+
+			future = ServiceFuture(self, method, params)
+			futures.append(future)
+
+			if self.cache is not None:
+				cached, age = self.cache.lookup(self.service, method, params)
+				if self.cache.is_fresh(self.service, method, age):
+					future.result = cached
+					continue
+				if self.cache.is_servable(self.service, method, age):
+					future.stale = cached
+
+			self.queued.append(future)
+
+		self._pump()
+		return futures
+
+	def get(self, method, params):
+		return self.get_many([(method, params)])[0]
+
+	#### ==== Scheduling ==== ####
+	def _pump(self):
+
+		''' Starts queued calls until max_concurrency are in flight. '''
+
+		while len(self.queued) > 0 and len(self.in_flight) < self.max_concurrency:
+
+			self.rate_limiter.acquire()
+
+			future = self.queued.pop(0)
+			future.rpc = urlfetch.create_rpc(deadline=self.deadline)
+			urlfetch.make_fetch_call(future.rpc, self.client._url(future.method, future.params))
+			self.in_flight.append(future)
+
+	def _wait_one(self):
+
+		if len(self.in_flight) > 0:
+			self._complete(self.in_flight[0])
+		else:
+			self._pump()
+
+	def _complete(self, future):
+
+		''' Waits for a call's RPC, resolves its future, then tops up the in-flight calls. '''
+
+		self.in_flight.remove(future)
+
+		try:
+			response = future.rpc.get_result()
+			if response.status_code != 200:
+				raise ServiceFetchError(self.service, future.method, response.status_code, response.content)
+			future.result = self.client._parse(response.content)
+
+			if self.cache is not None:
+				self.cache.store(self.service, future.method, future.params, future.result)
+
+		except Exception, e:
+			if future.stale is not None:
+				logging.warning('SERVICE FETCH: '+self.service+' '+future.method+' failed ('+str(e)+'), serving stale response.')
+				future.result = future.stale
+			else:
+				future.error = e
+
+		self._pump()
@@ -0,0 +1,200 @@
+import time
+import config
+import logging
+import datetime
+
+from google.appengine.ext import db
+
+from tipfy.ext.sharded_counter import Counter
+
+from momentum.fatcatmap.models.services import ExtService
+from momentum.fatcatmap.models.services import ExtServiceKey
+
+from momentum.fatcatmap.core.services.ratelimit import TokenBucket
+
+
+## Instance-wide pools, by service name
+_pools = {}
+
+
+class KeyPoolExhausted(Exception):
+	pass
+
+
+class UsageCounter(Counter):
+
+	''' Sharded usage counter for a service key. The shard count is fixed here, so counters work outside of a tipfy request (e.g. in pipeline tasks). '''
+
+	shards = 5
+
+
+class KeyPool(object):
+
+	'''
+
+	Hands out API keys for one external service.
+
+	Keys are loaded into instance memory and reloaded every reload_interval seconds,
+	so picking a key costs no RPCs. Keys are chosen round-robin, or (with the 'quota'
+	strategy) by most remaining daily quota. Keys with enforce_limits set are skipped
+	once their daily_usage_limit is reached, and every key has a token bucket so no
+	single key is used faster than its configured rate.
+
+	Usage is counted in instance memory and flushed every flush_interval seconds (or
+	flush_threshold uses) into sharded counters - one per key per day, plus a running
+	total - and onto each key's last_used and global_uses.
+
+	'''
+
+	def __init__(self, service):
+
+		cfg = config.config.get('momentum.fatcatmap.services.keys')
+
+		self.service = service
+		self.strategy = cfg['strategies'].get(service, cfg['default_strategy'])
+		self.rate, self.burst = cfg['rate_limits'].get(service, cfg['default_rate_limit'])
+		self.reload_interval = cfg['reload_interval']
+		self.flush_interval = cfg['flush_interval']
+		self.flush_threshold = cfg['flush_threshold']
+
+		self.keys = []
+		self.loaded = 0
+		self.next_index = 0
+		self.buckets = {}
+		self.daily_usage = {}
+		self.pending = {}
+		self.pending_total = 0
+		self.last_flush = time.time()
+
+	#### ==== Loading ==== ####
+	def load(self):
+
+		manifest = db.Key.from_path(ExtService.kind(), self.service)
+		self.keys = ExtServiceKey.all().ancestor(manifest).fetch(100)
+		self.loaded = time.time()
+
+		for key in self.keys:
+			if key.key().name() not in self.buckets:
+				self.buckets[key.key().name()] = TokenBucket(self.rate, self.burst)
+
+		self.refresh_usage()
+
+		logging.debug('Loaded '+str(len(self.keys))+' API keys for service "'+self.service+'".')
+
+	def check(self):
+		if len(self.keys) == 0 or time.time()-self.loaded > self.reload_interval:
+			self.load()
+
+	#### ==== Usage ==== ####
+	def _counter_names(self, key_name):
+		prefix = 'service-key:'+self.service+':'+key_name
+		return (prefix+':'+datetime.date.today().strftime('%Y%m%d'), prefix+':total')
+
+	def refresh_usage(self):
+
+		''' Reads today's (flushed) usage for every key from its counter. Counts are served from memcache. '''
+
+		for key in self.keys:
+			daily, total = self._counter_names(key.key().name())
+			self.daily_usage[key.key().name()] = UsageCounter(daily).count
+
+	def remaining(self, key):
+
+		''' Remaining daily quota for a key, counting unflushed local usage. None means unlimited. '''
+
+		if not key.enforce_limits or key.daily_usage_limit is None:
+			return None
+
+		key_name = key.key().name()
+		return key.daily_usage_limit-self.daily_usage.get(key_name, 0)-self.pending.get(key_name, 0)
+
+	def record(self, key):
+
+		key_name = key.key().name()
+		self.pending[key_name] = self.pending.get(key_name, 0)+1
+		self.pending_total += 1
+
+		if self.pending_total >= self.flush_threshold or time.time()-self.last_flush > self.flush_interval:
+			self.flush()
+
+	def flush(self):
+
+		''' Writes pending usage into the sharded counters and onto the keys themselves. '''
+
+		if self.pending_total == 0:
+			self.last_flush = time.time()
+			return
+
+		now = datetime.datetime.now()
+		updated = []
+		for key in self.keys:
+
+			key_name = key.key().name()
+			count = self.pending.get(key_name, 0)
+			if count == 0:
+				continue
+
+			daily, total = self._counter_names(key_name)
+			UsageCounter(daily).increment(count)
+			total_counter = UsageCounter(total)
+			total_counter.increment(count)
+
+			key.last_used = now
+			key.global_uses = total_counter.count
+			updated.append(key)
+
+		try:
+			db.put(updated)
+		except db.Error, e:
+			## Counters are already updated - the keys will catch up on the next flush
+			logging.warning('Could not update usage on service keys for "'+self.service+'": '+str(e))
+
+		self.pending = {}
+		self.pending_total = 0
+		self.last_flush = time.time()
+		self.refresh_usage()
+
+	#### ==== Selection ==== ####
+	def candidates(self):
+
+		''' Keys that still have quota, in selection order. '''
+
+		keys = [key for key in self.keys if self.remaining(key) is None or self.remaining(key) > 0]
+
+		if self.strategy == 'quota':
+			## Unlimited keys first, then by most remaining quota
+			keys.sort(key=lambda key: (self.remaining(key) is not None, -(self.remaining(key) or 0)))
+		elif len(keys) > 0:
+			offset = self.next_index % len(keys)
+			keys = keys[offset:]+keys[0:offset]
+			self.next_index += 1
+
+		return keys
+
+	def acquire(self):
+
+		''' Picks a key with quota and a free token, records its use, and returns its value. Blocks (briefly) when every key is rate limited. '''
+
+		self.check()
+
+		while True:
+
+			keys = self.candidates()
+			if len(keys) == 0:
+				raise KeyPoolExhausted('No API keys with remaining quota for service "'+self.service+'".')
+
+			for key in keys:
+				if self.buckets[key.key().name()].consume():
+					self.record(key)
+					return key.value
+
+			time.sleep(min([self.buckets[key.key().name()].wait_time() for key in keys]))
+
+
+def get_key_pool(service):
+
+	''' Returns the instance-wide KeyPool for a service. Nothing is loaded until a key is first acquired. '''
+
+	if service not in _pools:
+		_pools[service] = KeyPool(service)
+	return _pools[service]
@@ -0,0 +1,43 @@
+import time
+
+
+class TokenBucket(object):
+
+	''' Token bucket rate limiter: holds up to capacity tokens, refilled at rate tokens per second. Per-instance only. '''
+
+	def __init__(self, rate, capacity=None):
+		self.rate = float(rate)
+		self.capacity = float(capacity or rate)
+		self.tokens = self.capacity
+		self.updated = time.time()
+
+	def _refill(self):
+		now = time.time()
+		self.tokens = min(self.capacity, self.tokens+((now-self.updated)*self.rate))
+		self.updated = now
+
+	def consume(self, tokens=1):
+
+		''' Takes tokens if they're available. Returns False (taking nothing) if they're not. '''
+
+		self._refill()
+		if self.tokens >= tokens:
+			self.tokens -= tokens
+			return True
+		return False
+
+	def wait_time(self, tokens=1):
+
+		''' Seconds until tokens will be available. '''
+
+		self._refill()
+		if self.tokens >= tokens:
+			return 0.0
+		return (tokens-self.tokens)/self.rate
+
+	def acquire(self, tokens=1):
+
+		''' Blocks until tokens are available, then takes them. '''
+
+		while not self.consume(tokens):
+			time.sleep(self.wait_time(tokens))
@@ -19,7 +19,13 @@ def add_graph_artifact_types():
     models.append(EdgeType(key_name='sunlight_committee_membership', name='Committee Membership', plural='Committee Memberships', edge_text='sits on', edge_impl_class=['momentum','fatcatmap','models','sunlight','CommitteeMembership']))
     models.append(EdgeType(key_name='campaign_contributions', name='Campaign Contribution', plural='Campaign Contributions', edge_text=['contributed money to','received contributions from'], edge_impl_class=['momentum','fatcatmap','models','opensecrets','CampaignContribution']))
 
-    return db.put(models)
+    keys = db.put(models)
+
+    ## Tell every instance to reload its graph types
+    from momentum.fatcatmap.core.graph import registry
+    registry.invalidate()
+
+    return keys
 
 
 def add_services():
@@ -1,42 +1,84 @@
 import config
+import inspect
 import logging
 
+from tipfy import Response
 from tipfy import import_string
 from tipfy import cached_property
 
+from google.appengine.ext import db
+
 from momentum.fatcatmap.api import MomentumAPIRequest
-from momentum.fatcatmap.handlers import FCMBaseRequestHandler
+from momentum.fatcatmap.handlers import BaseFCMRequestHandler
 
 
-class CheshireDispatch(FCMBaseRequestHandler):
+class CheshireDispatch(BaseFCMRequestHandler):
 
     config = {}
     adapter = None
     api_request = None
 
 
-    def handleRequest(self, request):
+    def handleRequest(self, *args, **kwargs):
+
+        try:
+            self.decodeRequest(*args, **kwargs)
+            action = self.computed_method()
+
+            try:
+                result = action.execute(**self.methodParams(action))
+            except db.BadKeyError:
+                ## A malformed node or edge key in the request
+                raise InvalidParams
+
+            response = {'id': self.api_request.id, 'status': 'success', 'type': action.response.type, 'result': result}
+
+        except APIException, e:
+            if self.apiConfig['debug'] == True:
+                logging.warning('API method failed with '+e.__class__.__name__+': "'+e.message+'".')
+            response = {'id': self.api_request is not None and self.api_request.id or None, 'status': 'failure', 'error': e.__class__.__name__, 'message': e.message}
+
+        ## Format errors are reported in the default format
+        if self.adapter is None:
+            self.loadDataAdapter(self.apiConfig['adapters']['default'])
+
+        return Response(self.adapter.encode(response), mimetype='application/json')
+
+
+    def methodParams(self, action):
+
+        ''' The request's params, narrowed to those the action's execute() takes (unless it takes **kwargs). Raises InvalidParams if a required one is missing. '''
 
-        self.api_request = request
+        params = dict([(str(key), value) for key, value in (self.api_request.params or {}).items()])
 
-        ## Resolve method
-        func = self.resolveMethod(self.api_request.method)
+        names, varargs, varkw, defaults = inspect.getargspec(action.execute)
+        names = names[1:]
+
+        for name in names[0:len(names)-len(defaults or [])]:
+            if name not in params:
+                raise InvalidParams
+
+        if varkw is None:
+            params = dict([(name, value) for name, value in params.items() if name in names])
+
+        return params
 
 
     def decodeRequest(self, *args, **kwargs):
 
-        self.config = self.gatherConfig()
+        self.config = self.gatherConfig(**kwargs)
+        format = self.config.get('format', self.config.get('output'))
 
         ## Load Adapter
-        if 'format' in config:
-            if config['format'].lower() in self.apiConfig['adapters']:
-                if self.apiConfig['adapters'][config['format'].lower()]['enabled'] != True:
+        if format is not None:
+            if format.lower() in self.apiConfig['adapters']:
+                if self.apiConfig['adapters'][format.lower()]['enabled'] != True:
 
                     if self.apiConfig['debug'] == True:
-                        logging.warning('Invalid output adapter encountered: "'+str(config['output'].lower())+'". Responding with error.')
+                        logging.warning('Invalid output adapter encountered: "'+str(format.lower())+'". Responding with error.')
                     raise FormatDisabled
                 else:
-                    self.loadDataAdapter(self.apiConfig['adapters'][config['format'].lower()]['path'])
+                    self.loadDataAdapter(self.apiConfig['adapters'][format.lower()]['path'])
             else:
                 raise FormatInvalid
         else:
@@ -45,9 +87,6 @@ class CheshireDispatch(FCMBaseRequestHandler):
         ## Decode Payload
         self.api_request = MomentumAPIRequest.spawnRequest(self.config, self.adapter)
 
-        ## Resolve method
-        self.computed_method = self.resolveMethod()
-
 
     def gatherConfig(self, **kwargs):
         temp_config = {}
@@ -81,7 +120,23 @@ class CheshireDispatch(FCMBaseRequestHandler):
 
     def resolveMethod(self):
 
-        if len(self.api_request.method)
+        ## Method can come in as 'module.method' or ['module', 'method']
+        method = self.api_request.method
+        if isinstance(method, basestring):
+            method = method.split('.')
+
+        if not isinstance(method, list) or len(method) != 2:
+            raise InvalidMethod
+
+        module, name = method
+        if module not in self.apiConfig['modules'] or self.apiConfig['modules'][module]['enabled'] != True:
+            raise InvalidMethod
+
+        methods = self.apiConfig['modules'][module].get('methods', {})
+        if name not in methods:
+            raise InvalidMethod
+
+        return import_string('.'.join(methods[name]))
 
 
     @cached_property
@@ -89,13 +144,17 @@ class CheshireDispatch(FCMBaseRequestHandler):
         return config.config.get('momentum.fatcatmap.api')
 
 
-    def get(self, *args, **kwargs): return self.handleRequest(self.decodeRequest(*args, **kwargs))
-    def put(self, *args, **kwargs): return self.handleRequest(self.decodeRequest(*args, **kwargs))
+    def computed_method(self):
+        return self.resolveMethod()()
+
+
+    def get(self, *args, **kwargs): return self.handleRequest(*args, **kwargs)
+    def put(self, *args, **kwargs): return self.handleRequest(*args, **kwargs)
 
-    def post(self, *args, **kwargs): return self.handleRequest(self.decodeRequest(*args, **kwargs))
-    def head(self, *args, **kwargs): return self.handleRequest(self.decodeRequest(*args, **kwargs))
-    def delete(self, *args, **kwargs): return self.handleRequest(self.decodeRequest(*args, **kwargs))
-    def options(self, *args, **kwargs): return self.handleRequest(self.decodeRequest(*args, **kwargs))
+    def post(self, *args, **kwargs): return self.handleRequest(*args, **kwargs)
+    def head(self, *args, **kwargs): return self.handleRequest(*args, **kwargs)
+    def delete(self, *args, **kwargs): return self.handleRequest(*args, **kwargs)
+    def options(self, *args, **kwargs): return self.handleRequest(*args, **kwargs)
 
 
 ### API Exceptions
@@ -106,4 +165,5 @@ class FormatInvalid(OutputException): message = 'The specified output type is no
 class FormatDisabled(OutputException): message = 'The specified output type is currently disabled. Please rewrite your request and try again.'
 
 class MethodException(APIException): message = 'An error was encountered trying to find or complete the requested method. Please try again later.'
-class InvalidMethod(MethodException): message = 'The requested method could not be found. Please try again.'
\ No newline at end of file
+class InvalidMethod(MethodException): message = 'The requested method could not be found. Please try again.'
+class InvalidParams(MethodException): message = 'The parameters given for the requested method were missing or invalid. Please rewrite your request and try again.'
\ No newline at end of file
@@ -64,6 +64,24 @@ class SandboxProcedure(FCMRequestHandler):
 
             return self.render('sandbox/sunlightConsole.html', channel_token=token)
 
+        elif procedure == 'sunlightbulk':
+
+            from momentum.fatcatmap.pipelines.sunlight.legislators import SunlightLegislatorsBulk
+
+            bulk = SunlightLegislatorsBulk()
+            bulk.start(queue_name=SunlightLegislatorsBulk.queue_name)
+
+            return self.response('<b>Started bulk legislator import: '+str(bulk.pipeline_id)+'</b>')
+
+        elif procedure == 'searchindex':
+
+            from momentum.fatcatmap.pipelines.search import RebuildSearchIndex
+
+            rebuild = RebuildSearchIndex()
+            rebuild.start(queue_name=RebuildSearchIndex.queue_name)
+
+            return self.response('<b>Started search index rebuild: '+str(rebuild.pipeline_id)+'</b>')
+
         elif procedure == 'basedata':
 
             from momentum.fatcatmap.dev.default_data import all_functions
@@ -87,12 +105,12 @@ class SandboxGraphQuery(FCMRequestHandler):
         nodes = Node.all().fetch(50)
         edges = Edge.all().fetch(50)
 
-        nodes_index = []
+        nodes_index = {}
         nodes_list = []
         for node in nodes:
-            nodes_index.append(node.key())
+            nodes_index[node.key()] = len(nodes_list)
             if node.parent() is not None:
-                parent = node.parent().kind() + ' // ' + node.parent().key().id_or_name()
+                parent = node.parent().kind() + ' // ' + str(node.parent().key().id_or_name())
             else:
                 parent = str(None)
             nodes_list.append({'nodeName': node.label, 'group': 1,
@@ -101,11 +119,15 @@ class SandboxGraphQuery(FCMRequestHandler):
 
         edges_list = []
         for edge in edges:
-            node_alpha = edge.nodes[0]
-            node_beta = edge.nodes[1]
+            node_alpha = Edge.source.get_value_for_datastore(edge)
+            node_beta = Edge.target.get_value_for_datastore(edge)
+
+            ## Skip edges to nodes outside this sample
+            if node_alpha not in nodes_index or node_beta not in nodes_index:
+                continue
 
             edges_list.append(
-                        {'source': nodes_index.index(node_alpha), 'target': nodes_index.index(node_beta), 'value': 1})
+                        {'source': nodes_index[node_alpha], 'target': nodes_index[node_beta], 'value': 1})
 
         data = {'nodes': nodes_list, 'links': edges_list}
 
@@ -0,0 +1,45 @@
+from momentum.fatcatmap.handlers import FCMRequestHandler
+
+from momentum.fatcatmap.core.graph.export import GraphExport
+from momentum.fatcatmap.core.graph.export import stream_json
+from momentum.fatcatmap.core.graph.export import stream_ndjson
+
+_MAX_EXPORT_LIMIT = 5000
+
+
+class GraphExportHandler(FCMRequestHandler):
+
+	''' Streams the graph as JSON or newline-delimited JSON, one cursor-resumable page at a time. '''
+
+	def get(self, format='json'):
+
+		try:
+			limit = int(self.request.args.get('limit', 1000))
+		except (ValueError, TypeError):
+			return self.abort(400)
+
+		if limit < 1:
+			return self.abort(400)
+		limit = min(limit, _MAX_EXPORT_LIMIT)
+
+		node_fields = None
+		if self.request.args.get('node_fields'):
+			node_fields = self.request.args.get('node_fields').split(',')
+
+		link_fields = None
+		if self.request.args.get('link_fields'):
+			link_fields = self.request.args.get('link_fields').split(',')
+
+		try:
+			export = GraphExport(cursor=self.request.args.get('cursor'), limit=limit, node_fields=node_fields, link_fields=link_fields)
+		except (ValueError, TypeError):
+			return self.abort(400)
+
+		if format == 'ndjson':
+			r = self.response(stream_ndjson(export))
+			r.headers['Content-Type'] = 'application/x-ndjson'
+		else:
+			r = self.response(stream_json(export))
+			r.headers['Content-Type'] = 'application/json'
+
+		return r
@@ -0,0 +1,39 @@
+from mapreduce import context
+from mapreduce import operation as op
+
+from momentum.fatcatmap.models.graph import Node
+from momentum.fatcatmap.models.graph import GraphScoreFile
+from momentum.fatcatmap.core.graph.snapshot import open_snapshot
+from momentum.fatcatmap.core.graph.centrality import open_scores
+
+
+## The score file this instance is writing, by GraphScoreFile key: (snapshot, score column)
+_writing = {}
+
+
+def influence_scores(scores_key):
+
+	''' The snapshot and score column for a GraphScoreFile key, read once per instance rather than once per mapped node. '''
+
+	if scores_key not in _writing:
+		scores = GraphScoreFile.get(scores_key)
+		_writing.clear()
+		_writing[scores_key] = (open_snapshot(scores.snapshot), open_scores(scores))
+	return _writing[scores_key]
+
+
+def write_influence(node):
+
+	''' Stores the node's score from a GraphScoreFile as Node.influence. Nodes created since the scores' snapshot are left alone until the next run. '''
+
+	params = context.get().mapreduce_spec.mapper.params
+
+	snapshot, values = influence_scores(params['scores'])
+	node_id = snapshot.id_for(node.key())
+	if node_id is None:
+		yield op.counters.Increment('influence-skipped')
+		return
+
+	## Set in a small transaction, so concurrent writes to the node aren't undone (see Node.set_score)
+	if Node.set_score(node.key(), 'influence', float(values[node_id])):
+		yield op.counters.Increment('influence-written')
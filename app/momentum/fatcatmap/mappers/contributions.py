@@ -0,0 +1,67 @@
+from mapreduce import context
+from mapreduce import operation as op
+
+from momentum.fatcatmap.core.graph.loader import get_loader
+from momentum.fatcatmap.core.graph.loader import connect_edges
+from momentum.fatcatmap.core.graph.contributions import sum_partials
+from momentum.fatcatmap.core.graph.contributions import contribution_edges
+from momentum.fatcatmap.core.graph.contributions import ContributionCombiner
+
+
+def combine_contribution(line):
+
+	''' Stage one of a contribution load: parses a line with the "loader" mapper param's mapping and adds it to the shard's in-memory combiner, which writes partial sums at the end of each slice. '''
+
+	ctx = context.get()
+
+	combiner = ctx.get_pool('contribution_combiner')
+	if combiner is None:
+		params = ctx.mapreduce_spec.mapper.params
+		combiner = ContributionCombiner(params['run'], get_loader(params['loader']), ctx.shard_id)
+		ctx.register_pool('contribution_combiner', combiner)
+
+	## Unpack line data
+	byte_offset, line_value = line
+
+	if byte_offset == 0 and combiner.loader.skip_header:
+		return
+
+	contribution = combiner.loader.contribution(line_value)
+	if contribution is None:
+		yield op.counters.Increment('contributions-skipped')
+		return
+
+	combiner.add(byte_offset, *contribution)
+	yield op.counters.Increment('contributions-read')
+
+
+def write_contribution_edge(total):
+
+	''' Stage two: sums a ContributionTotal's partials from this run and writes one CampaignContribution edge pair for it, through the mutation pool. The partials are deleted once summed. '''
+
+	if total.run != context.get().mapreduce_spec.mapper.params['run']:
+		return
+
+	amount, count, partial_keys = sum_partials(total)
+	if count == 0 and total.count is not None:
+		## A retried slice: the partials are gone, but their sum was stored
+		amount, count = total.total, total.count
+
+	total.total = amount
+	total.count = count
+	yield op.db.Put(total)
+
+	for key in partial_keys:
+		yield op.db.Delete(key)
+
+	edges = contribution_edges(total, amount, count)
+	if len(edges) == 0:
+		yield op.counters.Increment('contributions-unresolved')
+		return
+
+	connect_edges(edges, total.edge_type)
+
+	for edge in edges:
+		yield op.db.Put(edge)
+
+	yield op.counters.Increment('contribution-edges')
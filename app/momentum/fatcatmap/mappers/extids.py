@@ -0,0 +1,19 @@
+from mapreduce import operation as op
+
+from momentum.fatcatmap.models.services import NodeID
+from momentum.fatcatmap.models.services import ExtIDIndex
+
+
+def index_node_id(node_id):
+
+	''' Backfills the ExtIDIndex entry for a NodeID written before the reverse index existed. '''
+
+	## NodeID shares its kind with EdgeID
+	if not isinstance(node_id, NodeID):
+		return
+
+	service = NodeID.service.get_value_for_datastore(node_id)
+	if service is None or node_id.value is None:
+		return
+
+	yield op.db.Put(ExtIDIndex(key=ExtIDIndex.key_for(service.name(), node_id.value), node=node_id.parent_key(), name=node_id.name))
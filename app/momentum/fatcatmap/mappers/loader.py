@@ -0,0 +1,48 @@
+from mapreduce import context
+from mapreduce import operation as op
+
+from momentum.fatcatmap.models.graph import Edge as GraphEdge
+from momentum.fatcatmap.core.graph.loader import get_loader
+from momentum.fatcatmap.core.graph.loader import LoaderPool
+from momentum.fatcatmap.core.graph.loader import connect_edges
+
+
+def load_line(line):
+
+	''' Loads one line of an offline dataset with the bulk loader named by the "loader" mapper param (see core.graph.loader). Lines are loaded in batches by the shard's LoaderPool. '''
+
+	for operation in load_with(context.get().mapreduce_spec.mapper.params['loader'], line):
+		yield operation
+
+
+def load_with(loader_name, line):
+
+	''' Mapper operations for one (byte offset, line) pair from a BlobstoreLineInputReader. '''
+
+	ctx = context.get()
+
+	pool = ctx.get_pool('bulk_loader')
+	if pool is None:
+		pool = LoaderPool(get_loader(loader_name), ctx.counters)
+		ctx.register_pool('bulk_loader', pool)
+
+	## Unpack line data
+	byte_offset, line_value = line
+
+	if byte_offset == 0 and pool.loader.skip_header:
+		return
+
+	pool.add(line_value)
+	yield op.counters.Increment('loader-lines')
+
+
+def connect_loaded_edge(edge):
+
+	''' Follow-up pass of a bulk edge load: counts a loaded edge into its SuperEdge and the adjacency index (see core.graph.loader.connect_edges). Counting is idempotent, so the pass can be re-run. Edges that weren't bulk loaded are left alone. '''
+
+	key_name = edge.key().name()
+	if key_name is None or not key_name.startswith('l:'):
+		return
+
+	connect_edges([edge], GraphEdge.type.get_value_for_datastore(edge).name())
+	yield op.counters.Increment('loader-edges-connected')
@@ -0,0 +1,77 @@
+from google.appengine.ext import db
+
+from mapreduce import context
+from mapreduce import operation as op
+
+from momentum.fatcatmap.models.graph import PageRankScore
+from momentum.fatcatmap.core.graph.pagerank import to_counter
+from momentum.fatcatmap.core.graph.pagerank import PopularityWriter
+from momentum.fatcatmap.core.graph.pagerank import initial_score
+from momentum.fatcatmap.core.graph.pagerank import iterate_score
+from momentum.fatcatmap.core.search.index import rescore_term
+from momentum.fatcatmap.core.search.autocomplete import rescore_prefix
+
+
+def initialize_rank(node):
+
+	''' Iteration 0 of a PageRank run: writes each node's starting score and edge weight, and counts nodes and dangling score. '''
+
+	params = context.get().mapreduce_spec.mapper.params
+
+	score = initial_score(params['run'], node)
+	yield op.db.Put(score)
+
+	yield op.counters.Increment('pagerank-nodes')
+	if score.strength == 0:
+		yield op.counters.Increment('pagerank-dangling', to_counter(score.rank))
+
+
+def iterate_rank(node):
+
+	''' One PageRank iteration: writes the node's new score through the mutation pool, drops its score from two iterations back (nothing reads it any more), and counts how far it moved. '''
+
+	params = context.get().mapreduce_spec.mapper.params
+	run, iteration = params['run'], int(params['iteration'])
+
+	score, previous = iterate_score(run, iteration, node, int(params['nodes']), float(params['dangling']))
+	yield op.db.Put(score)
+
+	if iteration >= 2:
+		yield op.db.Delete(PageRankScore.key_for(run, iteration-2, node.key()))
+
+	yield op.counters.Increment('pagerank-nodes')
+	yield op.counters.Increment('pagerank-change', to_counter(abs(score.rank-previous)))
+	if score.strength == 0:
+		yield op.counters.Increment('pagerank-dangling', to_counter(score.rank))
+
+
+def write_popularity(node):
+
+	''' Final pass of a run: stores the node's converged score as Node.popularity, and deletes the run's last two iterations of scores. Nodes are handed to the shard's PopularityWriter, which reads their scores in batches, sets popularity only where it changed and deletes the scores. '''
+
+	ctx = context.get()
+	params = ctx.mapreduce_spec.mapper.params
+	run, iteration = params['run'], int(params['iteration'])
+
+	writer = ctx.get_pool('popularity_writer')
+	if writer is None:
+		writer = PopularityWriter(run, iteration, ctx.counters)
+		ctx.register_pool('popularity_writer', writer)
+
+	writer.add(node.key())
+
+
+def rescore_search_term(search_term):
+
+	''' Refreshes the popularity scores held in a search posting list. The list is re-read and rescored in a transaction (see core.search.index.rescore_term), so postings indexed while the mapper runs aren't lost. '''
+
+	if rescore_term(search_term.key()):
+		yield op.counters.Increment('pagerank-search-terms')
+
+
+def rescore_search_prefix(bucket):
+
+	''' Refreshes the popularity scores held in an autocomplete bucket (see rescore_search_term). '''
+
+	if rescore_prefix(bucket.key()):
+		yield op.counters.Increment('pagerank-search-prefixes')
@@ -0,0 +1,37 @@
+import pipeline
+
+from mapreduce import operation as op
+
+from momentum.fatcatmap.models.opensecrets import CampaignContributor
+from momentum.fatcatmap.core.graph.resolution import canonical_pair
+from momentum.fatcatmap.core.graph.resolution import ContributorResolver
+from momentum.fatcatmap.pipelines.graph import MergeNodes
+
+
+_resolver = None
+
+
+def resolve_contributor(native):
+
+	''' Adds a contributor to the blocking index and starts a MergeNodes pipeline for every duplicate it matches. The lower node key survives each merge, so both sides of a match start the same (idempotent) merge. '''
+
+	global _resolver
+
+	## CampaignContributor shares the Native kind with every other native
+	if not isinstance(native, CampaignContributor):
+		return
+
+	if _resolver is None:
+		_resolver = ContributorResolver()
+
+	node_key = native.parent_key()
+	for match, score in _resolver.match(node_key, native.name):
+
+		canonical, duplicate = canonical_pair(node_key, match)
+		try:
+			MergeNodes(str(canonical), str(duplicate), score).start(idempotence_key='merge-node-'+str(duplicate), queue_name=MergeNodes.queue_name)
+			yield op.counters.Increment('contributor-merges')
+		except pipeline.PipelineExistsError:
+			pass
+
+	yield op.counters.Increment('contributors-resolved')
@@ -0,0 +1,19 @@
+from mapreduce import context
+from mapreduce import operation as op
+
+from momentum.fatcatmap.core.search.index import PostingPool
+
+
+def index_native(native):
+
+	''' Writes a SearchPosting for every term in a native's node, tagged with the rebuild's generation. Natives are batched by the shard's PostingPool, which reads their nodes and writes their postings together. '''
+
+	ctx = context.get()
+
+	pool = ctx.get_pool('search_postings')
+	if pool is None:
+		pool = PostingPool(int(ctx.mapreduce_spec.params.get('generation', 0)), ctx.counters)
+		ctx.register_pool('search_postings', pool)
+
+	pool.add(native)
+	yield op.counters.Increment('search-natives')
@@ -1,9 +1,9 @@
-from mapreduce import operation as op
+from momentum.fatcatmap.mappers.loader import load_with
 
 
-def process(line):
-	
-	## Unpack line data
-	byte_offset, line_value = line
-	
-	
\ No newline at end of file
+def legislators(line):
+
+	''' Loads a line of the Sunlight legislators CSV (the "sunlight_legislators" bulk loader). '''
+
+	for operation in load_with('sunlight_legislators', line):
+		yield operation
@@ -3,14 +3,18 @@ from google.appengine.ext import db
 from ProvidenceClarity.data.core.model import Model
 from ProvidenceClarity.data.core.polymodel import PolyPro
 
+from momentum.fatcatmap.core.data.caching import entity_cache
+from momentum.fatcatmap.core.data.properties import CachedReferenceProperty
+
 
 class USState(Model):
+    _entity_cache = entity_cache
     fullname = db.StringProperty()
     abbreviation = db.StringProperty()
 
 
 class District(PolyPro):
-    state = db.ReferenceProperty(USState, collection_name='districts')
+    state = CachedReferenceProperty(USState, collection_name='districts')
 
 
 class ZipCode(Model):
@@ -1,45 +1,265 @@
+import hashlib
+
 from google.appengine.ext import db
+from google.appengine.ext import blobstore
 
 from ProvidenceClarity.data.core.model import Model
 from ProvidenceClarity.data.core.polymodel import PolyPro
 
+from momentum.fatcatmap.core.data.caching import entity_cache
+from momentum.fatcatmap.core.data.properties import CachedReferenceProperty
+
 from momentum.fatcatmap.models.system import _Counter_
 from momentum.fatcatmap.models.system import _ConfigGroup_
 
 from momentum.fatcatmap.models.services import NodeID
 from momentum.fatcatmap.models.services import EdgeID
+from momentum.fatcatmap.models.services import ExtIDIndex
+
+_ADJACENCY_SHARD_SIZE = 2500
+_MARK_PAGE_SIZE = 500
+_SUPER_EDGE_SHARDS = 10
 
 
 #### ==== Graph-wide Models ==== ####
 class Graph(Model):
 	name = db.StringProperty()
 
+class GraphSnapshotFile(Model):
+
+    ''' A binary graph snapshot in the blobstore (see core.graph.snapshot). Edges logged since started, when its build began, are replayed over it on load. '''
+
+    blob = blobstore.BlobReferenceProperty()
+    version = db.IntegerProperty(indexed=False)
+    started = db.DateTimeProperty()
+    node_count = db.IntegerProperty(indexed=False)
+    entry_count = db.IntegerProperty(indexed=False)
+    size = db.IntegerProperty(indexed=False)
+
+class GraphScoreFile(Model):
+
+    ''' Per-node scores computed from a stored snapshot (e.g. influence - see core.graph.centrality), as a blob of floats by snapshot node ID. '''
+
+    snapshot = db.ReferenceProperty(GraphSnapshotFile, collection_name='scores')
+    name = db.StringProperty()
+    blob = blobstore.BlobReferenceProperty()
+    count = db.IntegerProperty(indexed=False)
+    created = db.DateTimeProperty(auto_now_add=True)
+
 
 #### ==== Models for Graph Nodes ==== ####
 class NodeType(Model):
+    _entity_cache = entity_cache
     name = db.StringProperty()
     description = db.TextProperty()
     native_impl_class = db.StringListProperty(indexed=False)
 
 class Node(Model):
     label = db.StringProperty()
-    type = db.ReferenceProperty(NodeType, collection_name='nodes')
+    type = CachedReferenceProperty(NodeType, collection_name='nodes')
+    adjacency_shards = db.IntegerProperty(default=1, indexed=False)
+    popularity = db.FloatProperty(default=0.0)
+    influence = db.FloatProperty(default=0.0)
+
+    def neighbors(self, types=None, limit=None):
+
+        ''' Returns this node's neighbours as (node key, edge type, score) tuples, highest score first, with one batch get of its adjacency shards. '''
+
+        shard_keys = NodeAdjacency.shard_keys(self.key(), self.adjacency_shards or 1)
+
+        entries = []
+        for shard in db.get(shard_keys):
+            if shard is not None:
+                entries.extend(shard.entries())
+
+        if types is not None:
+            if isinstance(types, basestring):
+                types = [types]
+            entries = [entry for entry in entries if entry[1] in types]
+
+        entries.sort(key=lambda entry: entry[2], reverse=True)
+
+        if limit is not None:
+            return entries[0:limit]
+        return entries
+
+    @classmethod
+    def set_score(cls, node_key, name, value):
+
+        ''' Sets one score property (e.g. popularity) on a node, in a transaction that re-reads it, so writes made to the node's other properties since it was read aren't lost. Returns True if the node was written. '''
+
+        def txn():
+            node = db.get(node_key)
+            if node is None or getattr(node, name) == value:
+                return False
+            setattr(node, name, value)
+            node.put()
+            return True
+
+        return db.run_in_transaction(txn)
+
+    @classmethod
+    def get_by_ext_id(cls, service, value):
+
+        ''' Returns the node carrying an external ID (e.g. service 'opensecrets', value a CRP ID), or None. '''
+
+        return cls.get_by_ext_ids(service, [value]).get(value)
+
+    @classmethod
+    def get_by_ext_ids(cls, service, values):
+
+        ''' Resolves many external IDs from one service at once: one batch get of the reverse index, then one of the nodes. Returns a dict of value => node, for the values that resolved. '''
+
+        index_entries = db.get([ExtIDIndex.key_for(service, value) for value in values])
+
+        resolved = [(value, ExtIDIndex.node.get_value_for_datastore(entry)) for value, entry in zip(values, index_entries) if entry is not None]
+        nodes = cls.get([node_key for value, node_key in resolved])
+
+        return dict([(value, node) for (value, node_key), node in zip(resolved, nodes) if node is not None])
+
+class AdjacencyMark(Model):
+
+    ''' Marks an edge as counted into its source node's adjacency shards, with the score it was counted at. Keyed under the node by neighbour and edge key, so a neighbour's marks are one contiguous key range, and kept out of the shards so they don't grow them. '''
+
+    score = db.FloatProperty(default=0.0, indexed=False)
+
+    @classmethod
+    def key_for(cls, node_key, neighbor_key, edge_key):
+        return db.Key.from_path(cls.kind(), 'n:'+str(neighbor_key)+':'+hashlib.sha1(str(edge_key)).hexdigest(), parent=node_key)
 
     @classmethod
-    def get_by_ext_id(id_name, id_value):
-        n = NodeID.all().filter('name =', id_name).filter('value =', id_value).get()
-        if n is None or len(n) == 0:
-            return None
-        else:
-            return db.get(n.parent())
+    def keys_for_neighbor(cls, node_key, neighbor_key, limit):
+
+        ''' Keys of up to limit marks a node holds for one neighbour. '''
+
+        query = cls.all(keys_only=True).ancestor(node_key)
+        query.filter('__key__ >=', db.Key.from_path(cls.kind(), 'n:'+str(neighbor_key)+':', parent=node_key))
+        query.filter('__key__ <', db.Key.from_path(cls.kind(), 'n:'+str(neighbor_key)+';', parent=node_key))
+        return query.fetch(limit)
+
+class NodeAdjacency(Model):
+
+    ''' Denormalised, sharded adjacency list for a node. Stored as a child of the node, with the shard number as key name. '''
+
+    neighbors = db.ListProperty(db.Key, indexed=False)
+    edge_types = db.StringListProperty(indexed=False)
+    scores = db.ListProperty(float, indexed=False)
+
+    def entries(self):
+        return zip(self.neighbors, self.edge_types, self.scores)
+
+    def is_full(self):
+        return len(self.neighbors) >= _ADJACENCY_SHARD_SIZE
+
+    @classmethod
+    def shard_keys(cls, node_key, shard_count):
+        return [db.Key.from_path(cls.kind(), str(shard), parent=node_key) for shard in xrange(0, shard_count)]
+
+    @classmethod
+    def add_neighbor(cls, node_key, neighbor_key, edge_type, score, edge_key):
+
+        '''
+
+        Records (or accumulates the score of) an edge from node_key to neighbor_key. Each
+        edge is counted once: an AdjacencyMark holding the score it was counted at is
+        written alongside. An edge that's counted again (a retry, or a re-run that
+        rewrote it) only adds the difference from that score, so retries don't inflate
+        scores and changed edges are picked up. Runs in a transaction on the node's
+        entity group. Returns the shard key written, or None if nothing changed or the
+        node doesn't exist.
+
+        '''
+
+        def txn():
+
+            node = db.get(node_key)
+            if node is None:
+                return None
+
+            shard_count = node.adjacency_shards or 1
+            shard_keys = cls.shard_keys(node_key, shard_count)
+            mark_key = AdjacencyMark.key_for(node_key, neighbor_key, edge_key)
+
+            entities = db.get(shard_keys+[mark_key])
+            shards, mark = entities[0:-1], entities[-1]
+
+            counted = 0.0
+            if mark is not None:
+                if mark.score == score:
+                    return None
+                counted = mark.score
+
+            ## Accumulate onto an existing entry for this neighbour and edge type
+            for shard in shards:
+                if shard is None:
+                    continue
+                for index, (existing_key, existing_type, existing_score) in enumerate(shard.entries()):
+                    if existing_key == neighbor_key and existing_type == edge_type:
+                        shard.scores[index] = existing_score+score-counted
+                        db.put([shard, AdjacencyMark(key=mark_key, score=score)])
+                        return shard.key()
+
+            ## Otherwise append to the last shard, opening a new one if it's full
+            shard = shards[-1]
+            if shard is None:
+                shard = cls(key=shard_keys[-1])
+            elif shard.is_full():
+                node.adjacency_shards = shard_count+1
+                shard = cls(key=db.Key.from_path(cls.kind(), str(shard_count), parent=node_key))
+                node.put()
+
+            shard.neighbors.append(neighbor_key)
+            shard.edge_types.append(edge_type)
+            shard.scores.append(score)
+
+            return db.put([shard, AdjacencyMark(key=mark_key, score=score)])[0]
+
+        return db.run_in_transaction(txn)
+
+    @classmethod
+    def remove_neighbor(cls, node_key, neighbor_key):
+
+        ''' Drops every entry for neighbor_key from a node's adjacency shards, in a transaction on the node's entity group, then deletes the neighbour's AdjacencyMarks. Returns the number of entries removed. '''
+
+        def txn():
+
+            node = db.get(node_key)
+            if node is None:
+                return 0
+
+            removed = 0
+            for shard in db.get(cls.shard_keys(node_key, node.adjacency_shards or 1)):
+                if shard is None or neighbor_key not in shard.neighbors:
+                    continue
+                kept = [entry for entry in shard.entries() if entry[0] != neighbor_key]
+                removed += len(shard.neighbors)-len(kept)
+                shard.neighbors = [entry[0] for entry in kept]
+                shard.edge_types = [entry[1] for entry in kept]
+                shard.scores = [entry[2] for entry in kept]
+                shard.put()
+
+            return removed
+
+        removed = db.run_in_transaction(txn)
+
+        while True:
+            marks = AdjacencyMark.keys_for_neighbor(node_key, neighbor_key, _MARK_PAGE_SIZE)
+            if len(marks) == 0:
+                break
+            db.delete(marks)
+
+        return removed
+
 
 class Native(PolyPro):
     version = db.IntegerProperty(default=1)
     node = db.ReferenceProperty(Node, collection_name='native')
+    fingerprint = db.StringProperty(indexed=False)
 
 
 #### ==== Models for Node Relationships ==== ####
 class EdgeType(Model):
+    _entity_cache = entity_cache
     name = db.StringProperty()
     plural = db.StringProperty()
     edge_text = db.StringProperty()
@@ -51,10 +271,83 @@ class SuperEdge(Model):
     target = db.ListProperty(db.Key)
     partner = db.ListProperty(db.Key)
     connection = db.ListProperty(db.Key)
+
+    @classmethod
+    def key_name_for(cls, node_a, node_b):
+        return hashlib.sha1('::'.join(sorted([str(node_a), str(node_b)]))).hexdigest()
+
+    @classmethod
+    def key_for(cls, node_a, node_b):
+
+        ''' Deterministic SuperEdge key for a node pair (order doesn't matter). '''
+
+        return db.Key.from_path(cls.kind(), cls.key_name_for(node_a, node_b))
+
+    @classmethod
+    def shard_keys(cls, super_edge_key):
+        return [db.Key.from_path(SuperEdgeCounter.kind(), super_edge_key.name()+':'+str(shard)) for shard in xrange(0, _SUPER_EDGE_SHARDS)]
+
+    @classmethod
+    def accumulate(cls, super_edge_key, edge_key, score):
+
+        '''
+
+        Adds an edge's score to one of the SuperEdge's counter shards. The shard is
+        picked from the edge key, so a retried accumulation always lands on the same
+        shard, where it's recognised: the shard keeps the score each edge was counted
+        at, and only the difference is applied (nothing, for a plain retry). Returns
+        False if nothing changed.
+
+        '''
+
+        shard_keys = cls.shard_keys(super_edge_key)
+        shard_key = shard_keys[int(hashlib.md5(str(edge_key)).hexdigest(), 16) % len(shard_keys)]
+
+        def txn():
+
+            shard = db.get(shard_key)
+            if shard is None:
+                shard = SuperEdgeCounter(key=shard_key, super_edge=super_edge_key, value=0)
+
+            elif edge_key in shard.edges:
+                index = shard.edges.index(edge_key)
+                if shard.edge_scores[index] == score:
+                    return False
+                shard.score = shard.score+score-shard.edge_scores[index]
+                shard.edge_scores[index] = score
+                shard.put()
+                return True
+
+            shard.value = (shard.value or 0)+1
+            shard.score = shard.score+score
+            shard.edges.append(edge_key)
+            shard.edge_scores.append(score)
+            shard.put()
+
+            return True
+
+        return db.run_in_transaction(txn)
+
+    @classmethod
+    def rollup(cls, super_edge_key, nodes):
+
+        ''' Sums a SuperEdge's counter shards into SuperEdge.score. Shards are fetched by key, so no index scan is involved. '''
+
+        score = 0.0
+        edges = []
+        for shard in db.get(cls.shard_keys(super_edge_key)):
+            if shard is not None:
+                score += shard.score
+                edges.extend(shard.edges)
+
+        super_edge = cls(key=super_edge_key, target=sorted(nodes, key=str), connection=edges, score=score)
+        super_edge.put()
+
+        return super_edge
     
 class Edge(PolyPro):
     score = db.FloatProperty(default=0.1)
-    type = db.ReferenceProperty(EdgeType, collection_name='edges')
+    type = CachedReferenceProperty(EdgeType, collection_name='edges')
     source = db.ReferenceProperty(Node, collection_name='outgoing_edges')
     target = db.ReferenceProperty(Node, collection_name='incoming_edges')
     partner = db.SelfReferenceProperty()
@@ -78,9 +371,28 @@ class EdgeTypeConfig(_ConfigGroup_):
     parent_ref = db.ReferenceProperty(EdgeType, collection_name='config')
 
 
+#### ==== Analytics Models ==== ####
+class PageRankScore(Model):
+
+    ''' A node's score after one iteration of a PageRank run (see core.graph.pagerank), with its total edge weight alongside so neighbours can split the score without reading its adjacency. '''
+
+    rank = db.FloatProperty(default=1.0, indexed=False)
+    strength = db.FloatProperty(default=0.0, indexed=False)
+
+    @classmethod
+    def key_for(cls, run, iteration, node_key):
+        return db.Key.from_path(cls.kind(), 'r:'+run+':'+str(iteration)+':'+str(node_key))
+
+
 #### ==== Counter Models ==== ####
 class NodeTypeCounter(_Counter_):
     pass
 
 class EdgeTypeCounter(_Counter_):
-    pass
\ No newline at end of file
+    pass
+
+class SuperEdgeCounter(_Counter_):
+    super_edge = db.ReferenceProperty(SuperEdge, collection_name='score_shards')
+    score = db.FloatProperty(default=0.0)
+    edges = db.ListProperty(db.Key, indexed=False)
+    edge_scores = db.ListProperty(float, indexed=False)
\ No newline at end of file
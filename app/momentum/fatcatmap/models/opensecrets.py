@@ -1,5 +1,7 @@
 from google.appengine.ext import db
 
+from ProvidenceClarity.data.core.model import Model
+
 from momentum.fatcatmap.models.graph import DirectedEdge
 from momentum.fatcatmap.models.industry import Organization
 from momentum.fatcatmap.models.politics import ElectionCycle
@@ -7,7 +9,37 @@ from momentum.fatcatmap.models.politics import ElectionCycle
 
 class CampaignContribution(DirectedEdge):
     total = db.IntegerProperty()
+    count = db.IntegerProperty()
+    cycle = db.ReferenceProperty(ElectionCycle, collection_name='contributions')
 
 
 class CampaignContributor(Organization):
-    name = db.StringProperty()
\ No newline at end of file
+    name = db.StringProperty()
+
+
+#### ==== Contribution Aggregation ==== ####
+class ContributionTotal(Model):
+
+    ''' One (contributor, recipient, cycle) triple seen by a bulk contribution load. Keyed by "<cycle>:<contributor>><recipient>", where both parties are "<service>:<id>". Partial sums from each mapper shard are stored as its children. '''
+
+    loader = db.StringProperty()
+    run = db.StringProperty()
+    edge_type = db.StringProperty(indexed=False)
+    contributor = db.StringProperty(indexed=False)
+    recipient = db.StringProperty(indexed=False)
+    cycle = db.StringProperty(indexed=False)
+    total = db.IntegerProperty(indexed=False)
+    count = db.IntegerProperty(indexed=False)
+
+    @classmethod
+    def key_for(cls, cycle, contributor, recipient):
+        return db.Key.from_path(cls.kind(), str(cycle)+':'+contributor+'>'+recipient)
+
+
+class ContributionPartial(Model):
+
+    ''' A partial sum for a ContributionTotal, combined in memory by one mapper shard. Keyed by run, shard and position, so a retried slice rewrites its own partials. '''
+
+    run = db.StringProperty(indexed=False)
+    total = db.IntegerProperty(indexed=False)
+    count = db.IntegerProperty(indexed=False)
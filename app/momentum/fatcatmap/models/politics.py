@@ -3,6 +3,9 @@ from google.appengine.ext import db
 from ProvidenceClarity.data.core.model import Model
 from ProvidenceClarity.data.core.polymodel import PolyPro
 
+from momentum.fatcatmap.core.data.caching import entity_cache
+from momentum.fatcatmap.core.data.properties import CachedReferenceProperty
+
 from momentum.fatcatmap.models.geo import USState
 from momentum.fatcatmap.models.geo import District
 
@@ -12,6 +15,7 @@ from momentum.fatcatmap.models.group import Committee
 
 #### ==== Legislature Models ==== ####
 class Legislature(PolyPro):
+    _entity_cache = entity_cache
     name = db.StringProperty()
     short_name = db.StringProperty()
     total_members = db.IntegerProperty()
@@ -22,10 +26,11 @@ class StateLegislature(Legislature):
 
 #### ==== Legislative House Models ==== ####
 class LegislativeChamber(PolyPro):
+    _entity_cache = entity_cache
     name = db.StringProperty()
     short_name = db.StringProperty()
     title_abbr = db.StringProperty()
-    legislature = db.ReferenceProperty(Legislature, collection_name='houses')
+    legislature = CachedReferenceProperty(Legislature, collection_name='houses')
     total_members = db.IntegerProperty()
 
 class UpperLegislativeChamber(LegislativeChamber):
@@ -38,11 +43,11 @@ class LowerLegislativeChamber(LegislativeChamber):
 #### ==== District/Seat Models ==== ####
 class UpperChamberDistrict(District):
     seniority = db.StringProperty(choices=['junior','senior'])
-    chamber = db.ReferenceProperty(UpperLegislativeChamber, collection_name='districts')
+    chamber = CachedReferenceProperty(UpperLegislativeChamber, collection_name='districts')
 
 class LowerChamberDistrict(District):
     number = db.IntegerProperty()
-    chamber = db.ReferenceProperty(LowerLegislativeChamber, collection_name='districts')
+    chamber = CachedReferenceProperty(LowerLegislativeChamber, collection_name='districts')
 
 
 #### ==== Party Politics ==== ####
@@ -0,0 +1,43 @@
+from google.appengine.ext import db
+
+from ProvidenceClarity.data.core.model import Model
+
+
+#### ==== Entity Resolution Models ==== ####
+class ResolutionBlock(Model):
+
+    ''' One blocking key's members: the nodes whose normalised names produce the key, and those names. Keyed by "b/<blocking key>". Only nodes in the same block are ever compared, and an overflowed block (too common to be useful) holds no members. '''
+
+    nodes = db.ListProperty(db.Key, indexed=False)
+    names = db.StringListProperty(indexed=False)
+    overflowed = db.BooleanProperty(default=False, indexed=False)
+
+    @classmethod
+    def key_for(cls, block):
+        return db.Key.from_path(cls.kind(), 'b/'+block)
+
+
+class NodeMerge(Model):
+
+    ''' Records that a duplicate node was merged into a canonical one. Keyed by the duplicate's key, so old references can be followed to the surviving node. '''
+
+    canonical = db.ReferenceProperty(indexed=False)
+    label = db.StringProperty(indexed=False)
+    score = db.FloatProperty(indexed=False)
+    merged = db.DateTimeProperty(auto_now_add=True)
+
+    @classmethod
+    def key_for(cls, node_key):
+        return db.Key.from_path(cls.kind(), 'n/'+str(node_key))
+
+
+class MergeLock(Model):
+
+    ''' Held on a node while a merge involving it runs, so merges that share a node run one at a time. Keyed by "l/<node key>". '''
+
+    holder = db.StringProperty(indexed=False)
+    acquired = db.DateTimeProperty(indexed=False)
+
+    @classmethod
+    def key_for(cls, node_key):
+        return db.Key.from_path(cls.kind(), 'l/'+str(node_key))
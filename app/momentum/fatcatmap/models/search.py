@@ -0,0 +1,52 @@
+from google.appengine.ext import db
+
+from ProvidenceClarity.data.core.model import Model
+
+from momentum.fatcatmap.core.data.caching import entity_cache
+from momentum.fatcatmap.core.data.properties.indexing import IndexEntryListProperty
+
+
+#### ==== Models for Search ==== ####
+class SearchTerm(Model):
+
+    ''' Posting list for one (stemmed) search term, keyed by the term. Entries are (node key, popularity, relevance, final) tuples, sorted by final score, highest first. '''
+
+    _entity_cache = entity_cache
+    entries = IndexEntryListProperty()
+    generation = db.IntegerProperty(default=0, indexed=False)
+    modified = db.DateTimeProperty(auto_now=True, indexed=False)
+
+    @classmethod
+    def key_for(cls, term):
+        ## Key names may not start with a digit, so terms are prefixed
+        return db.Key.from_path(cls.kind(), 't/'+term)
+
+    def term(self):
+        return self.key().name()[2:]
+
+class SearchPosting(Model):
+
+    ''' One term occurrence for one node, written by the rebuild mapper and compacted into SearchTerm posting lists. Keyed by "t/<term>:<node key>", so each term's postings are contiguous in key order. '''
+
+    term = db.StringProperty()
+    node = db.ReferenceProperty(collection_name='search_postings', indexed=False)
+    popularity = db.FloatProperty(default=0.0, indexed=False)
+    relevance = db.FloatProperty(default=0.0, indexed=False)
+    final = db.FloatProperty(default=0.0, indexed=False)
+    generation = db.IntegerProperty(default=0, indexed=False)
+
+    @classmethod
+    def key_name_for(cls, term, node_key):
+        return 't/'+term+':'+str(node_key)
+
+class SearchPrefix(Model):
+
+    ''' Autocomplete bucket for one normalised prefix: the top nodes whose label (or a word in it) starts with the prefix, best first, with their labels alongside so completions need no further lookups. '''
+
+    _entity_cache = entity_cache
+    entries = IndexEntryListProperty()
+    labels = db.StringListProperty(indexed=False)
+
+    @classmethod
+    def key_for(cls, prefix):
+        return db.Key.from_path(cls.kind(), 'p/'+prefix)
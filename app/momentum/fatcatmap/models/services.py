@@ -48,4 +48,31 @@ class NodeID(ExtID):
     pass
     
 class EdgeID(ExtID):
-    pass
\ No newline at end of file
+    pass
+
+class ExtIDIndex(Model):
+
+    ''' Reverse index from an external ID to the node carrying it. Keyed by "<service>:<value>", so IDs resolve with a get (or one batch get for many). '''
+
+    node = db.ReferenceProperty(indexed=False)
+    name = db.StringProperty(indexed=False)
+
+    @classmethod
+    def key_for(cls, service, value):
+        return db.Key.from_path(cls.kind(), str(service)+':'+unicode(value))
+
+
+#### ==== Sync Models ==== ####
+class SyncRecord(Model):
+
+    ''' Last-synced state of one upstream record: its content fingerprint, the node and native built from it, and the IDs of related records synced with it. Keyed by "<service>:<kind>:<record id>". '''
+
+    fingerprint = db.StringProperty(indexed=False)
+    node = db.ReferenceProperty(indexed=False)
+    native = db.ReferenceProperty(indexed=False)
+    related = db.StringListProperty(indexed=False)
+    synced = db.DateTimeProperty(auto_now=True)
+
+    @classmethod
+    def key_for(cls, service, kind, record_id):
+        return db.Key.from_path(cls.kind(), str(service)+':'+str(kind)+':'+unicode(record_id))
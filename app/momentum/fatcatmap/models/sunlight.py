@@ -1,5 +1,7 @@
 from google.appengine.ext import db
 
+from momentum.fatcatmap.core.data.properties import CachedReferenceProperty
+
 from momentum.fatcatmap.models.geo import District
 from momentum.fatcatmap.models.group import GroupMembership
 from momentum.fatcatmap.models.person import Person
@@ -9,7 +11,7 @@ from momentum.fatcatmap.models.politics import LegislativeChamber
 
 class Legislator(Person):
 
-    house = db.ReferenceProperty(LegislativeChamber, collection_name='members')
+    house = CachedReferenceProperty(LegislativeChamber, collection_name='members')
     district = db.ReferenceProperty(District, collection_name='members')
     party = db.ReferenceProperty(PoliticalParty, collection_name='legislators')
 
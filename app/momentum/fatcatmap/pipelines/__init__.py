@@ -15,8 +15,8 @@ from google.appengine.api import taskqueue
 
 from momentum.fatcatmap.models.services import NodeID
 from momentum.fatcatmap.models.services import ExtService
-from momentum.fatcatmap.models.services import ExtServiceKey
 
+from momentum.fatcatmap.core.services.keys import get_key_pool
 from momentum.fatcatmap.core.data.adapters.json import FCMJSONAdapter
 
 
@@ -155,9 +155,8 @@ class FCMPipeline(pipeline.Pipeline):
 
             manifest = db.Key.from_path(ExtService.kind(), getattr(self, 'service'))
 
-            self.service = {'manifest':manifest}
-            keys = ExtServiceKey.all().ancestor(self.service['manifest']).order('-last_used').fetch(1)
-            self.service['keys'] = keys
+            ## Keys come from the instance's key pool, so constructing a pipeline costs no RPCs
+            self.service = {'manifest':manifest, 'pool':get_key_pool(getattr(self, 'service'))}
 
         ## Run Pre-Execute Hook
         if hasattr(self, 'pre_execute'):
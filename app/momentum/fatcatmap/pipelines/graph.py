@@ -1,23 +1,51 @@
 import sys
+import time
 
 if 'distlib' not in sys.path:
     sys.path.insert(1, 'lib')
     sys.path.insert(2, 'distlib')
 
+import config
 import logging
 
 from google.appengine.ext import db
+from google.appengine.ext import blobstore
 
-from tipfy import import_string
+from pipeline import common
+from mapreduce import control
 from momentum.fatcatmap.pipelines import FCMPipeline
+from momentum.fatcatmap.core.graph.bulk import put_nodes
+from momentum.fatcatmap.core.graph.extids import put_ext_ids
+from momentum.fatcatmap.core.graph.extids import build_ext_ids
+from momentum.fatcatmap.core.graph.registry import get_node_type
+from momentum.fatcatmap.core.graph.registry import get_edge_type
+from momentum.fatcatmap.core.search.index import index_nodes
+from momentum.fatcatmap.core.graph.sync import SyncReport
+from momentum.fatcatmap.core.graph.sync import record_syncs
+from momentum.fatcatmap.core.graph.merge import merge_nodes
+from momentum.fatcatmap.core.graph.loader import connect_edges
+from momentum.fatcatmap.core.graph.loader import build_edge_pair
+from momentum.fatcatmap.core.graph.snapshot import save_snapshot
+from momentum.fatcatmap.core.graph.snapshot import save_build
+from momentum.fatcatmap.core.graph.snapshot import resume_build
+from momentum.fatcatmap.core.graph.snapshot import SnapshotBuilder
+from momentum.fatcatmap.core.graph.snapshot import prune_snapshots
+from momentum.fatcatmap.core.graph.snapshot import open_snapshot
+from momentum.fatcatmap.core.graph.centrality import top_nodes
+from momentum.fatcatmap.core.graph.centrality import read_values
+from momentum.fatcatmap.core.graph.centrality import save_scores
+from momentum.fatcatmap.core.graph.centrality import simple_graph
+from momentum.fatcatmap.core.graph.centrality import dependencies
+from momentum.fatcatmap.core.graph.centrality import scale_betweenness
+from momentum.fatcatmap.core.graph.centrality import betweenness_sources
 
 from momentum.fatcatmap.models.group import Group
-from momentum.fatcatmap.models.graph import NodeType
-from momentum.fatcatmap.models.graph import SuperEdge
+from momentum.fatcatmap.models.graph import NodeAdjacency
+from momentum.fatcatmap.models.graph import GraphScoreFile
+from momentum.fatcatmap.models.graph import GraphSnapshotFile
 from momentum.fatcatmap.models.graph import Edge as GraphEdge
 from momentum.fatcatmap.models.graph import Node as GraphNode
-
-from momentum.fatcatmap.models.services import NodeID
+from momentum.fatcatmap.models.graph import Native as GraphNative
 
 
 
@@ -31,8 +59,7 @@ class Node(FCMPipeline):
         self.log.info('Creating Node')
 
         ## Grab NodeType record and Natural Class
-        TargetNodeType = NodeType.get_by_key_name(type)
-        TargetNodeNative = import_string('.'.join(TargetNodeType.native_impl_class))
+        TargetNodeType, TargetNodeNative = get_node_type(type)
 
         self.log.debug('Pulled NodeType "'+str(TargetNodeType)+'" with key_name "'+str(type)+'".')
 
@@ -79,6 +106,9 @@ class Node(FCMPipeline):
 
         self.log.info('CreateNode transaction complete.')
 
+        ## Make the new node searchable
+        index_nodes([(node, native)])
+
         ## Fill named outputs
         self.fill(self.outputs.node, str(node.key()))
         self.fill(self.outputs.native, str(native.key()))
@@ -86,6 +116,47 @@ class Node(FCMPipeline):
         return node.key()
 
 
+class BulkNodes(FCMPipeline):
+
+    ''' Creates many nodes at once. Fans out one BulkNodesChunk per chunk of (type, label, native_kwargs) tuples. '''
+
+    queue_name = 'graph-worker'
+    chunk_size = 250
+
+    def run(self, nodes, chunk_size=None):
+
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        self.log.info('Creating '+str(len(nodes))+' nodes in chunks of '+str(chunk_size)+'.')
+
+        chunks = []
+        for offset in xrange(0, len(nodes), chunk_size):
+            chunk = yield BulkNodesChunk(nodes[offset:offset+chunk_size])
+            chunks.append(chunk)
+
+        ## Combine chunk results into one list of (node key, native key) pairs
+        yield common.Extend(*chunks)
+
+
+class BulkNodesChunk(FCMPipeline):
+
+    ''' Creates a chunk of nodes and natives with one batched, transaction-free put. '''
+
+    queue_name = 'graph-worker'
+
+    def run(self, nodes):
+
+        self.log.info('Creating node chunk of '+str(len(nodes))+' nodes.')
+
+        ## Resolve types once, pre-allocate keys and write nodes + natives together
+        results = put_nodes(nodes, chunk_size=len(nodes) or 1)
+
+        self.log.info('Node chunk complete.')
+
+        return [(str(node_key), str(native_key)) for node_key, native_key in results]
+
+
 class NodeGroup(FCMPipeline):
 
     queue_name = 'graph-worker'
@@ -105,7 +176,6 @@ class NodeGroup(FCMPipeline):
 
 class Edge(FCMPipeline):
 
-    async = True
     queue_name = 'graph-worker'
     output_names = ['edges']
 
@@ -114,106 +184,340 @@ class Edge(FCMPipeline):
         self.log.info('Creating Edge')
 
         ## Grab EdgeType record and find Implementation Class
-        TargetEdgeType = EdgeType.get_by_key_name(type)
-        TargetEdgeImplClass = import_string('.'.join(TargetEdgeType.edge_impl_class))
+        TargetEdgeType, TargetEdgeImplClass = get_edge_type(type)
 
         self.log.debug('Pulled EdgeType "'+str(TargetEdgeType)+'" with key_name "'+str(type)+'".')
 
         if not isinstance(nodes, list) or len(nodes) != 2:
             self.log.error('Cannot connect more or less than 2 nodes. Failure.')
-            raise BadValueError
+            raise db.BadValueError('Edges must connect exactly 2 nodes.')
 
-        def txn():
+        nodes = [db.Key(str(node)) for node in nodes]
 
-            self.log.debug('================ TRANSACTION ================')
+        ## Create Edge for each node (each lives in its node's entity group). Keys are named
+        ## for this pipeline, so a retried task rewrites the same edges rather than adding more.
+        edges = build_edge_pair(TargetEdgeImplClass, TargetEdgeType, nodes[0], nodes[1], 'p:'+self.pipeline_id, **kwargs)
+        edge_keys = db.put(edges)
 
-            ## Create Edge for each node
-            edges = []
-            edges.append(TargetEdgeImplClass(nodes[0], source=nodes[0], target=nodes[1], type=TargetEdgeType, **kwargs))
-            edges.append(TargetEdgeImplClass(nodes[1], source=nodes[1], target=nodes[0], type=TargetEdgeType, **kwargs))
+        self.log.debug('Edge Keys: '+str(edge_keys))
+        self.log.debug('Edge Class: '+str(TargetEdgeImplClass))
+        self.log.debug('Edge Nodes: '+str(nodes))
 
-            ## Save Edges
-            edge_keys = db.put(edges)
+        ## Accumulate score into the pair's SuperEdge counter shards (rolled up at the end of the
+        ## interval), and maintain the adjacency index on both sides of the edge (both skip edges
+        ## already counted by an earlier try)
+        connect_edges(edges, type)
 
-            ## Assign Partners
-            edges[0].partner = edges[1]
-            edges[1].partner = edges[0]
+        self.log.info('SuperEdge score accumulated for node pair '+str(nodes)+'.')
 
-            ## Save Edges
-            db.put(edges)
+        return [str(key) for key in edge_keys]
 
-            self.log.debug('TXN: Edge Keys: '+str(edges))
-            self.log.debug('TXN: Edge Class: '+str(TargetEdgeImplclass))
-            self.log.debug('TXN: Edge Nodes: '+str(nodes))
 
-            self.log.debug('=============================================')
+class NodeExtID(FCMPipeline):
 
-            ## Get edge followup task (creates/updates an edge pair's connection record)
-            task = self.get_callback_task(transactional=True)
-            try:
-                self.log.debug('TXN: Adding followup task "'+str(task)+'".')
-                task.add(queue_name)
-            except (taskqueue.TombstonedTaskError, taskqueue.TaskAlreadyExistsError):
-                self.log.debug('TXN: Task followup task tombstoned or already queued:  "'+str(task)+'". Moving on.')
-                pass
+    def run(self, node, service, key, value, link=None):
 
-            ## Return values
-            return edges
+        ext_ids = build_ext_ids(db.Key(str(node)), {service: value}, names={service: key}, links={service: link})
+        return [str(key) for key in db.put(ext_ids)]
 
 
-        self.log.info('Starting transaction...')
+class NodeExtIDs(FCMPipeline):
 
-        ## Run transaction
-        edges = db.run_in_transaction(txn)
+    ''' Writes all of a node's external IDs (a dict of service => value), and their reverse index entries, with one batched put. '''
 
-        self.log.info('CreateEdge transaction complete.')
+    def run(self, node, ids, names=None):
 
-        ## Fill named outputs
-        self.fill(self.outputs.edges, edges)
+        count = put_ext_ids([(db.Key(str(node)), ids)], names)
+        self.log.info('Stored '+str(count)+' external IDs for node '+str(node)+'.')
+
+        return count
+
+
+class NodeSyncRecord(FCMPipeline):
+
+    ''' Records the fingerprint (and related record IDs) a node was last synced from, once the node exists. The native is found with a keys-only ancestor query. '''
 
-        return edges
+    def run(self, node, service, kind, record_id, fingerprint, related=None):
 
+        node_key = db.Key(str(node))
+        native_key = GraphNative.all(keys_only=True).ancestor(node_key).get()
 
-    def callback(self):
+        if native_key is None:
+            self.log.warning('No native found for node '+str(node)+', not recording sync for '+service+' '+kind+' '+str(record_id)+'.')
+            return None
 
-        nodes = self.kwargs['nodes']
+        record_syncs(service, kind, [(record_id, fingerprint, node_key, native_key, related)])
+        return str(node_key)
 
-        self.log.info('Following up on SuperEdge health check for node pair '+str(nodes)+'...')
 
-        node_connection = SuperEdge.all().filter('target =', nodes[0]).filter('target =', nodes[1])
+class SyncReportMerge(FCMPipeline):
 
-        if node_connection.count() == 0:
+    ''' Merges the sync reports (dicts, see core.graph.sync) returned by the child pipelines of a sync, logs the result and returns it. '''
 
-            self.log.info('No SuperEdge exists. Creating.')
+    def run(self, name, *reports):
 
-            super_edge = SuperEdge()
-            super_edge.target = nodes
+        report = SyncReport()
+        for child_report in reports:
+            if child_report is not None:
+                report.merge(child_report)
 
-            key = super_edge.put()
+        self.log.info('Sync report for '+name+': '+report.summary())
 
-            self.log.info('Stored SuperEdge at key "'+str(key)+'".')
+        return report.to_dict()
 
+
+class MergeNodes(FCMPipeline):
+
+    ''' Merges a duplicate node into a canonical one (see core.graph.merge). Safe to retry, and retried while another merge holds one of the nodes (MergeLocked). '''
+
+    queue_name = 'graph-worker'
+
+    def __init__(self, *args, **kwargs):
+        super(MergeNodes, self).__init__(*args, **kwargs)
+
+        ## Chained matches wait on each other's node locks, so allow for a few rounds of that
+        self.max_attempts = 8
+
+    def run(self, canonical, duplicate, score=None):
+
+        if merge_nodes(db.Key(canonical), db.Key(duplicate), score):
+            self.log.info('Merged node '+duplicate+' into '+canonical+'.')
+            return canonical
+
+        self.log.info('Nothing to merge for node '+duplicate+'.')
+        return None
+
+
+class BuildGraphSnapshot(FCMPipeline):
+
+    '''
+
+    Builds a snapshot of the whole graph, saves it to the blobstore as the latest one,
+    and prunes old snapshots (see core.graph.snapshot). Outputs
+    the new GraphSnapshotFile's key.
+
+    Each task builds for at most step_seconds. If the build isn't finished by then,
+    the builder is stored in the blobstore and a child BuildGraphSnapshot carries on
+    from it, so a graph of any size is built without running into the task deadline.
+
+    '''
+
+    queue_name = 'graph-worker'
+
+    def run(self, build=None):
+
+        cfg = config.config.get('momentum.fatcatmap.graph.snapshot')
+
+        if build is None:
+            builder = SnapshotBuilder()
         else:
-            super_edge = node_connection.get()
+            builder = resume_build(build)
 
-        edges = []
-        for edge in self.outputs.edges:
-            super_edge.score = super_edge.score+edge.score
-            edge.connection = key
-            edges.append(edge)
+        snapshot = builder.build(time.time()+cfg['step_seconds'])
 
-        db.put(edges)
+        if snapshot is None:
+            self.log.info('Graph snapshot build continues: '+builder.phase+' phase, '+str(len(builder.keys))+' nodes and '+str(len(builder.targets))+' adjacency entries read so far.')
+            following = BuildGraphSnapshot(str(save_build(builder)))
 
-        self.log.info('Computed SuperEdge score: '+str(super_edge.score))
-        self.log.info('SuperEdge and edges saved. Finished health check.')
+        else:
+            record = save_snapshot(snapshot)
+            pruned = prune_snapshots(cfg['keep'])
+            self.log.info('Graph snapshot saved ('+str(record.size)+' bytes), pruned '+str(pruned)+' older snapshots.')
+            following = common.Return(str(record.key()))
 
-        return super_edge
+        ## The state this step started from has been carried forward (or finished with)
+        if build is not None:
+            blobstore.delete(build)
 
+        yield following
 
 
-class NodeExtID(FCMPipeline):
+class PageRank(FCMPipeline):
 
-    def run(self, node, service, key, value, link=None):
+    '''
+
+    Computes PageRank over the whole graph and stores it as Node.popularity. Each pass
+    is a sharded mapper over Node, and each pass's done callback (GraphWorker) reads
+    its counters to start the next one:
+
+        PageRankIteration 0         starting scores
+        PageRankIteration 1..n      until the mean change falls below the tolerance
+        PageRankWrite               Node.popularity, set per node in a small transaction (see PopularityWriter)
+        PageRankRescoreSearch       popularity in search posting lists and autocomplete buckets
+
+    '''
+
+    queue_name = 'graph-worker'
+
+    def run(self, run=None):
+
+        if run is None:
+            run = str(int(time.time()))
+
+        self.log.info('Starting PageRank run '+run+'.')
+
+        return start_pagerank_map('Graph: PageRank (initial)', 'initialize_rank', run, 0)
+
+
+class PageRankIteration(FCMPipeline):
+
+    queue_name = 'graph-worker'
+
+    def run(self, run, iteration, nodes, dangling):
+
+        self.log.info('PageRank run '+run+': starting iteration '+str(iteration)+' over '+str(nodes)+' nodes.')
+
+        return start_pagerank_map('Graph: PageRank (iteration '+str(iteration)+')', 'iterate_rank', run, iteration, nodes=nodes, dangling=dangling)
+
+
+class PageRankWrite(FCMPipeline):
+
+    queue_name = 'graph-worker'
+
+    def run(self, run, iteration):
+
+        self.log.info('PageRank run '+run+': writing node popularity from iteration '+str(iteration)+'.')
+
+        return start_pagerank_map('Graph: PageRank (write)', 'write_popularity', run, iteration, callback='pagerank_search')
+
+
+class PageRankRescoreSearch(FCMPipeline):
+
+    ''' Refreshes the popularity held in the search index once nodes have theirs, with one mapper over posting lists and one over autocomplete buckets. '''
+
+    queue_name = 'graph-worker'
+
+    def run(self, run):
+
+        cfg = config.config.get('momentum.fatcatmap.graph.pagerank')
+
+        jobs = []
+        for name, handler, kind in [('Search Terms', 'rescore_search_term', 'SearchTerm'), ('Search Prefixes', 'rescore_search_prefix', 'SearchPrefix')]:
+            jobs.append(control.start_map('Graph: PageRank (rescore '+name+')',
+                                          'momentum.fatcatmap.mappers.pagerank.'+handler,
+                                          'mapreduce.input_readers.DatastoreInputReader',
+                                          {'entity_kind': 'momentum.fatcatmap.models.search.'+kind, 'run': run},
+                                          shard_count=cfg['shard_count'],
+                                          queue_name=self.queue_name))
+        return jobs
+
+
+class ComputeInfluence(FCMPipeline):
+
+    '''
+
+    Computes every node's influence - its approximate betweenness, the share of
+    shortest paths through the graph that pass through it - over the latest stored
+    snapshot (one is built first if none has been stored yet), and writes it to
+    Node.influence. Started by GraphWorker once a bulk contribution load has written
+    its edges; edges newer than the snapshot count from the next snapshot on.
+
+    The betweenness sample is worked through in chunks of chunk_sources, each a task
+    of its own (InfluenceChunk), so no one task runs long; InfluenceWrite adds up their
+    partial sums.
+
+    '''
+
+    queue_name = 'graph-worker'
+
+    def run(self, run=None):
+
+        record = GraphSnapshotFile.all().order('-started').get()
+        if record is None:
+            self.log.info('No graph snapshot stored yet: building one first.')
+            record_key = yield BuildGraphSnapshot()
+        else:
+            record_key = str(record.key())
+
+        yield InfluenceSample(record_key)
+
+
+class InfluenceSample(FCMPipeline):
+
+    ''' Draws the betweenness sample for a stored snapshot, and fans it out over InfluenceChunks. '''
+
+    queue_name = 'graph-worker'
+
+    def run(self, record_key):
+
+        cfg = config.config.get('momentum.fatcatmap.graph.centrality')
+
+        record = GraphSnapshotFile.get(record_key)
+        sources = betweenness_sources(record.node_count, seed=record_key)
+
+        self.log.info('Computing influence over snapshot '+str(record.started)+' from '+str(len(sources))+' sampled sources.')
+
+        partials = []
+        for offset in xrange(0, len(sources), cfg['chunk_sources']):
+            partials.append((yield InfluenceChunk(record_key, offset, cfg['chunk_sources'])))
+
+        yield InfluenceWrite(record_key, len(sources), *partials)
+
+
+class InfluenceChunk(FCMPipeline):
+
+    ''' Sums node dependencies over one slice of the betweenness sample, and stores them beside the snapshot as a partial score file. '''
+
+    queue_name = 'graph-worker'
+
+    def run(self, record_key, offset, count):
+
+        record = GraphSnapshotFile.get(record_key)
+        graph = simple_graph(record)
+
+        ## The sample is drawn again from the same seed, so every chunk sees the same one
+        sources = betweenness_sources(record.node_count, seed=record_key)[offset:offset+count]
+
+        return str(save_scores(record, 'influence-partial', dependencies(graph, sources)).key())
+
+
+class InfluenceWrite(FCMPipeline):
+
+    ''' Adds up the partial sums of a betweenness sample into influence scores, stores them beside the snapshot, and writes them to Node.influence with a mapper. '''
+
+    queue_name = 'graph-worker'
+
+    def run(self, record_key, count, *partials):
+
+        cfg = config.config.get('momentum.fatcatmap.graph.centrality')
+
+        record = GraphSnapshotFile.get(record_key)
+
+        totals = [0.0]*record.node_count
+        partials = [partial for partial in GraphScoreFile.get(list(partials)) if partial is not None]
+        for partial in partials:
+            totals = [total+value for total, value in zip(totals, read_values(GraphScoreFile.blob.get_value_for_datastore(partial)))]
+
+        influence = scale_betweenness(totals, record.node_count, count)
+        scores = save_scores(record, 'influence', influence)
+
+        for key, value in top_nodes(open_snapshot(record), influence, 5):
+            self.log.info('Influence: '+str(key)+' scores '+str(value)+'.')
+
+        job = control.start_map('Graph: Write Influence',
+                                'momentum.fatcatmap.mappers.centrality.write_influence',
+                                'mapreduce.input_readers.DatastoreInputReader',
+                                {'entity_kind': 'momentum.fatcatmap.models.graph.Node', 'scores': str(scores.key())},
+                                shard_count=cfg['shard_count'],
+                                queue_name=self.queue_name)
+
+        ## The partial sums are no longer needed (any left by a failed run go when their snapshot is pruned)
+        blobstore.delete([GraphScoreFile.blob.get_value_for_datastore(partial) for partial in partials])
+        db.delete(partials)
+
+        return job
+
+
+def start_pagerank_map(name, handler, run, iteration, nodes=0, dangling=0.0, callback='pagerank'):
+
+    ''' Starts one PageRank pass over every Node, calling back to the graph worker when it's done. '''
+
+    cfg = config.config.get('momentum.fatcatmap.graph.pagerank')
 
-        service_object = db.Key.from_path('ExtService', service)
-        return NodeID(node, key_name=key, name=key, value=value, link=link, service=service_object).put()
\ No newline at end of file
+    return control.start_map(name,
+                             'momentum.fatcatmap.mappers.pagerank.'+handler,
+                             'mapreduce.input_readers.DatastoreInputReader',
+                             {'entity_kind': 'momentum.fatcatmap.models.graph.Node', 'run': run, 'iteration': iteration, 'nodes': nodes, 'dangling': dangling},
+                             shard_count=cfg['shard_count'],
+                             mapreduce_parameters={'done_callback': '/_pc/workers/graph/'+callback+'?run='+run+'&iteration='+str(iteration)},
+                             queue_name=PageRank.queue_name)
@@ -1,5 +1,7 @@
 import crpapi
 from momentum.fatcatmap.pipelines import FCMPipeline
+from momentum.fatcatmap.core.services.fetch import AsyncServiceClient
+from momentum.fatcatmap.core.services.caching import response_cache
 
 crp_object = None
 
@@ -7,6 +9,7 @@ crp_object = None
 class CRPPipeline(FCMPipeline):
 
     opensecrets = None
+    opensecrets_async = None
     service = 'opensecrets'
     queue_name = 'sunlight-worker'
 
@@ -15,5 +18,7 @@ class CRPPipeline(FCMPipeline):
         global crp_object
         if crp_object is None:
             crp_object = crpapi.CRP
-            crp_object.apikey = self.service['keys'][0].value
-        self.opensecrets = crp_object
\ No newline at end of file
+            crp_object.key_pool = self.service['pool']
+            crp_object.cache = response_cache
+        self.opensecrets = crp_object
+        self.opensecrets_async = AsyncServiceClient('opensecrets', crp_object)
\ No newline at end of file
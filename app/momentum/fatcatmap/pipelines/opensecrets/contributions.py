@@ -1,4 +1,9 @@
+import time
+
+from mapreduce import control
+
 from momentum.fatcatmap.models.sunlight import Legislator
+from momentum.fatcatmap.models.graph import Node as GraphNode
 
 from momentum.fatcatmap.pipelines.graph import Node
 from momentum.fatcatmap.pipelines.graph import Edge
@@ -16,7 +21,7 @@ class OpenSecretsContributorsSummary(CRPPipeline):
         elif cid is not None and legislator is None:
 
             ## Lookup legislator
-            n = Node.get_by_ext_id('crp_id', cid)
+            n = GraphNode.get_by_ext_id('opensecrets', cid)
             if n is None:
                 legislator = yield SunlightLegislator(crp_id=cid)
 
@@ -30,3 +35,72 @@ class OpenSecretsContributorsSummary(CRPPipeline):
                     with self.pipeline.After(contributor):
                         yield Edge()
 
+
+class OpenSecretsPrefetchContributors(CRPPipeline):
+
+    ''' Warms the response cache with candContrib for many candidates at once, fetched concurrently at the OpenSecrets rate limit. Later per-candidate calls are then served from cache. '''
+
+    def run(self, cids, cycle='2010'):
+
+        futures = self.opensecrets_async.get_many([('candContrib', {'cid': cid, 'cycle': cycle}) for cid in cids])
+
+        failed = []
+        for cid, future in zip(cids, futures):
+            try:
+                future.get_result()
+            except Exception, e:
+                self.log.warning('Could not fetch contributors for '+str(cid)+': '+str(e))
+                failed.append(cid)
+
+        self.log.info('Prefetched contributors for '+str(len(cids)-len(failed))+' of '+str(len(cids))+' candidates.')
+
+        return failed
+
+
+class OpenSecretsLoadContributions(CRPPipeline):
+
+    '''
+
+    Loads a bulk contribution file (a blob) as CampaignContribution edges, in two
+    sharded mapper stages. The first parses lines with a 'contribution' bulk loader
+    mapping and combines them per (contributor, recipient, cycle) in memory before
+    writing partial sums; its done callback starts OpenSecretsWriteContributionEdges,
+    which sums each triple's partials and writes one edge pair per triple.
+
+    '''
+
+    shard_count = 16
+
+    def run(self, blob_key, loader='opensecrets_pac_totals', run=None):
+
+        if run is None:
+            run = str(int(time.time()))
+
+        self.log.info('Loading contributions from blob '+str(blob_key)+' with loader "'+loader+'" (run '+run+').')
+
+        return control.start_map('OpenSecrets: Combine Contributions',
+                                 'momentum.fatcatmap.mappers.contributions.combine_contribution',
+                                 'mapreduce.input_readers.BlobstoreLineInputReader',
+                                 {'blob_keys': str(blob_key), 'loader': loader, 'run': run},
+                                 shard_count=self.shard_count,
+                                 mapreduce_parameters={'done_callback': '/_pc/workers/opensecrets/contribution_edges?run='+run},
+                                 queue_name=self.queue_name)
+
+
+class OpenSecretsWriteContributionEdges(CRPPipeline):
+
+    ''' Second stage of OpenSecretsLoadContributions: maps over ContributionTotals, writing edges for the ones touched by this run. Node influence is recomputed when it's done. '''
+
+    shard_count = 16
+
+    def run(self, run):
+
+        self.log.info('Writing contribution edges for run '+run+'.')
+
+        return control.start_map('OpenSecrets: Write Contribution Edges',
+                                 'momentum.fatcatmap.mappers.contributions.write_contribution_edge',
+                                 'mapreduce.input_readers.DatastoreInputReader',
+                                 {'entity_kind': 'momentum.fatcatmap.models.opensecrets.ContributionTotal', 'run': run},
+                                 shard_count=self.shard_count,
+                                 mapreduce_parameters={'done_callback': '/_pc/workers/graph/influence?run='+run},
+                                 queue_name=self.queue_name)
@@ -0,0 +1,57 @@
+import time
+
+from mapreduce import control
+
+from momentum.fatcatmap.pipelines import FCMPipeline
+from momentum.fatcatmap.core.search.index import sweep_terms
+from momentum.fatcatmap.core.search.index import compact_terms
+
+
+class RebuildSearchIndex(FCMPipeline):
+
+    ''' Rebuilds the whole search index: starts the posting mapper over every Native, whose done callback kicks off CompactSearchIndex for the same generation. '''
+
+    queue_name = 'graph-worker'
+    shard_count = 8
+
+    def run(self, generation=None):
+
+        if generation is None:
+            generation = int(time.time())
+
+        self.log.info('Rebuilding search index (generation '+str(generation)+').')
+
+        return control.start_map('Search: Rebuild Index',
+                                 'momentum.fatcatmap.mappers.search.index_native',
+                                 'mapreduce.input_readers.DatastoreInputReader',
+                                 {'entity_kind': 'momentum.fatcatmap.models.graph.Native'},
+                                 shard_count=self.shard_count,
+                                 mapreduce_parameters={'generation': generation, 'done_callback': '/_pc/workers/search/compact?generation='+str(generation)},
+                                 queue_name=self.queue_name)
+
+
+class CompactSearchIndex(FCMPipeline):
+
+    ''' Folds SearchPostings into per-term posting lists, one batch of terms per stage, then sweeps terms left over from older generations. '''
+
+    queue_name = 'graph-worker'
+
+    def run(self, generation, start=None):
+
+        position = compact_terms(generation, start)
+        if position is not None:
+            yield CompactSearchIndex(generation, position)
+        else:
+            self.log.info('Search index compaction complete for generation '+str(generation)+'.')
+            yield SweepSearchTerms(generation)
+
+
+class SweepSearchTerms(FCMPipeline):
+
+    queue_name = 'graph-worker'
+
+    def run(self, generation, cursor=None):
+
+        cursor = sweep_terms(generation, cursor)
+        if cursor is not None:
+            yield SweepSearchTerms(generation, cursor)
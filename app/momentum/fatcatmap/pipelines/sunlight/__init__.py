@@ -1,5 +1,7 @@
 import sunlightapi
 from momentum.fatcatmap.pipelines import FCMPipeline
+from momentum.fatcatmap.core.services.fetch import AsyncServiceClient
+from momentum.fatcatmap.core.services.caching import response_cache
 
 sunlight_object = None
 
@@ -8,6 +10,7 @@ class SunlightPipeline(FCMPipeline):
 
     service = 'sunlight'
     sunlight = None
+    sunlight_async = None
     queue_name = 'sunlight-worker'
 
     def pre_execute(self):
@@ -15,5 +18,7 @@ class SunlightPipeline(FCMPipeline):
         global sunlight_object
         if sunlight_object is None:
             sunlight_object = sunlightapi.sunlight
-            sunlight_object.apikey = self.service['keys'][0].value
-        self.sunlight = sunlight_object
\ No newline at end of file
+            sunlight_object.key_pool = self.service['pool']
+            sunlight_object.cache = response_cache
+        self.sunlight = sunlight_object
+        self.sunlight_async = AsyncServiceClient('sunlight', sunlight_object)
\ No newline at end of file
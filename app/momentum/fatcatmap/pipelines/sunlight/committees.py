@@ -4,9 +4,20 @@ import sunlightapi
 from google.appengine.ext import db
 
 from momentum.fatcatmap.models.graph import Node
+from pipeline import common
+
+from momentum.fatcatmap.core.geo import geography
+from momentum.fatcatmap.core.graph.extids import resolve_ext_ids
+from momentum.fatcatmap.core.graph.sync import SyncReport
+from momentum.fatcatmap.core.graph.sync import fingerprint
+from momentum.fatcatmap.core.graph.sync import diff_records
+from momentum.fatcatmap.core.graph.sync import update_nodes
+from momentum.fatcatmap.core.graph.sync import record_syncs
 from momentum.fatcatmap.pipelines.graph import Edge
 from momentum.fatcatmap.pipelines.graph import NodeGroup
 from momentum.fatcatmap.pipelines.graph import NodeExtID
+from momentum.fatcatmap.pipelines.graph import NodeSyncRecord
+from momentum.fatcatmap.pipelines.graph import SyncReportMerge
 from momentum.fatcatmap.pipelines.sunlight import SunlightPipeline
 from momentum.fatcatmap.pipelines.sunlight.legislators import SunlightLegislator
 
@@ -22,10 +33,13 @@ from momentum.fatcatmap.models.politics import LowerChamberCommittee
 
 class SunlightCommitteeMembership(SunlightPipeline):
 
-	def run(self, group, committee, member):
+	def run(self, group, committee, member, legislator=None):
 
-		if 'crp_id' in member:
-			legislator = Node.get_by_ext_id('crp_id', member['crp_id'])
+		## Members are normally resolved in batch by SunlightCommittee - fall back to a single lookup
+		if legislator is None and member.get('crp_id', '') != '':
+			legislator = Node.get_by_ext_id('opensecrets', member['crp_id'])
+			if legislator is not None:
+				legislator = str(legislator.key())
 
 		if legislator is None:
 			legislator = yield SunlightLegislator(object=member)
@@ -36,28 +50,57 @@ class SunlightCommitteeMembership(SunlightPipeline):
 			yield Edge('sunlight_committee_membership', [group, legislator], legislator=legislator, group=group)
 
 
+def committee_record(committee):
+
+	''' Converts a sunlightapi.Committee into a plain dict, with its subcommittees (recursively) and members as dicts too. '''
+
+	record = dict(committee.__dict__)
+	record['subcommittees'] = [committee_record(subcommittee) for subcommittee in record.get('subcommittees', [])]
+	record['members'] = [member.__dict__ for member in record.get('members', [])]
+	return record
+
+
+def committee_member_id(member):
+
+	''' ID a committee member is tracked by in its committee's SyncRecord. '''
+
+	return member.get('bioguide_id', '') or member.get('crp_id', '')
+
+
 class SunlightCommittee(SunlightPipeline):
 
-	def run(self, id=None, object=None):
+	def run(self, id=None, object=None, sync=None):
 
 		logging.info('Running sunlight committee')
 
 		if object is None:
-			object = self.cache.get('sunlight-committee-'+str(id))
-			if object is None:
-				object = self.sunlight.committees.get(id)
-				self.cache.set('sunlight-committee-'+str(id), object)
 
-			committee = object.__dict__
+			## Responses are cached by the client (see core.services.caching)
+			object = self.sunlight.committees.get(id)
+			committee = committee_record(object)
 
 			self.log.info('COMMITTEE OBJECT: '+str(object.__dict__))
 
 		else:
 			committee = object
 
+		## Diff stage: SunlightCommittees diffs top-level committees in batch, anything else is diffed here
+		if sync is None:
+			sync = diff_records('sunlight', 'committee', [(committee['id'], fingerprint(committee))], id_service='uscongress')[0]
+
+		report = SyncReport()
+		if sync['status'] == 'unchanged':
+			self.log.info('Committee '+str(committee['id'])+' is unchanged, skipping.')
+			report.unchanged = 1
+			yield common.Return(report.to_dict())
+			return
+
+		members = committee.get('members', [])
+		member_ids = [committee_member_id(member) for member in members if committee_member_id(member) != '']
+
 		congress = db.Key.from_path('Legislature', 'us_congress')
-		us_senate = db.Key.from_path('LegislativeChamber', 'us_senate', parent=congress)
-		us_house = db.Key.from_path('LegislativeChamber', 'us_house_of_reps', parent=congress)
+		us_senate = geography.chamber('us_congress', 'us_senate')
+		us_house = geography.chamber('us_congress', 'us_house_of_reps')
 
 		## Resolve impl class
 		if committee['chamber'].lower() == 'joint':
@@ -72,6 +115,13 @@ class SunlightCommittee(SunlightPipeline):
 			committee['type'] = 'lower_chamber_legislative_committee'
 			committee['chamber'] = us_house
 
+		else:
+			raise db.BadValueError('Unknown chamber "'+str(committee['chamber'])+'" for committee '+str(committee['id'])+'.')
+
+		## A committee saved without its chamber would never be repaired by later syncs - fail (and retry) instead
+		if committee['chamber'] is None or (isinstance(committee['chamber'], list) and None in committee['chamber']):
+			raise db.BadArgumentError('Cannot resolve chamber for committee '+str(committee['id'])+': US Congress chambers are missing.')
+
 		## Set properties
 		committee['code'] = committee['id']
 		committee['legislature'] = congress
@@ -79,25 +129,86 @@ class SunlightCommittee(SunlightPipeline):
 		## Calculate node label
 		label = committee['name']
 
-		node = yield self.createNode(label, committee)
-		with self.pipeline.After(node):
-			if 'id' in committee: yield NodeExtID(node, 'uscongress', 'jpsr_id', committee['id'])
+		subcommittee_reports = []
+
+		if sync['status'] == 'changed':
+
+			## Existing committee: write only the fields that changed, then sync new members
+			update_nodes([(sync['node'], sync['native'], label, self.committee_object(committee, sync['fingerprint']))], report)
+			report.updated = 1
+
+			## Memberships aren't deleted - members who left are only counted
+			report.removed = len([member_id for member_id in sync['related'] if member_id not in member_ids])
+			members = [member for member in members if committee_member_id(member) not in sync['related']]
+
+			children = []
+			for subcommittee in committee.get('subcommittees', []):
+				subcommittee_report = yield SunlightCommittee(object=subcommittee)
+				subcommittee_reports.append(subcommittee_report)
+				children.append(subcommittee_report)
+
+			for membership in self.memberships(sync['node'], sync['native'], members):
+				membership = yield membership
+				children.append(membership)
+
+			## The sync is only recorded once every child has finished, so a failed membership is retried next sync
+			if len(children) > 0:
+				with self.pipeline.After(*children):
+					yield NodeSyncRecord(sync['node'], 'sunlight', 'committee', sync['id'], sync['fingerprint'], member_ids)
+			else:
+				record_syncs('sunlight', 'committee', [(sync['id'], sync['fingerprint'], sync['node'], sync['native'], member_ids)])
+
+		else:
+
+			node = yield self.createNode(label, committee, sync['fingerprint'])
+			report.created = 1
+
+			children = [node]
+			with self.pipeline.After(node):
+				if 'id' in committee:
+					ext_id = yield NodeExtID(node, 'uscongress', 'jpsr_id', committee['id'])
+					children.append(ext_id)
+
+			with self.pipeline.After(node):
+				if 'subcommittees' in committee and len(committee['subcommittees']) > 0:
+					for subcommittee in committee['subcommittees']:
+						self.log.info('Yielding pipeline for subcommittee "'+str(subcommittee)+'".')
+						#subcommittee['parent_committee'] = node
+						subcommittee_report = yield SunlightCommittee(object=subcommittee)
+						subcommittee_reports.append(subcommittee_report)
+						children.append(subcommittee_report)
+
+			with self.pipeline.After(node):
+				for membership in self.memberships(node, node.native, members):
+					membership = yield membership
+					children.append(membership)
+
+			## Recorded last, after the node, its ext ID, subcommittees and memberships are all in place
+			with self.pipeline.After(*children):
+				yield NodeSyncRecord(node, 'sunlight', 'committee', sync['id'], sync['fingerprint'], member_ids)
+
+		yield SyncReportMerge('committee '+str(committee['id']), report.to_dict(), *subcommittee_reports)
 
-		with self.pipeline.After(node):
-			if 'subcommittees' in committee and len(committee['subcommittees']) > 0:
-				for subcommittee in committee['subcommittees']:
-					self.log.info('Yielding pipeline for subcommittee "'+str(subcommittee)+'".')
-					#subcommittee['parent_committee'] = node
-					yield SunlightCommittee(object=subcommittee)
 
-		with self.pipeline.After(node):
-			if 'members' in committee and len(committee['members']) > 0:
-				for member in committee['members']:
-					self.log.info('Creating membership for member "'+str(member)+'".')
-					yield SunlightCommitteeMembership(node, node.native, member)
+	def memberships(self, group, committee, members):
 
+		''' Membership pipelines for a list of committee members, resolving every member by CRP ID with one batch get of the ext ID index. '''
 
-	def createNode(self, label, object):
+		crp_ids = [member['crp_id'] for member in members if member.get('crp_id', '') != '']
+		resolved = resolve_ext_ids('opensecrets', crp_ids)
+
+		pipelines = []
+		for member in members:
+			self.log.info('Creating membership for member "'+str(member)+'".')
+			legislator = resolved.get(member.get('crp_id', ''))
+			if legislator is not None:
+				legislator = str(legislator)
+			pipelines.append(SunlightCommitteeMembership(group, committee, member, legislator))
+
+		return pipelines
+
+
+	def committee_object(self, object, fingerprint=None):
 
 		committee_object = {
 
@@ -108,6 +219,16 @@ class SunlightCommittee(SunlightPipeline):
 
 		}
 
+		if fingerprint is not None:
+			committee_object['fingerprint'] = fingerprint
+
+		return committee_object
+
+
+	def createNode(self, label, object, fingerprint=None):
+
+		committee_object = self.committee_object(object, fingerprint)
+
 		self.log.info('Creating node for committee ID '+str(committee_object['code']))
 
 		return NodeGroup(object['type'], label, committee_object)
@@ -117,14 +238,36 @@ class SunlightCommittees(SunlightPipeline):
 
 	def run(self, chamber):
 
-		## Get Legislators
-		for committee in self.sunlight.committees.getList(chamber):
-			logging.info('Yielding pipeline for sunlight committee '+str(committee))
+		committees = self.sunlight.committees.getList(chamber)
+
+		## Fetch every committee's full record (with members) concurrently
+		futures = self.sunlight_async.get_many([('committees.get', {'id': committee.id}) for committee in committees])
+
+		full_records = []
+		for committee, future in zip(committees, futures):
+
+			try:
+				committee = sunlightapi.Committee(future.get_result()['committee'])
+			except Exception, e:
+				## A partial record would look like a change (every member gone) - leave this one for the next sync
+				self.log.warning('Could not fetch full record for committee '+str(committee)+' ('+str(e)+'), skipping it this sync.')
+				continue
+
+			full_records.append(committee_record(committee))
+
+		## Diff stage: one batch get of SyncRecords for every committee, skipping the unchanged ones
+		changes = diff_records('sunlight', 'committee', [(committee['id'], fingerprint(committee)) for committee in full_records], id_service='uscongress')
+
+		report = SyncReport()
+		reports = []
+		for committee, change in zip(full_records, changes):
+
+			if change['status'] == 'unchanged':
+				report.unchanged += 1
+				continue
 
-			committee = committee.__dict__
-			subcommittees = []
-			for item in committee['subcommittees']:
-				subcommittees.append(item.__dict__)
-			committee['subcommittees'] = subcommittees
+			logging.info('Yielding pipeline for sunlight committee '+str(committee['id']))
+			committee_report = yield SunlightCommittee(object=committee, sync=change)
+			reports.append(committee_report)
 
-			yield SunlightCommittee(object=committee)
\ No newline at end of file
+		yield SyncReportMerge('committees ('+str(chamber)+')', report.to_dict(), *reports)
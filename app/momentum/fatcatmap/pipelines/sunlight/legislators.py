@@ -1,147 +1,152 @@
-import hashlib
 import logging
 import sunlightapi
 
 from google.appengine.ext import db
 from google.appengine.api import taskqueue
 
+from pipeline import common
+
+from momentum.fatcatmap.core.geo import geography
+from momentum.fatcatmap.core.graph.bulk import put_nodes
+from momentum.fatcatmap.core.graph.extids import put_ext_ids
+from momentum.fatcatmap.core.graph.sync import SyncReport
+from momentum.fatcatmap.core.graph.sync import fingerprint
+from momentum.fatcatmap.core.graph.sync import diff_records
+from momentum.fatcatmap.core.graph.sync import update_nodes
+from momentum.fatcatmap.core.graph.sync import record_syncs
+
 from momentum.fatcatmap.pipelines.graph import Node
-from momentum.fatcatmap.pipelines.graph import NodeExtID
+from momentum.fatcatmap.pipelines.graph import NodeExtIDs
+from momentum.fatcatmap.pipelines.graph import SyncReportMerge
 from momentum.fatcatmap.pipelines.sunlight import SunlightPipeline
 
 from momentum.fatcatmap.pipelines.opensecrets.contributions import OpenSecretsContributorsSummary
 
 from momentum.fatcatmap.models.geo import USState
-from momentum.fatcatmap.models.geo import District
-from momentum.fatcatmap.models.politics import LegislativeChamber
 from momentum.fatcatmap.models.politics import UpperChamberDistrict
 from momentum.fatcatmap.models.politics import LowerChamberDistrict
 
+## (service, id name) pairs for the external IDs carried on a Sunlight legislator
+_LEGISLATOR_EXT_IDS = [
 
-class SunlightLegislator(SunlightPipeline):
+    ('bioguide', 'bioguide_id'),
+    ('votesmart', 'votesmart_id'),
+    ('fec', 'fec_id'),
+    ('govtrack', 'govtrack_id'),
+    ('eventful', 'eventful_id'),
+    ('congresspedia', 'congresspedia_url'),
+    ('twitter', 'twitter_id'),
+    ('youtube', 'youtube_id'),
+    ('opensecrets', 'crp_id')
 
-    def run(self, object=None, **kwargs):
+]
 
-        if object is None:
+_LEGISLATOR_EXT_ID_NAMES = dict(_LEGISLATOR_EXT_IDS)
 
-            md5_kwargs = hashlib.md5()
-            md5_kwargs.update(str(kwargs))
-            cache_key = 'sunlight-legislator-'+md5_kwargs.hexdigest()
-            object = self.cache.get(cache_key)
 
-            if object is None:
-                object = self.sunlight.legislators.get(**kwargs)
-                self.cache.set(cache_key, object)
+def legislator_ext_ids(legislator):
 
-            legislator = object.__dict__
+    ''' Returns a dict of service => value for the external IDs present on a Sunlight legislator record. '''
 
-        else:
-            legislator = object
+    return dict([(service, legislator[name]) for service, name in _LEGISLATOR_EXT_IDS if legislator.get(name, '') != ''])
+
+
+def legislator_label(legislator):
 
-        state = db.Key.from_path('USState', legislator['state'].upper())
-        congress = db.Key.from_path('Legislature', 'us_congress')
+    ''' Node label for a legislator whose party and state have been resolved to keys, e.g. "Sen. Barbara Boxer (D-CA)". '''
 
-        ## If we're adding a Senator...
-        if legislator['chamber'].lower() == 'senate':
+    return legislator['title']+'. '+legislator['firstname']+' '+legislator['lastname']+' ('+legislator['party'].name()+'-'+legislator['state'].name()+')'
 
-            ## Pull leg house and try to pull district
-            legislative_house = self.cache.get('legislative-chamber-us-senate')
-            if legislative_house is None:
-                legislative_house = LegislativeChamber.get_by_key_name('us_senate', parent=congress)
-                self.cache.set('legislative-chamber-us-senate', legislative_house)
 
-            seniority = legislator['district'].lower().split(' ')[0]
+def legislator_native_kwargs(object):
 
-            cache_key = 'legislative-district-'+str(legislative_house.key())+'-'+legislator['state']+'-'+seniority[0].upper()
-            district = self.cache.get(cache_key)
-            if district is None:
-                district = District.get_by_key_name(legislator['state']+'-'+seniority[0].upper(), parent=legislative_house)
+    ''' Maps a Sunlight legislator record onto Legislator native properties. '''
 
-                ## Create district if it doesn't exist...
-                if district is None:
-                    district = UpperChamberDistrict(legislative_house, key_name=legislator['state']+'-'+seniority[0].upper())
-                    district.house = legislative_house
-                    district.state = state
-                    district.put()
+    ## Person.gender only accepts 'm' or 'f'
+    gender = (object.get('gender', None) or '').lower()
+    if gender not in ['m', 'f']:
+        gender = None
 
-                self.cache.set(cache_key, district)
+    return {
 
-            ## Inject 'seniority' param to legislator Native object...
-            legislator['seniority'] = seniority
+        'party':object.get('party', None),
+        'house':object.get('house', None),
+        'district':object.get('district', None),
+        'first_name':object.get('firstname', None),
+        'middle_name':object.get('middlename', None),
+        'last_name':object.get('lastname', None),
+        'name_suffix':object.get('name_suffix', None),
+        'nickname':object.get('nickname', None),
+        'gender':gender,
+        'office_phone':object.get('phone', None),
+        'office_fax':object.get('fax', None),
+        'office_address':object.get('congress_address', None),
+        'official_website':object.get('website', None),
+        'official_webform':object.get('webform', None),
+        'official_email':object.get('email', None)
 
+    }
 
-        ## If we're adding a Congressperson..
-        elif legislator['chamber'].lower() == 'house':
 
-            ## Pull leg house and try to pull district
-            legislative_house = self.cache.get('legislative-chamber-us-house-of-reps')
-            if legislative_house is None:
-                legislative_house = LegislativeChamber.get_by_key_name('us_house_of_reps', parent=congress)
-                self.cache.set('legislative-chamber-us-house-of-reps', legislative_house)
+def resolve_legislator_seat(legislator):
 
+    '''
 
-            cache_key = 'legislative-district-'+str(legislative_house.key())+'-'+legislator['state']+'-'+legislator['district']
-            district = self.cache.get(cache_key)
-            if district is None:
-                district = District.get_by_key_name(legislator['state']+'-'+legislator['district'], parent=legislative_house)
+    Resolves state, party, chamber and district onto a Sunlight legislator record as
+    keys, using the geography resolver (no RPCs once it's loaded). Districts that
+    don't exist yet are queued with it - call geography.create_missing() afterwards.
 
-                ## Create district if it doesn't exist...
-                if district is None:
-                    district = LowerChamberDistrict(legislative_house, key_name=legislator['state']+'-'+legislator['district'], number=int(legislator['district']), house=legislative_house)
-                    district.chamber = legislative_house
-                    district.state = state
-                    district.number = int(legislator['district'])
-                    district.put()
+    '''
 
-                self.cache.set(cache_key, district)
+    state = geography.state(legislator['state']) or db.Key.from_path(USState.kind(), legislator['state'].upper())
 
-        ## Set references
-        legislator['state'] = state
-        legislator['district'] = district.key()
-        legislator['house'] = legislative_house.key()
-        legislator['party'] = db.Key.from_path('PoliticalParty', legislator['party'].upper())
+    if legislator['chamber'].lower() == 'senate':
+        chamber = geography.chamber('us_congress', 'us_senate')
+        seniority = legislator['district'].lower().split(' ')[0]
+        legislator['seniority'] = seniority
+        district = geography.district(chamber, legislator['state']+'-'+seniority[0].upper(), lambda key: UpperChamberDistrict(key=key, state=state, chamber=chamber))
+
+    else:
+        chamber = geography.chamber('us_congress', 'us_house_of_reps')
+        number = int(legislator['district'])
+        district = geography.district(chamber, legislator['state']+'-'+legislator['district'], lambda key: LowerChamberDistrict(key=key, state=state, chamber=chamber, number=number))
+
+    legislator['state'] = state
+    legislator['house'] = chamber
+    legislator['district'] = district
+    legislator['party'] = db.Key.from_path('PoliticalParty', legislator['party'].upper())
+
+    return legislator
+
+
+class SunlightLegislator(SunlightPipeline):
+
+    def run(self, object=None, **kwargs):
+
+        if object is None:
+
+            ## Responses are cached by the client (see core.services.caching)
+            legislator = self.sunlight.legislators.get(**kwargs).__dict__
+
+        else:
+            legislator = object
+
+        ## Chamber and district keys come from the instance's geography resolver
+        resolve_legislator_seat(legislator)
+        geography.create_missing()
 
         ## Calculate node label
-        label = legislator['title']+'. '+legislator['firstname']+' '+legislator['lastname']+' ('+legislator['party'].name()+'-'+legislator['state'].name()+')'
+        label = legislator_label(legislator)
 
         node = yield self.createNode(label, legislator)
         with self.pipeline.After(node):
-            if 'bioguide_id' in legislator and legislator['bioguide_id'] != '': yield NodeExtID(node, 'bioguide', 'bioguide_id', legislator['bioguide_id'])
-            if 'votesmart_id' in legislator and legislator['votesmart_id'] != '': yield NodeExtID(node, 'votesmart', 'votesmart_id', legislator['votesmart_id'])
-            if 'fec_id' in legislator and legislator['fec_id'] != '': yield NodeExtID(node, 'fec', 'fec_id', legislator['fec_id'])
-            if 'govtrack_id' in legislator and legislator['govtrack_id'] != '': yield NodeExtID(node, 'govtrack', 'govtrack_id', legislator['govtrack_id'])
-            if 'eventful_id' in legislator and legislator['eventful_id'] != '': yield NodeExtID(node, 'eventful', 'eventful_id', legislator['eventful_id'])
-            if 'congresspedia_url' in legislator and legislator['congresspedia_url'] != '': yield NodeExtID(node, 'congresspedia', 'congresspedia_url', legislator['congresspedia_url'])
-            if 'twitter_id' in legislator and legislator['twitter_id'] != '': yield NodeExtID(node, 'twitter', 'twitter_id', legislator['twitter_id'])
-            if 'youtube_id' in legislator and legislator['youtube_id'] != '': yield NodeExtID(node, 'youtube', 'youtube_id', legislator['youtube_id'])
+            yield NodeExtIDs(node, legislator_ext_ids(legislator), _LEGISLATOR_EXT_ID_NAMES)
             if 'crp_id' in legislator and legislator['crp_id'] != '':
-                yield NodeExtID(node, 'opensecrets', 'crp_id', legislator['crp_id'])
                 yield OpenSecretsContributorsSummary(node, legislator['crp_id'])
 
 
     def createNode(self, label, object):
-
-        legislator_object = {
-
-            'party':object.get('party', None),
-            'house':object.get('house', None),
-            'district':object.get('district', None),
-            'first_name':object.get('firstname', None),
-            'middle_name':object.get('middlename', None),
-            'last_name':object.get('lastname', None),
-            'name_suffix':object.get('name_suffix', None),
-            'nickname':object.get('nickname', None),
-            'gender':object.get('gender', 'u').lower(),
-            'office_phone':object.get('phone', None),
-            'office_fax':object.get('fax', None),
-            'office_address':object.get('congress_address', None),
-            'official_website':object.get('website', None),
-            'official_webform':object.get('webform', None),
-            'official_email':object.get('email', None)
-
-        }
-
-        return Node('legislator', label, legislator_object)
+        return Node('legislator', label, legislator_native_kwargs(object))
 
 
 class SunlightLegislatorsByState(SunlightPipeline):
@@ -151,13 +156,7 @@ class SunlightLegislatorsByState(SunlightPipeline):
         legislators = self.sunlight.legislators.getList(state=state)
 
         for legislator in legislators:
-
-            leg_cfg = {'crp_id':legislator.__dict__['crp_id']}
-            md5_hash = hashlib.md5()
-            md5_hash.update(str(leg_cfg))
-
-            self.cache.set('sunlight-legislator-'+md5_hash.hexdigest(), legislator)
-            yield SunlightLegislator(crp_id=legislator.__dict__['crp_id'])
+            yield SunlightLegislator(object=legislator.__dict__)
 
 
 class SunlightLegislators(SunlightPipeline):
@@ -165,20 +164,113 @@ class SunlightLegislators(SunlightPipeline):
     def run(self, **kwargs):
 
         if len(kwargs) == 0:
-            states = USState.all().fetch(50)
-            for state in states:
-                yield SunlightLegislatorsByState(state.key().name())
+            geography.check()
+            for state in sorted(geography.states.keys()):
+                yield SunlightLegislatorsByState(state)
         else:
 
             ## Get Legislators
             legislators = self.sunlight.legislators.getList(**kwargs)
 
             for legislator in legislators:
+                yield SunlightLegislator(object=legislator.__dict__)
+
+
+class SunlightLegislatorsBulk(SunlightPipeline):
+
+    ''' Bulk import (and nightly re-sync): fetches the legislator list with a single getList() call and fans out one SunlightLegislatorsChunk per chunk of legislators, rather than a pipeline tree per person. Returns the merged sync report. '''
 
-                ## Cache legislator
-                leg_cfg = {'crp_id':legislator.__dict__['crp_id']}
-                md5_hash = hashlib.md5()
-                md5_hash.update(str(leg_cfg))
+    chunk_size = 100
+
+    def run(self, chunk_size=None, **kwargs):
+
+        if chunk_size is None:
+            chunk_size = self.chunk_size
+
+        legislators = [legislator.__dict__ for legislator in self.sunlight.legislators.getList(**kwargs)]
+
+        self.log.info('Bulk syncing '+str(len(legislators))+' legislators in chunks of '+str(chunk_size)+'.')
+
+        chunks = []
+        for offset in xrange(0, len(legislators), chunk_size):
+            chunk = yield SunlightLegislatorsChunk(legislators[offset:offset+chunk_size])
+            chunks.append(chunk)
+
+        yield SyncReportMerge('legislators', *chunks)
+
+
+class SunlightLegislatorsChunk(SunlightPipeline):
+
+    '''
+
+    Syncs a chunk of legislator records in a handful of batched RPCs.
+
+    Each record is fingerprinted and diffed against its SyncRecord first (one batch
+    get), and unchanged records are skipped outright. For the rest: one get for the
+    chambers, one get (and at most one put) for their districts; new legislators get
+    nodes and natives with one put, while changed ones have only their differing
+    fields written. External IDs and SyncRecords are then written for both. Returns
+    a sync report (see core.graph.sync).
+
+    '''
+
+    def run(self, legislators):
+
+        report = SyncReport()
+
+        ## Diff stage: fingerprint the upstream records before any keys are resolved onto them
+        changes = diff_records('sunlight', 'legislator', [(legislator['bioguide_id'], fingerprint(legislator)) for legislator in legislators], id_service='bioguide')
+
+        pending = [(legislator, change) for legislator, change in zip(legislators, changes) if change['status'] != 'unchanged']
+        report.unchanged = len(legislators)-len(pending)
+
+        if len(pending) == 0:
+            self.log.info('No changes in chunk of '+str(len(legislators))+' legislators.')
+            return report.to_dict()
+
+        self.resolve_districts([legislator for legislator, change in pending])
+
+        created = [(legislator, change) for legislator, change in pending if change['status'] == 'new']
+        updated = [(legislator, change) for legislator, change in pending if change['status'] == 'changed']
+
+        synced = []
+
+        ## New legislators: nodes and natives
+        if len(created) > 0:
+            results = put_nodes([('legislator', legislator_label(legislator), self.native_kwargs(legislator, change)) for legislator, change in created])
+            for (legislator, change), (node_key, native_key) in zip(created, results):
+                synced.append((legislator, change, node_key, native_key))
+
+        ## Changed legislators: only differing fields are written
+        if len(updated) > 0:
+            update_nodes([(change['node'], change['native'], legislator_label(legislator), self.native_kwargs(legislator, change)) for legislator, change in updated], report)
+            for legislator, change in updated:
+                synced.append((legislator, change, change['node'], change['native']))
+
+        ## External IDs and their reverse index
+        ext_id_count = put_ext_ids([(db.Key(str(node_key)), legislator_ext_ids(legislator)) for legislator, change, node_key, native_key in synced], _LEGISLATOR_EXT_ID_NAMES)
+
+        record_syncs('sunlight', 'legislator', [(change['id'], change['fingerprint'], node_key, native_key, None) for legislator, change, node_key, native_key in synced])
+
+        report.created = len(created)
+        report.updated = len(updated)
+
+        self.log.info('Synced chunk of '+str(len(legislators))+' legislators ('+str(ext_id_count)+' external IDs): '+report.summary())
+
+        return report.to_dict()
+
+    def native_kwargs(self, legislator, change):
+        native_kwargs = legislator_native_kwargs(legislator)
+        native_kwargs['fingerprint'] = change['fingerprint']
+        return native_kwargs
+
+    def resolve_districts(self, legislators):
+
+        ''' Resolves each legislator's seat to keys, then creates whichever districts don't exist yet in one batched write. '''
+
+        for legislator in legislators:
+            resolve_legislator_seat(legislator)
 
-                self.cache.set('sunlight-legislator-'+md5_hash.hexdigest(), legislator)
-                yield SunlightLegislator(crp_id=legislator.__dict__['crp_id'])
\ No newline at end of file
+        created = geography.create_missing()
+        if created > 0:
+            self.log.info('Created '+str(created)+' districts.')
@@ -37,6 +37,15 @@ def get_rules(app):
         ]),
 
 
+        ## Graph Export
+        HandlerPrefix('momentum.fatcatmap.handlers.graph.', [
+
+            Rule('/_pc/graph/export', endpoint='graph-export', handler='GraphExportHandler'),
+            Rule('/_pc/graph/export.<string:format>', endpoint='graph-export-format', handler='GraphExportHandler'),
+
+        ]),
+
+
         ## FatCatMap API Engine (codenamed Cheshire)
         HandlerPrefix('momentum.fatcatmap.handlers.api.', [
 
@@ -54,10 +63,12 @@ def get_rules(app):
         ]),
 
         ## Workers
-        HandlerPrefix('momentum.fatcatmap.handlers.workers.', [
+        HandlerPrefix('momentum.fatcatmap.workers.', [
 
             Rule('/_pc/workers/sunlight/<string:procedure>', endpoint='workers-sunlight', handler='sunlight.SunlightManager'),
-            Rule('/_pc/workers/opensecrets/<string:procedure>', endpoint='workers-opensecrets', handler='sunlight.OpenSecretsManager'),
+            Rule('/_pc/workers/opensecrets/<string:procedure>', endpoint='workers-opensecrets', handler='opensecrets.OpenSecretsManager'),
+            Rule('/_pc/workers/search/<string:procedure>', endpoint='workers-search', handler='search.SearchIndexWorker'),
+            Rule('/_pc/workers/graph/<string:procedure>', endpoint='workers-graph', handler='graph.GraphWorker'),
 
         ]),
 
@@ -0,0 +1,89 @@
+import time
+import logging
+import pipeline
+
+from google.appengine.ext import db
+
+from mapreduce.model import MapreduceState
+
+from momentum.fatcatmap.workers import FCMWorker
+from momentum.fatcatmap.models.graph import SuperEdge
+from momentum.fatcatmap.core.graph.pagerank import next_step
+from momentum.fatcatmap.pipelines.graph import PageRank
+from momentum.fatcatmap.pipelines.graph import PageRankWrite
+from momentum.fatcatmap.pipelines.graph import PageRankIteration
+from momentum.fatcatmap.pipelines.graph import PageRankRescoreSearch
+from momentum.fatcatmap.pipelines.graph import BuildGraphSnapshot
+from momentum.fatcatmap.pipelines.graph import ComputeInfluence
+
+## Minimum seconds between snapshot builds, however often the job is triggered
+_SNAPSHOT_INTERVAL = 3600
+
+## ...and between PageRank runs
+_PAGERANK_INTERVAL = 43200
+
+
+class GraphWorker(FCMWorker):
+
+    '''
+
+    Scheduled graph maintenance, and the done callbacks of its mappers:
+
+        snapshot            (cron) starts a BuildGraphSnapshot
+        pagerank_start      (cron) starts a PageRank run
+        pagerank            a PageRank pass finished: start the next iteration, or write scores
+        pagerank_search     node popularity is written: refresh the search index
+        influence           a bulk contribution load finished: recompute node influence
+        rollup              (scheduled by connect_edges) sum a SuperEdge's counter shards into its score
+
+    '''
+
+    def execute(self, procedure=None, **kwargs):
+
+        if procedure == 'snapshot':
+            return self.start_once(BuildGraphSnapshot(), 'graph-snapshot-'+str(int(time.time()) / _SNAPSHOT_INTERVAL))
+
+        if procedure == 'pagerank_start':
+            run = str(int(time.time()) / _PAGERANK_INTERVAL)
+            return self.start_once(PageRank(run), 'pagerank-'+run)
+
+        if procedure == 'rollup' and 'super_edge' in self.params:
+            ## The task is named per node pair and interval, so this runs once per interval (and a retry just sums again)
+            super_edge = SuperEdge.rollup(db.Key(self.params['super_edge']), [db.Key(node) for node in self.params['nodes'].split(',')])
+            logging.info('Rolled up SuperEdge '+str(super_edge.key())+': score '+str(super_edge.score)+'.')
+            return self.response('OK')
+
+        if procedure == 'influence' and 'run' in self.params:
+            return self.start_once(ComputeInfluence(self.params['run']), 'influence-'+self.params['run'])
+
+        if procedure in ['pagerank', 'pagerank_search'] and 'run' in self.params:
+
+            run, iteration = self.params['run'], int(self.params.get('iteration', 0))
+
+            state = MapreduceState.get_by_job_id(self.request.headers.get('Mapreduce-Id', ''))
+            if state is None or state.result_status != MapreduceState.RESULT_SUCCESS:
+                logging.error('PageRank run '+run+' stopped: pass '+str(iteration)+' did not succeed.')
+                return self.response('OK')
+
+            if procedure == 'pagerank_search':
+                return self.start_once(PageRankRescoreSearch(run), 'pagerank-search-'+run)
+
+            step, nodes, value = next_step(iteration, state.counters_map)
+            if step == 'write':
+                logging.info('PageRank run '+run+' finished after '+str(iteration)+' iterations (mean change '+str(value)+').')
+                return self.start_once(PageRankWrite(run, iteration), 'pagerank-write-'+run)
+
+            return self.start_once(PageRankIteration(run, iteration+1, nodes, value), 'pagerank-'+run+'-'+str(iteration+1))
+
+        return self.abort(404)
+
+    def start_once(self, job, idempotence_key):
+
+        ## Cron and callback tasks may be delivered twice - only ever start a job once
+        try:
+            job.start(idempotence_key=idempotence_key, queue_name=job.queue_name)
+            logging.info('Started '+job.__class__.__name__+' ('+idempotence_key+').')
+        except pipeline.PipelineExistsError:
+            logging.info(job.__class__.__name__+' already started ('+idempotence_key+').')
+
+        return self.response('OK')
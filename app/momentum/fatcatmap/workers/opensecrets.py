@@ -1,14 +1,44 @@
+import config
+import logging
+import pipeline
+
+from tipfy import cached_property
+
 from google.appengine.ext import db
 from google.appengine.api import channel
 from google.appengine.api import taskqueue
 
+from mapreduce.model import MapreduceState
+
 from momentum.fatcatmap.workers import FCMWorker
+from momentum.fatcatmap.pipelines.opensecrets.contributions import OpenSecretsWriteContributionEdges
 
 
 class OpenSecretsManager(FCMWorker):
 
-    def execute(self, **kwargs):
-        pass
+    def execute(self, procedure=None, **kwargs):
+
+        ## Done callback from the contribution combine mapper: start writing edges
+        if procedure == 'contribution_edges' and 'run' in self.params:
+
+            run = self.params['run']
+
+            state = MapreduceState.get_by_job_id(self.request.headers.get('Mapreduce-Id', ''))
+            if state is None or state.result_status != MapreduceState.RESULT_SUCCESS:
+                logging.error('Contribution load run '+run+' stopped: the combine mapper did not succeed.')
+                return self.response('OK')
+
+            logging.info('Contribution combine mapper finished, writing edges for run '+run+'.')
+
+            ## The callback task may be retried - only ever start one edge writer per run
+            try:
+                OpenSecretsWriteContributionEdges(run).start(idempotence_key='contribution-edges-'+run, queue_name=OpenSecretsWriteContributionEdges.queue_name)
+            except pipeline.PipelineExistsError:
+                logging.info('Contribution edges for run '+run+' already started.')
+
+            return self.response('OK')
+
+        return self.abort(404)
 
 
     @cached_property
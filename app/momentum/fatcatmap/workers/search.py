@@ -0,0 +1,26 @@
+import logging
+import pipeline
+
+from momentum.fatcatmap.workers import FCMWorker
+from momentum.fatcatmap.pipelines.search import CompactSearchIndex
+
+
+class SearchIndexWorker(FCMWorker):
+
+    ''' Receives the rebuild mapper's done callback and starts compaction. '''
+
+    def execute(self, procedure=None, **kwargs):
+
+        if procedure != 'compact' or 'generation' not in self.params:
+            return self.abort(404)
+
+        generation = int(self.params['generation'])
+        logging.info('Search posting mapper finished, compacting generation '+str(generation)+'.')
+
+        ## The callback task may be retried - only ever start one compaction per generation
+        try:
+            CompactSearchIndex(generation).start(idempotence_key='search-compact-'+str(generation), queue_name=CompactSearchIndex.queue_name)
+        except pipeline.PipelineExistsError:
+            logging.info('Compaction for generation '+str(generation)+' already started.')
+
+        return self.response('OK')
@@ -14,6 +14,7 @@ from google.appengine.api import taskqueue
 
 from momentum.fatcatmap.workers import FCMWorker
 from momentum.fatcatmap.handlers import FCMRequestHandler
+from momentum.fatcatmap.core.services.caching import response_cache
 
 from momentum.fatcatmap.models.system import TemporaryText
 
@@ -33,6 +34,7 @@ class SunlightWorker(FCMWorker):
         if sunlight_client is None:
             sunlight_client = sunlight
             sunlight_client.apikey = self.serviceConfig['api_key']
+            sunlight_client.cache = response_cache
             return sunlight_client
         else:
             return sunlight_client